@@ -1,18 +1,25 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Leave, Attendance, Payroll
+from models import User, Leave, Payroll
 from app import db
-from datetime import datetime
 from werkzeug.security import generate_password_hash
 from api import api_bp
+from sqlalchemy.orm.exc import StaleDataError
+from utils import (get_current_principal, invalidate_principal, forget_principals, paginate_query, versioned_response,
+                   if_match_fails, precondition_failed)
+from serializers import serialize, serialize_all, parse_fields, select_fields
+from cache import summary_cache
+from rollups import move_department_rollups
+from api.dashboard import user_summary, attendance_summary, pending_leaves_summary
+from user_provisioning import read_user_records, provision_users, bulk_update_users
+import io
 import logging
 
 @api_bp.route('/admin/users', methods=['GET'])
 @jwt_required()
 def get_all_users():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -21,8 +28,6 @@ def get_all_users():
         department = request.args.get('department')
         role = request.args.get('role')
         is_active = request.args.get('is_active')
-        page = max(1, int(request.args.get('page', 1)))
-        per_page = max(1, min(100, int(request.args.get('per_page', 10))))
         
         # Build query
         query = User.query
@@ -37,16 +42,16 @@ def get_all_users():
             query = query.filter_by(is_active=is_active.lower() == 'true')
         
         # Get paginated results
-        users = query.order_by(User.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(User, request.args)
+            query = select_fields(query, User, fields, keep=[User.created_at])
+            users = paginate_query(query, [User.created_at, User.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'users': [user.to_dict() for user in users.items],
-            'total': users.total,
-            'pages': users.pages,
-            'current_page': page,
-            'per_page': per_page
+            'users': serialize_all(User, users.items, fields),
+            **users.meta()
         }), 200
     
     except Exception as e:
@@ -57,8 +62,7 @@ def get_all_users():
 @jwt_required()
 def create_user():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -66,7 +70,7 @@ def create_user():
         data = request.get_json()
         if not data:
             return jsonify({'error': 'Request body must be valid JSON'}), 400
-            
+        
         required_fields = ['username', 'email', 'password', 'first_name', 'last_name', 'employee_id']
         
         for field in required_fields:
@@ -98,6 +102,7 @@ def create_user():
         
         db.session.add(new_user)
         db.session.commit()
+        summary_cache.invalidate('users')
         
         return jsonify(new_user.to_dict()), 201
     
@@ -105,21 +110,99 @@ def create_user():
         logging.error(f"Create user error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@api_bp.route('/admin/users/bulk', methods=['POST'])
+@jwt_required()
+def bulk_create_users():
+    try:
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        # NDJSON or CSV, as a multipart file or the raw request body
+        if 'file' in request.files:
+            upload = request.files['file']
+            fmt = 'csv' if upload.filename.lower().endswith('.csv') else 'ndjson'
+            stream = upload.stream
+        elif request.mimetype == 'text/csv':
+            fmt, stream = 'csv', request.stream
+        elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            fmt, stream = 'ndjson', request.stream
+        else:
+            return jsonify({'error': 'Send NDJSON or CSV, as a "file" upload or the request body'}), 400
+        
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+        try:
+            report = provision_users(read_user_records(text, fmt))
+        except UnicodeDecodeError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if report['created']:
+            summary_cache.invalidate('users')
+        logging.info(f"Bulk user creation by {user.employee_id}: {report['created']} created")
+        
+        return jsonify(report), 200
+    
+    except Exception as e:
+        logging.error(f"Bulk create users error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/admin/users/bulk', methods=['PATCH'])
+@jwt_required()
+def bulk_update_users_view():
+    try:
+        current_user_id = int(get_jwt_identity())
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Request body must be valid JSON'}), 400
+        
+        user_ids = data.get('user_ids')
+        if not isinstance(user_ids, list) or not user_ids or \
+                not all(isinstance(user_id, int) for user_id in user_ids):
+            return jsonify({'error': 'user_ids must be a non-empty list of user IDs'}), 400
+        
+        changes = data.get('changes') or {}
+        if current_user_id in user_ids and ('role' in changes or 'is_active' in changes):
+            return jsonify({'error': 'Cannot change your own role or status'}), 400
+        
+        try:
+            updated = bulk_update_users(user_ids, changes)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        summary_cache.invalidate('users')
+        logging.info(f"Bulk user update by {user.employee_id}: {updated} users, fields {sorted(changes)}")
+        
+        return jsonify({'updated': updated}), 200
+    
+    except Exception as e:
+        logging.error(f"Bulk update users error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @api_bp.route('/admin/users/<int:user_id>', methods=['GET'])
 @jwt_required()
 def get_user_by_id(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
-        target_user = User.query.get(user_id)
+        try:
+            fields = parse_fields(User, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        target_user = select_fields(User.query, User, fields, keep=[User.version]).get(user_id)
         if not target_user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify(target_user.to_dict()), 200
+        return versioned_response(target_user, serialize(target_user, fields))
     
     except Exception as e:
         logging.error(f"Get user by ID error: {str(e)}")
@@ -129,8 +212,7 @@ def get_user_by_id(user_id):
 @jwt_required()
 def update_user(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -139,6 +221,10 @@ def update_user(user_id):
         if not target_user:
             return jsonify({'error': 'User not found'}), 404
         
+        # Reject edits made against an older version of the record
+        if if_match_fails(target_user):
+            return precondition_failed()
+        
         data = request.get_json()
         
         # Update fields
@@ -154,20 +240,39 @@ def update_user(user_id):
                 return jsonify({'error': 'Email already exists'}), 409
             target_user.email = data['email']
         
+        # Principals read the department from cached auth state
+        department_changed = 'department' in data and data['department'] != target_user.department
+        if department_changed:
+            move_department_rollups([target_user.id], data['department'])
         if 'department' in data:
             target_user.department = data['department']
         
         if 'position' in data:
             target_user.position = data['position']
         
-        if 'role' in data:
+        revoke_tokens = False
+        
+        if 'role' in data and data['role'] != target_user.role:
             target_user.role = data['role']
+            revoke_tokens = True
         
-        if 'is_active' in data:
+        if 'is_active' in data and bool(data['is_active']) != target_user.is_active:
             target_user.is_active = bool(data['is_active'])
+            revoke_tokens = True
+        
+        # Role and status live in issued tokens; force those to be re-resolved
+        if revoke_tokens:
+            invalidate_principal(target_user)
         
         db.session.commit()
-        return jsonify(target_user.to_dict()), 200
+        if department_changed or revoke_tokens:
+            forget_principals([target_user.id])
+        summary_cache.invalidate('users')
+        return versioned_response(target_user)
+    
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
     
     except Exception as e:
         logging.error(f"Update user error: {str(e)}")
@@ -178,7 +283,7 @@ def update_user(user_id):
 def delete_user(user_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -191,11 +296,18 @@ def delete_user(user_id):
         if target_user.id == current_user_id:
             return jsonify({'error': 'Cannot delete your own account'}), 400
         
+        invalidate_principal(target_user)
         db.session.delete(target_user)
         db.session.commit()
+        forget_principals([user_id])
+        summary_cache.invalidate('users', 'leaves', 'attendance')
         
         return jsonify({'message': 'User deleted successfully'}), 200
     
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
+    
     except Exception as e:
         logging.error(f"Delete user error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -204,8 +316,7 @@ def delete_user(user_id):
 @jwt_required()
 def get_all_leaves():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -213,8 +324,6 @@ def get_all_leaves():
         # Get query parameters
         status = request.args.get('status')
         user_id = request.args.get('user_id')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
         
         # Build query
         query = Leave.query
@@ -226,16 +335,16 @@ def get_all_leaves():
             query = query.filter_by(user_id=user_id)
         
         # Get paginated results
-        leaves = query.order_by(Leave.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(Leave, request.args)
+            query = select_fields(query, Leave, fields, keep=[Leave.created_at])
+            leaves = paginate_query(query, [Leave.created_at, Leave.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'leaves': [leave.to_dict() for leave in leaves.items],
-            'total': leaves.total,
-            'pages': leaves.pages,
-            'current_page': page,
-            'per_page': per_page
+            'leaves': serialize_all(Leave, leaves.items, fields),
+            **leaves.meta()
         }), 200
     
     except Exception as e:
@@ -246,36 +355,20 @@ def get_all_leaves():
 @jwt_required()
 def get_admin_dashboard():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get statistics
-        total_users = User.query.count()
-        active_users = User.query.filter_by(is_active=True).count()
-        pending_leaves = Leave.query.filter_by(status='pending').count()
-        
-        # Today's attendance
-        today = datetime.now().date()
-        today_attendance = Attendance.query.filter_by(date=today).count()
-        
-        # Department breakdown
-        dept_breakdown = db.session.query(
-            User.department,
-            db.func.count(User.id).label('count')
-        ).group_by(User.department).all()
+        # Get statistics (cached org-wide fragments)
+        users = user_summary()
         
         dashboard = {
-            'total_users': total_users,
-            'active_users': active_users,
-            'pending_leaves': pending_leaves,
-            'today_attendance': today_attendance,
-            'department_breakdown': [
-                {'department': dept, 'count': count}
-                for dept, count in dept_breakdown
-            ]
+            'total_users': users['total_users'],
+            'active_users': users['active_users'],
+            'pending_leaves': pending_leaves_summary()['pending_leaves'],
+            'today_attendance': attendance_summary()['today_records'],
+            'department_breakdown': users['department_breakdown']
         }
         
         return jsonify(dashboard), 200
@@ -4,40 +4,46 @@ from models import User, Announcement
 from app import db
 from datetime import datetime
 from api import api_bp
+from utils import get_current_principal, paginate_query, conditional_get, freshness
+from serializers import serialize, serialize_all, parse_fields, select_fields
+from cache import summary_cache
+from events import event_broker
 import logging
 
+def _announcements_query():
+    query = Announcement.query
+    
+    if request.args.get('active_only', 'true').lower() == 'true':
+        query = query.filter_by(is_active=True)
+    
+    return query
+
+def _with_author(query):
+    # to_dict renders the author's name, so their updates change the payload too
+    return freshness(query.outerjoin(User, User.id == Announcement.author_id),
+                     Announcement.updated_at, User.updated_at)
+
 @api_bp.route('/announcements', methods=['GET'])
 @jwt_required()
+@conditional_get(lambda principal: _with_author(_announcements_query()))
 def get_announcements():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get query parameters
-        active_only = request.args.get('active_only', 'true').lower() == 'true'
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-        
-        # Build query
-        query = Announcement.query
-        
-        if active_only:
-            query = query.filter_by(is_active=True)
-        
         # Get paginated results
-        announcements = query.order_by(Announcement.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(Announcement, request.args)
+            query = select_fields(_announcements_query(), Announcement, fields, keep=[Announcement.created_at])
+            announcements = paginate_query(query, [Announcement.created_at, Announcement.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'announcements': [announcement.to_dict() for announcement in announcements.items],
-            'total': announcements.total,
-            'pages': announcements.pages,
-            'current_page': page,
-            'per_page': per_page
+            'announcements': serialize_all(Announcement, announcements.items, fields),
+            **announcements.meta()
         }), 200
     
     except Exception as e:
@@ -49,7 +55,7 @@ def get_announcements():
 def create_announcement():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -92,8 +98,12 @@ def create_announcement():
         
         db.session.add(announcement)
         db.session.commit()
+        summary_cache.invalidate('announcements')
         
-        return jsonify(announcement.to_dict()), 201
+        announcement_data = announcement.to_dict()
+        event_broker.publish('announcement.created', announcement_data)
+        
+        return jsonify(announcement_data), 201
     
     except Exception as e:
         db.session.rollback()
@@ -102,19 +112,24 @@ def create_announcement():
 
 @api_bp.route('/announcements/<int:announcement_id>', methods=['GET'])
 @jwt_required()
+@conditional_get(lambda principal, announcement_id: _with_author(Announcement.query.filter_by(id=announcement_id)))
 def get_announcement(announcement_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        announcement = Announcement.query.get(announcement_id)
+        try:
+            fields = parse_fields(Announcement, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        announcement = select_fields(Announcement.query, Announcement, fields).get(announcement_id)
         if not announcement:
             return jsonify({'error': 'Announcement not found'}), 404
         
-        return jsonify(announcement.to_dict()), 200
+        return jsonify(serialize(announcement, fields)), 200
     
     except Exception as e:
         logging.error(f"Get announcement error: {str(e)}")
@@ -125,7 +140,7 @@ def get_announcement(announcement_id):
 def update_announcement(announcement_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -163,6 +178,7 @@ def update_announcement(announcement_id):
                 announcement.expires_at = None
         
         db.session.commit()
+        summary_cache.invalidate('announcements')
         return jsonify(announcement.to_dict()), 200
     
     except Exception as e:
@@ -174,7 +190,7 @@ def update_announcement(announcement_id):
 def delete_announcement(announcement_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -189,6 +205,7 @@ def delete_announcement(announcement_id):
         
         db.session.delete(announcement)
         db.session.commit()
+        summary_cache.invalidate('announcements')
         
         return jsonify({'message': 'Announcement deleted successfully'}), 200
     
@@ -1,9 +1,16 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Attendance
+from models import User, Attendance, AttendanceDailyRollup, AttendanceMonthlyRollup
 from app import db
 from datetime import datetime, timedelta
 from api import api_bp
+from utils import get_current_principal, paginate_query
+from serializers import serialize, serialize_all, parse_fields, select_fields
+from cache import summary_cache
+from rollups import attendance_snapshot, apply_attendance_change, month_start
+from sqlalchemy import func
+from attendance_import import import_attendance_csv
+import io
 import logging
 
 @api_bp.route('/attendance', methods=['GET'])
@@ -11,7 +18,7 @@ import logging
 def get_attendance():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -20,12 +27,6 @@ def get_attendance():
         date_from = request.args.get('date_from')
         date_to = request.args.get('date_to')
         
-        try:
-            page = max(1, int(request.args.get('page', 1)))
-            per_page = max(1, min(100, int(request.args.get('per_page', 10))))
-        except ValueError:
-            return jsonify({'error': 'Invalid page or per_page parameter'}), 400
-        
         # Build query
         query = Attendance.query.filter_by(user_id=current_user_id)
         
@@ -44,16 +45,16 @@ def get_attendance():
                 return jsonify({'error': 'Invalid date_to format. Use YYYY-MM-DD'}), 400
         
         # Get paginated results
-        attendance_records = query.order_by(Attendance.date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(Attendance, request.args)
+            query = select_fields(query, Attendance, fields, keep=[Attendance.date])
+            attendance_records = paginate_query(query, [Attendance.date, Attendance.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'attendance': [record.to_dict() for record in attendance_records.items],
-            'total': attendance_records.total,
-            'pages': attendance_records.pages,
-            'current_page': page,
-            'per_page': per_page
+            'attendance': serialize_all(Attendance, attendance_records.items, fields),
+            **attendance_records.meta()
         }), 200
     
     except Exception as e:
@@ -65,7 +66,7 @@ def get_attendance():
 def clock_in():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -84,6 +85,7 @@ def clock_in():
         
         # Create or update attendance record
         if not existing_record:
+            before = None
             attendance = Attendance(
                 user_id=current_user_id,
                 date=today,
@@ -92,11 +94,14 @@ def clock_in():
             )
             db.session.add(attendance)
         else:
+            before = attendance_snapshot(existing_record)
             existing_record.clock_in = current_time
             existing_record.status = 'present'
             attendance = existing_record
         
+        apply_attendance_change(before, attendance_snapshot(attendance))
         db.session.commit()
+        summary_cache.invalidate('attendance')
         return jsonify(attendance.to_dict()), 201
     
     except Exception as e:
@@ -108,7 +113,7 @@ def clock_in():
 def clock_out():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -129,6 +134,7 @@ def clock_out():
             return jsonify({'error': 'Already clocked out today'}), 400
         
         # Update attendance record
+        before = attendance_snapshot(attendance)
         attendance.clock_out = current_time
         
         # Calculate hours worked
@@ -136,6 +142,7 @@ def clock_out():
         hours_worked = time_diff.total_seconds() / 3600
         attendance.hours_worked = round(hours_worked, 2)
         
+        apply_attendance_change(before, attendance_snapshot(attendance))
         db.session.commit()
         return jsonify(attendance.to_dict()), 200
     
@@ -148,12 +155,18 @@ def clock_out():
 def get_attendance_record(attendance_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        attendance = Attendance.query.get(attendance_id)
+        try:
+            fields = parse_fields(Attendance, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        attendance = select_fields(Attendance.query, Attendance, fields,
+                                   keep=[Attendance.user_id]).get(attendance_id)
         if not attendance:
             return jsonify({'error': 'Attendance record not found'}), 404
         
@@ -161,7 +174,7 @@ def get_attendance_record(attendance_id):
         if attendance.user_id != current_user_id and user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
-        return jsonify(attendance.to_dict()), 200
+        return jsonify(serialize(attendance, fields)), 200
     
     except Exception as e:
         logging.error(f"Get attendance record error: {str(e)}")
@@ -171,8 +184,7 @@ def get_attendance_record(attendance_id):
 @jwt_required()
 def update_attendance_record(attendance_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -186,6 +198,7 @@ def update_attendance_record(attendance_id):
             return jsonify({'error': 'Access denied'}), 403
         
         data = request.get_json()
+        before = attendance_snapshot(attendance)
         
         # Update fields
         if 'status' in data:
@@ -197,7 +210,9 @@ def update_attendance_record(attendance_id):
         if 'hours_worked' in data:
             attendance.hours_worked = data['hours_worked']
         
+        apply_attendance_change(before, attendance_snapshot(attendance))
         db.session.commit()
+        summary_cache.invalidate('attendance')
         return jsonify(attendance.to_dict()), 200
     
     except Exception as e:
@@ -209,7 +224,7 @@ def update_attendance_record(attendance_id):
 def get_today_attendance():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -228,3 +243,93 @@ def get_today_attendance():
     except Exception as e:
         logging.error(f"Get today attendance error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/attendance/report', methods=['GET'])
+@jwt_required()
+def get_attendance_report():
+    try:
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        today = datetime.now().date()
+        try:
+            date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d').date() \
+                if request.args.get('date_from') else month_start(today)
+            date_to = datetime.strptime(request.args['date_to'], '%Y-%m-%d').date() \
+                if request.args.get('date_to') else today
+            month = datetime.strptime(request.args['month'], '%Y-%m').date() \
+                if request.args.get('month') else month_start(today)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD (month: YYYY-MM)'}), 400
+        
+        by_department = db.session.query(
+            AttendanceDailyRollup.department,
+            func.sum(AttendanceDailyRollup.record_count),
+            func.sum(AttendanceDailyRollup.present_count),
+            func.sum(AttendanceDailyRollup.hours_worked)
+        ).filter(
+            AttendanceDailyRollup.date >= date_from,
+            AttendanceDailyRollup.date <= date_to
+        ).group_by(AttendanceDailyRollup.department)\
+            .order_by(AttendanceDailyRollup.department).all()
+        
+        by_user = db.session.query(AttendanceMonthlyRollup)\
+            .filter(AttendanceMonthlyRollup.month == month)\
+            .add_columns(User.first_name, User.last_name, User.employee_id, User.department)\
+            .outerjoin(User, User.id == AttendanceMonthlyRollup.user_id)\
+            .order_by(AttendanceMonthlyRollup.user_id).all()
+        
+        return jsonify({
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'month': month.strftime('%Y-%m'),
+            'by_department': [{
+                'department': department or None,
+                'record_count': record_count or 0,
+                'present_count': present_count or 0,
+                'hours_worked': round(hours_worked or 0.0, 2)
+            } for department, record_count, present_count, hours_worked in by_department],
+            'by_user': [{
+                **rollup.to_dict(),
+                'employee_name': f"{first_name} {last_name}" if first_name else None,
+                'employee_id': employee_id,
+                'department': department
+            } for rollup, first_name, last_name, employee_id, department in by_user]
+        }), 200
+    
+    except Exception as e:
+        logging.error(f"Get attendance report error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/attendance/import', methods=['POST'])
+@jwt_required()
+def import_attendance():
+    try:
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        # Multipart upload or a raw text/csv body; either is parsed as it streams in
+        if 'file' in request.files:
+            upload = request.files['file'].stream
+        elif request.mimetype == 'text/csv':
+            upload = request.stream
+        else:
+            return jsonify({'error': 'Upload a CSV file as "file" or send a text/csv body'}), 400
+        
+        try:
+            report = import_attendance_csv(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''))
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        summary_cache.invalidate('attendance')
+        logging.info(f"Attendance import by HR user {user.employee_id}: {report['imported']} rows")
+        
+        return jsonify(report), 200
+    
+    except Exception as e:
+        logging.error(f"Import attendance error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
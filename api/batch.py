@@ -0,0 +1,110 @@
+from flask import request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from werkzeug.test import EnvironBuilder
+from app import db
+from api import api_bp
+from utils import get_current_principal
+import logging
+
+# Sub-requests accepted in one batch
+MAX_BATCH_REQUESTS = 20
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# Conditional headers a sub-request may send; Authorization is always the batch's own
+FORWARDED_HEADERS = ('If-None-Match', 'If-Modified-Since', 'If-Match')
+# Response headers copied into each result
+RETURNED_HEADERS = ('ETag', 'Last-Modified', 'Location')
+
+def _validate(sub_request):
+    if not isinstance(sub_request, dict):
+        raise ValueError('Each request must be an object')
+    method = str(sub_request.get('method', 'GET')).upper()
+    if method not in BATCH_METHODS:
+        raise ValueError(f"Invalid method {method!r}")
+    path = sub_request.get('path')
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise ValueError('path must be an absolute path such as /api/settings')
+    headers = sub_request.get('headers') or {}
+    if not isinstance(headers, dict):
+        raise ValueError('headers must be an object')
+    return method, path, headers
+
+def _dispatch(app, method, path, headers, body):
+    """Run one sub-request through the app's normal request handling.
+    
+    The nested request context reuses the batch's app context, so every
+    sub-request shares its database session and the principal cached in g.
+    A sub-request that does not succeed is rolled back, so changes it left
+    uncommitted are not written by a later one.
+    """
+    forwarded = {name: headers[name] for name in FORWARDED_HEADERS if headers.get(name)}
+    forwarded['Authorization'] = request.headers.get('Authorization', '')
+    builder = EnvironBuilder(
+        path=path,
+        base_url=request.host_url.rstrip('/') + request.script_root,
+        method=method,
+        headers=forwarded,
+        json=body,
+        environ_base={'REMOTE_ADDR': request.remote_addr}
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    
+    with app.request_context(environ):
+        response = app.full_dispatch_request()
+    
+    if not 200 <= response.status_code < 300:
+        # Each sub-request is its own unit of work in the shared session
+        db.session.rollback()
+    return response
+
+def _result(response):
+    result = {
+        'status': response.status_code,
+        'headers': {name: response.headers[name] for name in RETURNED_HEADERS if name in response.headers}
+    }
+    if response.is_streamed:
+        response.close()
+        return {'status': 400, 'headers': {}, 'body': {'error': 'Streaming responses cannot be batched'}}
+    if response.is_json:
+        result['body'] = response.get_json()
+    elif response.status_code != 304:
+        result['body'] = response.get_data(as_text=True)
+    return result
+
+@api_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def batch():
+    try:
+        user = get_current_principal()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        data = request.get_json(silent=True)
+        sub_requests = data.get('requests') if isinstance(data, dict) else None
+        if not isinstance(sub_requests, list) or not sub_requests:
+            return jsonify({'error': 'requests must be a non-empty list'}), 400
+        if len(sub_requests) > MAX_BATCH_REQUESTS:
+            return jsonify({'error': f'At most {MAX_BATCH_REQUESTS} requests per batch'}), 400
+        
+        try:
+            validated = [_validate(sub_request) for sub_request in sub_requests]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        app = current_app._get_current_object()
+        results = []
+        for (method, path, headers), sub_request in zip(validated, sub_requests):
+            if path.split('?', 1)[0].rstrip('/') == request.path.rstrip('/'):
+                results.append({'status': 400, 'headers': {}, 'body': {'error': 'Batches cannot be nested'}})
+                continue
+            response = _dispatch(app, method, path, headers, sub_request.get('body'))
+            results.append(_result(response))
+        
+        return jsonify({'responses': results}), 200
+    
+    except Exception as e:
+        logging.error(f"Batch request error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
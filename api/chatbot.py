@@ -1,28 +1,24 @@
-from flask import request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User
+from flask import request, jsonify, Response
+from flask_jwt_extended import jwt_required
 from api import api_bp
+from utils import get_current_principal
+from llm import get_llm, LLMUnavailable
+from chat_cache import get_chat_cache
+from knowledge import get_knowledge
+from intents import respond
+from chat_memory import get_chat_memory
+import json
 import logging
-import os
+import re
+import time
 from datetime import datetime
 
-# Initialize OpenAI client (optional)
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = None
-
-if OPENAI_API_KEY:
-    try:
-        from openai import OpenAI
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
-    except ImportError:
-        logging.warning("OpenAI package not installed. Using basic chatbot responses.")
-
 @api_bp.route('/chatbot', methods=['POST'])
 @jwt_required()
 def chat_with_bot():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
+        user = principal.user if principal else None
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -33,15 +29,21 @@ def chat_with_bot():
         if not message:
             return jsonify({'error': 'Message is required'}), 400
         
+        passages = search_policies(message)
+        
         # If OpenAI API is available, use it
-        if openai_client:
-            response = get_openai_response(message, user)
+        if get_llm():
+            memory = get_chat_memory()
+            history = memory.messages(memory.load(user.id))
+            response = get_openai_response(message, user, passages, history)
+            memory.record(user.id, message, response)
         else:
-            # Fallback to rule-based responses
-            response = get_rule_based_response(message, user)
+            # Fallback to policy passages and rule-based responses
+            response = get_offline_response(message, user, passages)
         
         return jsonify({
             'response': response,
+            'sources': [passage.to_dict() for passage in passages],
             'timestamp': datetime.now().isoformat()
         }), 200
     
@@ -49,12 +51,179 @@ def chat_with_bot():
         logging.error(f"Chatbot error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-def get_openai_response(message, user):
-    """Get response from OpenAI API"""
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api_bp.route('/chatbot/stream', methods=['POST'])
+@jwt_required()
+def chat_with_bot_stream():
+    try:
+        principal = get_current_principal()
+        user = principal.user if principal else None
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        data = request.get_json()
+        message = data.get('message', '').strip()
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+        
+        # Everything the stream needs is prepared here, so it holds no
+        # database session while waiting on the LLM
+        llm = get_llm()
+        memory = get_chat_memory()
+        history = memory.messages(memory.load(user.id)) if llm else []
+        passages = search_policies(message)
+        sources = [passage.to_dict() for passage in passages]
+        cache = get_chat_cache()
+        personal = is_personal(message, history)
+        scope = cache_scope(user, personal)
+        # An answer that builds on earlier turns is neither looked up nor stored
+        cached = cache.get(message, scope) if llm and not history else None
+        messages = build_messages(message, user if personal else None, passages, history)
+        fallback = get_offline_response(message, user, passages)
+        user_id = user.id
+        
+        def done(source, answer):
+            if llm:
+                memory.record_later(user_id, message, answer)
+            return _sse('done', {'source': source, 'sources': sources, 'timestamp': datetime.now().isoformat()})
+        
+        def generate():
+            if cached is not None:
+                yield _sse('token', {'text': cached})
+                yield done('cache', cached)
+                return
+            
+            if llm:
+                started = False
+                parts = []
+                began_at = time.monotonic()
+                try:
+                    for text in llm.stream(messages):
+                        started = True
+                        parts.append(text)
+                        yield _sse('token', {'text': text})
+                    if not history:
+                        cache.put(message, ''.join(parts), scope, time.monotonic() - began_at)
+                    yield done('llm', ''.join(parts))
+                    return
+                except LLMUnavailable as e:
+                    logging.warning(f"Chatbot LLM unavailable: {str(e)}")
+                    if started:
+                        yield _sse('error', {'error': 'The reply was interrupted. Please try again'})
+                        return
+            
+            yield _sse('token', {'text': fallback})
+            yield done('policies' if passages else 'rules', fallback)
+        
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    except Exception as e:
+        logging.error(f"Chatbot stream error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/chatbot/session', methods=['GET'])
+@jwt_required()
+def get_chat_session():
+    try:
+        user = get_current_principal()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        session = get_chat_memory().load(user.id)
+        if not session:
+            return jsonify({'error': 'No active conversation'}), 404
+        
+        return jsonify(session.to_dict()), 200
+    
+    except Exception as e:
+        logging.error(f"Get chat session error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/chatbot/session', methods=['DELETE'])
+@jwt_required()
+def reset_chat_session():
+    try:
+        user = get_current_principal()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        get_chat_memory().reset(user.id)
+        return jsonify({'message': 'Conversation cleared'}), 200
+    
+    except Exception as e:
+        logging.error(f"Reset chat session error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/chatbot/metrics', methods=['GET'])
+@jwt_required()
+def get_chatbot_metrics():
     try:
-        system_prompt = f"""You are an AI assistant for an HR management system. 
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        llm = get_llm()
+        return jsonify({
+            'cache': get_chat_cache().stats(),
+            'llm': {
+                'configured': llm is not None,
+                'circuit': llm.breaker.state if llm else None
+            }
+        }), 200
+    
+    except Exception as e:
+        logging.error(f"Chatbot metrics error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def search_policies(message, k=3):
+    """The HR policy passages most relevant to ``message``, if a policy
+    directory is configured"""
+    knowledge = get_knowledge()
+    if not knowledge:
+        return []
+    try:
+        return knowledge.search(message, k)
+    except Exception as e:
+        logging.error(f"Policy search error: {str(e)}")
+        return []
+
+# First-person references that make an answer depend on who is asking
+_SELF_REFERENCE = re.compile(r"\b(my|me|mine|myself|am i|i am|i'm)\b", re.IGNORECASE)
+
+def is_personal(message, history=()):
+    """Whether answering ``message`` needs the asker's profile: it refers
+    to them, or follows up on their conversation"""
+    return bool(history) or bool(_SELF_REFERENCE.search(message))
+
+def cache_scope(user, personal):
+    """Scope of the cached answers a question from ``user`` may reuse.
+    
+    General questions are asked without the user's profile, so their
+    answers are shared by everyone; personal ones carry it and are only
+    reused for the same user. Either way an answer is only reused while
+    the policy index it was grounded in is unchanged.
+    """
+    knowledge = get_knowledge()
+    return (user.id if personal else None, knowledge.revision if knowledge else None)
+
+def build_messages(message, user=None, passages=(), history=()):
+    """Chat messages for the LLM: the system prompt, with ``user``'s
+    profile if given and grounded in any matching policy passages, the
+    conversation so far and the user's question"""
+    system_prompt = """You are an AI assistant for an HR management system. """
+    if user is not None:
+        system_prompt += f"""
         You're helping {user.first_name} {user.last_name} (Employee ID: {user.employee_id}) 
-        who works in {user.department} as a {user.position}.
+        who works in {user.department} as a {user.position}."""
+    system_prompt += """
         
         You can help with:
         - HR policies and procedures
@@ -67,53 +236,51 @@ def get_openai_response(message, user):
         
         Be helpful, professional, and concise. If you don't know something specific 
         about the company, suggest contacting HR directly."""
-        
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=300,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
     
-    except Exception as e:
-        logging.error(f"OpenAI API error: {str(e)}")
-        return get_rule_based_response(message, user)
+    if passages:
+        excerpts = '\n\n'.join(f"[{passage.title}]\n{passage.text}" for passage in passages)
+        system_prompt += f"""
+        
+        Answer from these company policy excerpts where they apply, and say which
+        policy you relied on:
 
-def get_rule_based_response(message, user):
-    """Fallback rule-based responses"""
-    message_lower = message.lower()
-    
-    # Leave-related queries
-    if any(word in message_lower for word in ['leave', 'vacation', 'sick', 'time off']):
-        return "To apply for leave, go to the Leaves section in your dashboard. You can submit a leave request with your desired dates and reason. Your manager or HR will review and approve it."
-    
-    # Attendance queries
-    elif any(word in message_lower for word in ['attendance', 'clock in', 'clock out', 'timesheet']):
-        return "You can clock in and out using the Attendance section. Make sure to clock in when you start work and clock out when you finish. Your attendance records are automatically tracked."
-    
-    # Payroll queries
-    elif any(word in message_lower for word in ['payroll', 'salary', 'payslip', 'pay']):
-        return "You can view your payroll information, including payslips and salary history, in the Payroll section of your dashboard."
-    
-    # Profile queries
-    elif any(word in message_lower for word in ['profile', 'update', 'personal information']):
-        return "You can update your personal information in the Profile section. This includes your contact details, emergency contacts, and other personal data."
-    
-    # General greetings
-    elif any(word in message_lower for word in ['hello', 'hi', 'hey', 'good morning', 'good afternoon']):
-        return f"Hello {user.first_name}! I'm here to help you with HR-related questions. How can I assist you today?"
+{excerpts}"""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        *history,
+        {"role": "user", "content": message}
+    ]
+
+def get_openai_response(message, user, passages=(), history=()):
+    """Get response from OpenAI API, or from the cache of earlier answers
+    when the question does not follow up on a conversation"""
+    cache = get_chat_cache()
+    personal = is_personal(message, history)
+    scope = cache_scope(user, personal)
+    cached = None if history else cache.get(message, scope)
+    if cached is not None:
+        return cached
     
-    # Help queries
-    elif any(word in message_lower for word in ['help', 'what can you do', 'assistance']):
-        return "I can help you with:\n• Leave applications and policies\n• Attendance tracking\n• Payroll inquiries\n• Profile updates\n• General HR questions\n\nWhat would you like to know about?"
+    try:
+        began_at = time.monotonic()
+        messages = build_messages(message, user if personal else None, passages, history)
+        response = get_llm().complete(messages, max_tokens=300, temperature=0.7)
+        if not history:
+            cache.put(message, response, scope, time.monotonic() - began_at)
+        return response
     
-    # Default response
-    else:
-        return "I'm here to help with HR-related questions. You can ask me about leave policies, attendance, payroll, or general workplace questions. For specific issues, please contact HR directly."
+    except LLMUnavailable as e:
+        logging.warning(f"OpenAI API unavailable: {str(e)}")
+        return get_offline_response(message, user, passages)
+
+def get_offline_response(message, user, passages=()):
+    """Answer without the LLM: the best matching policy passage, or a
+    rule-based response"""
+    if passages:
+        return f"{passages[0].text}\n\n(From: {passages[0].title})"
+    return get_rule_based_response(message, user)
+
+def get_rule_based_response(message, user):
+    """Fallback rule-based responses, from the intent table"""
+    return respond(message, user)
@@ -1,42 +1,101 @@
 from flask import jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Leave, Attendance, Announcement
+from models import User, Leave, Attendance, Announcement, AttendanceDailyRollup, AttendanceMonthlyRollup
 from app import db
 from datetime import datetime
 from api import api_bp
+from utils import get_current_principal
+from cache import summary_cache
 import logging
 from sqlalchemy import func
 
+# Org-wide summary fragments shared by the dashboard, desk and admin views.
+# Each is cached under its name; write endpoints invalidate by that name.
+
+def user_summary():
+    """Headcount figures (invalidated by user writes)"""
+    def compute():
+        dept_breakdown = db.session.query(
+            User.department,
+            func.count(User.id).label('count')
+        ).group_by(User.department).all()
+        
+        return {
+            'total_users': User.query.count(),
+            'active_users': User.query.filter_by(is_active=True).count(),
+            'active_departments': db.session.query(func.count(User.department.distinct()))\
+                .filter(User.is_active == True).scalar() or 0,
+            'department_breakdown': [
+                {'department': dept, 'count': count}
+                for dept, count in dept_breakdown
+            ]
+        }
+    
+    return summary_cache.get_or_compute('users', 'org', compute)
+
+def attendance_summary():
+    """Today's and this month's attendance counts (invalidated by clock-in)"""
+    today = datetime.now().date()
+    start_of_month = today.replace(day=1)
+    
+    def compute():
+        # Read from the rollup tables rather than counting Attendance rows;
+        # clock-in keeps one record per user per day
+        today_records = db.session.query(func.sum(AttendanceDailyRollup.record_count))\
+            .filter(AttendanceDailyRollup.date == today).scalar() or 0
+        return {
+            'present_today': today_records,
+            'today_records': today_records,
+            'monthly_records': db.session.query(func.sum(AttendanceMonthlyRollup.record_count))\
+                .filter(AttendanceMonthlyRollup.month == start_of_month).scalar() or 0
+        }
+    
+    # Keyed by date so the counts roll over at midnight
+    return summary_cache.get_or_compute('attendance', f"org:{today.isoformat()}", compute)
+
+def pending_leaves_summary():
+    """Org-wide pending leave count and latest requests, HR/admin only (invalidated by leave writes)"""
+    def compute():
+        recent_leaves = Leave.query.filter_by(status='pending')\
+            .order_by(Leave.created_at.desc()).limit(5).all()
+        return {
+            'pending_leaves': Leave.query.filter_by(status='pending').count(),
+            'recent_leave_requests': [leave.to_dict() for leave in recent_leaves]
+        }
+    
+    return summary_cache.get_or_compute('leaves', 'hr', compute)
+
+def recent_announcements_summary(limit):
+    """Latest active announcements, up to 5 (invalidated by announcement writes)"""
+    def compute():
+        announcements = Announcement.query.filter_by(is_active=True)\
+            .order_by(Announcement.created_at.desc()).limit(5).all()
+        return [ann.to_dict() for ann in announcements]
+    
+    return summary_cache.get_or_compute('announcements', 'org', compute)[:limit]
+
 @api_bp.route('/dashboard/stats', methods=['GET'])
 @jwt_required()
 def get_dashboard_stats():
     """Get comprehensive dashboard statistics"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
+        user = principal.user if principal else None
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         today = datetime.now().date()
-        
-        # Total active employees
-        total_employees = User.query.filter_by(is_active=True).count()
-        
-        # Present today (users with attendance record for today)
-        present_today = db.session.query(func.count(Attendance.user_id.distinct()))\
-            .filter(Attendance.date == today).scalar() or 0
+        users = user_summary()
+        attendance = attendance_summary()
         
         # Pending leaves (for all users if admin/hr, else just current user)
         if user.role in ['admin', 'hr']:
-            pending_leaves = Leave.query.filter_by(status='pending').count()
+            pending_leaves = pending_leaves_summary()['pending_leaves']
         else:
             pending_leaves = Leave.query.filter_by(user_id=current_user_id, status='pending').count()
         
-        # Recent announcements
-        recent_announcements = Announcement.query.filter_by(is_active=True)\
-            .order_by(Announcement.created_at.desc()).limit(3).all()
-        
         # Current user's today attendance
         user_attendance_today = Attendance.query.filter_by(
             user_id=current_user_id, 
@@ -46,30 +105,20 @@ def get_dashboard_stats():
         # Additional stats for admin/hr
         additional_stats = {}
         if user.role in ['admin', 'hr']:
-            # Monthly stats
-            start_of_month = datetime.now().replace(day=1).date()
-            monthly_attendance = db.session.query(func.count(Attendance.id))\
-                .filter(Attendance.date >= start_of_month).scalar() or 0
-            
-            # Recent leave requests
-            recent_leaves = Leave.query.filter_by(status='pending')\
-                .order_by(Leave.created_at.desc()).limit(5).all()
-            
             additional_stats = {
-                'monthly_attendance_records': monthly_attendance,
-                'recent_leave_requests': [leave.to_dict() for leave in recent_leaves],
-                'total_departments': db.session.query(func.count(User.department.distinct()))\
-                    .filter(User.is_active == True).scalar() or 0
+                'monthly_attendance_records': attendance['monthly_records'],
+                'recent_leave_requests': pending_leaves_summary()['recent_leave_requests'],
+                'total_departments': users['active_departments']
             }
         
         stats = {
-            'total_employees': total_employees,
-            'present_today': present_today,
+            'total_employees': users['active_users'],
+            'present_today': attendance['present_today'],
             'pending_leaves': pending_leaves,
             'current_time': datetime.now().isoformat(),
             'user': user.to_dict(),
             'user_attendance_today': user_attendance_today.to_dict() if user_attendance_today else None,
-            'recent_announcements': [ann.to_dict() for ann in recent_announcements],
+            'recent_announcements': recent_announcements_summary(3),
             **additional_stats
         }
         
@@ -84,8 +133,7 @@ def get_dashboard_stats():
 def get_quick_actions():
     """Get user-specific quick actions"""
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -1,9 +1,11 @@
 from flask import jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Leave, Attendance, Announcement
+from models import Leave, Attendance, AttendanceMonthlyRollup
 from app import db
 from datetime import datetime, timedelta
 from api import api_bp
+from utils import get_current_principal
+from api.dashboard import recent_announcements_summary
 import logging
 
 @api_bp.route('/desk/summary', methods=['GET'])
@@ -11,7 +13,8 @@ import logging
 def get_desk_summary():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
+        user = principal.user if principal else None
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -23,16 +26,10 @@ def get_desk_summary():
         today = datetime.now().date()
         today_attendance = Attendance.query.filter_by(user_id=current_user_id, date=today).first()
         
-        # Get recent announcements
-        recent_announcements = Announcement.query.filter_by(is_active=True)\
-            .order_by(Announcement.created_at.desc()).limit(5).all()
-        
         # Get this month's attendance summary
         start_of_month = datetime.now().replace(day=1).date()
-        monthly_attendance = Attendance.query.filter(
-            Attendance.user_id == current_user_id,
-            Attendance.date >= start_of_month
-        ).count()
+        monthly_rollup = db.session.get(AttendanceMonthlyRollup, (start_of_month, current_user_id))
+        monthly_attendance = monthly_rollup.record_count if monthly_rollup else 0
         
         # Quick links based on user role
         quick_links = [
@@ -54,7 +51,7 @@ def get_desk_summary():
             'pending_leaves': pending_leaves,
             'today_attendance': today_attendance.to_dict() if today_attendance else None,
             'monthly_attendance_days': monthly_attendance,
-            'recent_announcements': [ann.to_dict() for ann in recent_announcements],
+            'recent_announcements': recent_announcements_summary(5),
             'quick_links': quick_links,
             'current_time': datetime.now().isoformat()
         }
@@ -0,0 +1,82 @@
+from flask import jsonify, request, Response, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from api import api_bp
+from utils import get_current_principal, principal_is_current
+from events import event_broker
+import logging
+import time
+
+@api_bp.route('/events/token', methods=['POST'])
+@jwt_required()
+def event_stream_token():
+    try:
+        user = get_current_principal()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        return jsonify({
+            'token': event_broker.issue_token(user.id, user.auth_version),
+            'expires_in': current_app.config['EVENTS_TOKEN_TTL']
+        }), 200
+    
+    except Exception as e:
+        logging.error(f"Event stream token error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# EventSource cannot set headers, so browsers open the stream with a token
+# from /events/token as ?token= instead of putting their JWT in the URL
+@api_bp.route('/events/stream', methods=['GET'])
+@jwt_required(optional=True)
+def event_stream():
+    try:
+        if get_jwt_identity() is not None:
+            user = get_current_principal()
+            
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            
+            user_id, auth_version = user.id, user.auth_version
+        else:
+            token = request.args.get('token')
+            verified = event_broker.verify_token(token) if token else None
+            
+            if verified is None or not principal_is_current(*verified):
+                return jsonify({'error': 'Invalid or expired stream token'}), 401
+            
+            user_id, auth_version = verified
+        
+        subscription = event_broker.subscribe(user_id)
+        if subscription is None:
+            return jsonify({'error': 'Too many event stream connections. Try again later'}), 503
+        
+        heartbeat = current_app.config['EVENTS_HEARTBEAT']
+        app = current_app._get_current_object()
+        
+        # Runs after the request context is gone, so it touches neither g nor
+        # the request's database session
+        def generate():
+            yield 'retry: 5000\n\n'
+            checked_at = time.monotonic()
+            while True:
+                frames = subscription.wait(heartbeat)
+                if time.monotonic() - checked_at >= heartbeat:
+                    # A deactivated user or revoked token ends the stream
+                    with app.app_context():
+                        current = principal_is_current(user_id, auth_version)
+                    if not current:
+                        yield 'event: session.revoked\ndata: {}\n\n'
+                        return
+                    checked_at = time.monotonic()
+                # Comment lines keep proxies from timing out idle connections
+                yield ''.join(frames) if frames else ': keep-alive\n\n'
+        
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # Also runs when the client leaves before the first frame is sent
+        response.call_on_close(subscription.close)
+        return response
+    
+    except Exception as e:
+        logging.error(f"Event stream error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,96 @@
+from flask import request, jsonify, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import User, Attendance, Leave, Payroll
+from app import db
+from datetime import datetime
+from api import api_bp
+from utils import get_current_principal
+from export_formats import EXPORT_FORMATS, stream_export
+import logging
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+# dataset -> (model, date column for date_from/date_to, exported columns)
+EXPORT_DATASETS = {
+    'attendance': (Attendance, Attendance.date, [
+        Attendance.date, Attendance.clock_in, Attendance.clock_out,
+        Attendance.hours_worked, Attendance.status, Attendance.notes
+    ]),
+    'leaves': (Leave, Leave.start_date, [
+        Leave.leave_type, Leave.start_date, Leave.end_date, Leave.days_requested,
+        Leave.status, Leave.reason, Leave.approved_at, Leave.created_at
+    ]),
+    'payroll': (Payroll, Payroll.pay_period_start, [
+        Payroll.pay_period_start, Payroll.pay_period_end, Payroll.basic_salary, Payroll.allowances,
+        Payroll.deductions, Payroll.overtime_hours, Payroll.overtime_pay, Payroll.gross_pay,
+        Payroll.tax_deduction, Payroll.net_pay, Payroll.status
+    ]),
+}
+
+EMPLOYEE_COLUMNS = [User.employee_id, User.first_name, User.last_name, User.department]
+
+@api_bp.route('/exports/<dataset>', methods=['GET'])
+@jwt_required()
+def export_dataset(dataset):
+    try:
+        current_user_id = int(get_jwt_identity())
+        user = get_current_principal()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        if dataset not in EXPORT_DATASETS:
+            return jsonify({'error': f"Unknown export. Use one of: {', '.join(EXPORT_DATASETS)}"}), 404
+        
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f"Invalid format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+        
+        model, date_column, columns = EXPORT_DATASETS[dataset]
+        statement = db.select(*EMPLOYEE_COLUMNS, *columns)\
+            .select_from(model).join(User, User.id == model.user_id)
+        
+        # HR/admin export everyone (optionally one employee); others only themselves
+        if user.role in ['hr', 'admin']:
+            if request.args.get('user_id'):
+                try:
+                    statement = statement.where(model.user_id == int(request.args['user_id']))
+                except ValueError:
+                    return jsonify({'error': 'Invalid user_id parameter'}), 400
+        else:
+            statement = statement.where(model.user_id == current_user_id)
+        
+        try:
+            if request.args.get('date_from'):
+                statement = statement.where(
+                    date_column >= datetime.strptime(request.args['date_from'], '%Y-%m-%d').date())
+            if request.args.get('date_to'):
+                statement = statement.where(
+                    date_column <= datetime.strptime(request.args['date_to'], '%Y-%m-%d').date())
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        # Server-side cursor: rows arrive in batches while the response is streaming
+        statement = statement.order_by(date_column, model.id)\
+            .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+        header = [column.key for column in EMPLOYEE_COLUMNS + columns]
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        filename = f"{dataset}-{datetime.now().strftime('%Y%m%d')}.{extension}"
+        
+        def generate():
+            try:
+                rows = db.session.execute(statement)
+                yield from stream_export(fmt, header, rows, sheet_name=dataset.capitalize())
+            except Exception as e:
+                # Headers are already sent; the truncated file is the only signal left
+                logging.error(f"Export {dataset} error: {str(e)}")
+        
+        logging.info(f"Export of {dataset} as {fmt} by user {user.employee_id}")
+        
+        return Response(stream_with_context(generate()), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    
+    except Exception as e:
+        logging.error(f"Export error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
@@ -4,6 +4,11 @@ from models import User, Leave
 from app import db
 from datetime import datetime, timedelta
 from api import api_bp
+from sqlalchemy.orm.exc import StaleDataError
+from utils import get_current_principal, paginate_query, versioned_response, if_match_fails, precondition_failed
+from serializers import serializer_for, serialize, parse_fields, select_fields
+from cache import summary_cache
+from events import event_broker
 import logging
 
 @api_bp.route('/leaves', methods=['GET'])
@@ -11,7 +16,7 @@ import logging
 def get_leaves():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -19,55 +24,68 @@ def get_leaves():
         # Get query parameters with validation
         status = request.args.get('status')
         
-        try:
-            page = max(1, int(request.args.get('page', 1)))
-            per_page = max(1, min(100, int(request.args.get('per_page', 10))))
-        except ValueError:
-            return jsonify({'error': 'Invalid page or per_page parameter'}), 400
-        
         # Build query - HR/Admin see all leaves, others see only their own
-        if user.role in ['hr', 'admin']:
+        is_hr_view = user.role in ['hr', 'admin']
+        if is_hr_view:
             query = Leave.query
         else:
             query = Leave.query.filter_by(user_id=current_user_id)
         
         if status:
-            query = query.filter_by(status=status)
+            query = query.filter(Leave.status == status)
+        
+        try:
+            fields = parse_fields(Leave, request.args, also=('user',) if is_hr_view else ())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = select_fields(query, Leave, fields, keep=[Leave.created_at])
+        include_user = is_hr_view and (fields is None or 'user' in fields)
+        
+        # HR view fetches the employee columns in the same query as the page
+        if include_user:
+            query = query.outerjoin(User, User.id == Leave.user_id).add_columns(
+                User.id, User.first_name, User.last_name, User.employee_id, User.department, User.position
+            )
         
         # Get paginated results
-        leaves = query.order_by(Leave.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            leaves = paginate_query(query, [Leave.created_at, Leave.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Include user info for HR/Admin views
+        serialize_leave = serializer_for(Leave, fields)
         leaves_data = []
-        for leave in leaves.items:
-            leave_dict = leave.to_dict()
-            if user.role in ['hr', 'admin']:
-                if leave.user:
-                    leave_dict['user'] = {
-                        'id': leave.user.id,
-                        'first_name': leave.user.first_name,
-                        'last_name': leave.user.last_name,
-                        'department': leave.user.department,
-                        'position': leave.user.position
-                    }
-                else:
-                    leave_dict['user'] = {
-                        'id': None,
-                        'first_name': 'Unknown',
-                        'last_name': 'User',
-                        'department': 'N/A',
-                        'position': 'N/A'
-                    }
+        for item in leaves.items:
+            if not include_user:
+                leaves_data.append(serialize_leave(item))
+                continue
+            
+            leave, employee_pk, first_name, last_name, emp_id, department, position = item
+            leave_dict = serialize_leave(leave)
+            if employee_pk is not None:
+                leave_dict['user'] = {
+                    'id': employee_pk,
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'employee_id': emp_id,
+                    'department': department,
+                    'position': position
+                }
+            else:
+                leave_dict['user'] = {
+                    'id': None,
+                    'first_name': 'Unknown',
+                    'last_name': 'User',
+                    'employee_id': 'N/A',
+                    'department': 'N/A',
+                    'position': 'N/A'
+                }
             leaves_data.append(leave_dict)
         
         return jsonify({
             'leaves': leaves_data,
-            'total': leaves.total,
-            'pages': leaves.pages,
-            'current_page': page,
-            'per_page': per_page
+            **leaves.meta()
         }), 200
     
     except Exception as e:
@@ -79,7 +97,7 @@ def get_leaves():
 def create_leave_request():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -88,10 +106,10 @@ def create_leave_request():
             data = request.get_json(force=True)
         except Exception:
             return jsonify({'error': 'Request body must be valid JSON'}), 400
-            
+        
         if not data:
             return jsonify({'error': 'Request body must be valid JSON'}), 400
-            
+        
         required_fields = ['leave_type', 'start_date', 'end_date', 'reason']
         
         for field in required_fields:
@@ -132,6 +150,7 @@ def create_leave_request():
         
         db.session.add(leave)
         db.session.commit()
+        summary_cache.invalidate('leaves')
         
         return jsonify(leave.to_dict()), 201
     
@@ -145,12 +164,17 @@ def create_leave_request():
 def get_leave(leave_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        leave = Leave.query.get(leave_id)
+        try:
+            fields = parse_fields(Leave, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        leave = select_fields(Leave.query, Leave, fields, keep=[Leave.user_id, Leave.version]).get(leave_id)
         if not leave:
             return jsonify({'error': 'Leave request not found'}), 404
         
@@ -158,7 +182,7 @@ def get_leave(leave_id):
         if leave.user_id != current_user_id and user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
-        return jsonify(leave.to_dict()), 200
+        return versioned_response(leave, serialize(leave, fields))
     
     except Exception as e:
         logging.error(f"Get leave error: {str(e)}")
@@ -169,7 +193,7 @@ def get_leave(leave_id):
 def update_leave(leave_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -187,12 +211,18 @@ def update_leave(leave_id):
         if leave.user_id != current_user_id and user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
+        # Reject edits made against an older version of the record
+        if if_match_fails(leave):
+            return precondition_failed()
+        
         # Update leave status (HR/Admin only)
+        decided = False
         if 'status' in data and user.role in ['hr', 'admin']:
             leave.status = data['status']
             if data['status'] in ['approved', 'rejected']:
                 leave.approved_by = current_user_id
                 leave.approved_at = datetime.utcnow()
+                decided = True
         
         # Update other fields (owner or HR/Admin)
         if leave.user_id == current_user_id or user.role in ['hr', 'admin']:
@@ -200,7 +230,16 @@ def update_leave(leave_id):
                 leave.reason = data['reason']
         
         db.session.commit()
-        return jsonify(leave.to_dict()), 200
+        summary_cache.invalidate('leaves')
+        
+        leave_data = leave.to_dict()
+        if decided and leave.user_id != current_user_id:
+            event_broker.publish('leave.decided', leave_data, user_ids=[leave.user_id])
+        return versioned_response(leave, leave_data)
+    
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
     
     except Exception as e:
         logging.error(f"Update leave error: {str(e)}")
@@ -211,7 +250,7 @@ def update_leave(leave_id):
 def delete_leave(leave_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -230,9 +269,14 @@ def delete_leave(leave_id):
         
         db.session.delete(leave)
         db.session.commit()
+        summary_cache.invalidate('leaves')
         
         return jsonify({'message': 'Leave request deleted successfully'}), 200
     
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
+    
     except Exception as e:
         logging.error(f"Delete leave error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -1,109 +1,171 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Payroll
+from models import User, Payroll, PayrollYearTotal, PayrollRun
 from app import db
-from datetime import datetime
+from datetime import datetime, date
 from sqlalchemy import func
 from api import api_bp
+from sqlalchemy.orm.exc import StaleDataError
+from utils import (get_current_principal, paginate_query, conditional_get, freshness, version_freshness,
+                   versioned_response, if_match_fails, precondition_failed)
+from serializers import serializer_for, serialize, parse_fields, select_fields
+from rollups import payroll_snapshot, apply_payroll_change, year_range
+from payroll_runs import calculate_pay, run_payroll, PayrollRunInProgress
 import logging
 
+# Keys the HR list view adds to each record
+EMPLOYEE_FIELDS = ('employee_name', 'employee_id', 'department')
+
+def _payroll_query(user):
+    """Payroll records visible to ``user`` filtered by the request's
+    year/month/employee_id; raises ValueError for invalid parameters"""
+    year = request.args.get('year')
+    month = request.args.get('month')
+    employee_id = request.args.get('employee_id')  # For HR to filter by employee
+    
+    # Build query based on user role
+    if user.role in ['hr', 'admin']:
+        # HR can view all payroll records
+        if employee_id:
+            try:
+                query = Payroll.query.filter_by(user_id=int(employee_id))
+            except ValueError:
+                raise ValueError('Invalid employee_id parameter')
+        else:
+            query = Payroll.query
+    else:
+        # Employees can only view their own payroll
+        query = Payroll.query.filter_by(user_id=user.id)
+    
+    year_int = month_int = None
+    if year:
+        try:
+            year_int = int(year)
+        except ValueError:
+            raise ValueError('Invalid year parameter')
+        if year_int < 1900 or year_int > 2100:
+            raise ValueError('Invalid year parameter')
+    
+    if month:
+        try:
+            month_int = int(month)
+        except ValueError:
+            raise ValueError('Invalid month parameter')
+        if month_int < 1 or month_int > 12:
+            raise ValueError('Invalid month parameter')
+    
+    # Filter on a pay_period_start range so ix_payroll_user_period is usable
+    if year_int and month_int:
+        period_start = date(year_int, month_int, 1)
+        period_end = date(year_int + 1, 1, 1) if month_int == 12 else date(year_int, month_int + 1, 1)
+        query = query.filter(Payroll.pay_period_start >= period_start,
+                             Payroll.pay_period_start < period_end)
+    elif year_int:
+        period_start, period_end = year_range(year_int)
+        query = query.filter(Payroll.pay_period_start >= period_start,
+                             Payroll.pay_period_start < period_end)
+    elif month_int:
+        # A month in every year has no single range to seek on
+        query = query.filter(func.extract('month', Payroll.pay_period_start) == month_int)
+    
+    return query
+
+def _payroll_freshness(principal):
+    if principal.role not in ['hr', 'admin']:
+        return freshness(_payroll_query(principal), Payroll.updated_at)
+    # The HR view renders employee names and departments as well
+    return freshness(_payroll_query(principal).outerjoin(User, User.id == Payroll.user_id),
+                     Payroll.updated_at, User.updated_at)
+
 @api_bp.route('/payroll', methods=['GET'])
 @jwt_required()
+@conditional_get(_payroll_freshness)
 def get_payroll():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get query parameters with validation
-        year = request.args.get('year')
-        month = request.args.get('month')
-        employee_id = request.args.get('employee_id')  # For HR to filter by employee
-        
         try:
-            page = max(1, int(request.args.get('page', 1)))
-            per_page = max(1, min(100, int(request.args.get('per_page', 10))))
-        except ValueError:
-            return jsonify({'error': 'Invalid page or per_page parameter'}), 400
-        
-        # Build query based on user role
-        if user.role in ['hr', 'admin']:
-            # HR can view all payroll records
-            if employee_id:
-                try:
-                    query = Payroll.query.filter_by(user_id=int(employee_id))
-                except ValueError:
-                    return jsonify({'error': 'Invalid employee_id parameter'}), 400
-            else:
-                query = Payroll.query
-        else:
-            # Employees can only view their own payroll
-            query = Payroll.query.filter_by(user_id=current_user_id)
+            query = _payroll_query(user)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if year:
-            try:
-                year_int = int(year)
-                if year_int < 1900 or year_int > 2100:
-                    return jsonify({'error': 'Invalid year parameter'}), 400
-                query = query.filter(func.extract('year', Payroll.pay_period_start) == year_int)
-            except ValueError:
-                return jsonify({'error': 'Invalid year parameter'}), 400
+        is_hr_view = user.role in ['hr', 'admin']
         
-        if month:
-            try:
-                month_int = int(month)
-                if month_int < 1 or month_int > 12:
-                    return jsonify({'error': 'Invalid month parameter'}), 400
-                query = query.filter(func.extract('month', Payroll.pay_period_start) == month_int)
-            except ValueError:
-                return jsonify({'error': 'Invalid month parameter'}), 400
+        try:
+            fields = parse_fields(Payroll, request.args, also=EMPLOYEE_FIELDS if is_hr_view else ())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = select_fields(query, Payroll, fields, keep=[Payroll.pay_period_start])
+        include_employee = is_hr_view and (fields is None or not set(fields).isdisjoint(EMPLOYEE_FIELDS))
+        
+        # HR view fetches the employee columns in the same query as the page
+        if include_employee:
+            query = query.outerjoin(User, User.id == Payroll.user_id).add_columns(
+                User.first_name, User.last_name, User.employee_id, User.department
+            )
         
         # Get paginated results
-        payroll_records = query.order_by(Payroll.pay_period_start.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            payroll_records = paginate_query(query, [Payroll.pay_period_start, Payroll.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Include employee details for HR view
+        serialize_payroll = serializer_for(Payroll, fields)
         payroll_data = []
-        for record in payroll_records.items:
-            record_dict = record.to_dict()
-            if user.role in ['hr', 'admin']:
-                employee = User.query.get(record.user_id)
-                if employee:
-                    record_dict['employee_name'] = f"{employee.first_name} {employee.last_name}"
-                    record_dict['employee_id'] = employee.employee_id
-                    record_dict['department'] = employee.department
-                else:
-                    record_dict['employee_name'] = "Unknown Employee"
-                    record_dict['employee_id'] = "N/A"
-                    record_dict['department'] = "N/A"
+        for item in payroll_records.items:
+            if not include_employee:
+                payroll_data.append(serialize_payroll(item))
+                continue
+            
+            record, first_name, last_name, emp_id, department = item
+            record_dict = serialize_payroll(record)
+            if emp_id is not None:
+                employee = {'employee_name': f"{first_name} {last_name}", 'employee_id': emp_id,
+                            'department': department}
+            else:
+                employee = {'employee_name': "Unknown Employee", 'employee_id': "N/A", 'department': "N/A"}
+            record_dict.update((key, value) for key, value in employee.items()
+                               if fields is None or key in fields)
             payroll_data.append(record_dict)
         
         return jsonify({
             'payroll': payroll_data,
-            'total': payroll_records.total,
-            'pages': payroll_records.pages,
-            'current_page': page,
-            'per_page': per_page
+            **payroll_records.meta()
         }), 200
     
     except Exception as e:
         logging.error(f"Get payroll error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def _payroll_freshness_by_id(principal, payroll_id):
+    query = Payroll.query.filter_by(id=payroll_id)
+    if principal.role not in ['hr', 'admin']:
+        # Others' records count as no rows, leaving the 403 to the view
+        query = query.filter_by(user_id=principal.id)
+    return version_freshness(query, Payroll)
+
 @api_bp.route('/payroll/<int:payroll_id>', methods=['GET'])
 @jwt_required()
+@conditional_get(_payroll_freshness_by_id)
 def get_payroll_detail(payroll_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        payroll = Payroll.query.get(payroll_id)
+        try:
+            fields = parse_fields(Payroll, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        payroll = select_fields(Payroll.query, Payroll, fields,
+                                keep=[Payroll.user_id, Payroll.version]).get(payroll_id)
         if not payroll:
             return jsonify({'error': 'Payroll record not found'}), 404
         
@@ -111,7 +173,7 @@ def get_payroll_detail(payroll_id):
         if payroll.user_id != current_user_id and user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
-        return jsonify(payroll.to_dict()), 200
+        return versioned_response(payroll, serialize(payroll, fields))
     
     except Exception as e:
         logging.error(f"Get payroll detail error: {str(e)}")
@@ -122,44 +184,47 @@ def get_payroll_detail(payroll_id):
 def get_payroll_summary():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         # Get current year payroll summary
         current_year = datetime.now().year
-        
-        # Total earnings this year
-        total_earnings = db.session.query(
-            db.func.sum(Payroll.net_pay)
-        ).filter_by(user_id=current_user_id).filter(
-            db.extract('year', Payroll.pay_period_start) == current_year
-        ).scalar() or 0
-        
-        # Total tax deductions this year
-        total_tax = db.session.query(
-            db.func.sum(Payroll.tax_deduction)
-        ).filter_by(user_id=current_user_id).filter(
-            db.extract('year', Payroll.pay_period_start) == current_year
-        ).scalar() or 0
-        
-        # Latest payroll record
-        latest_payroll = Payroll.query.filter_by(user_id=current_user_id)\
-            .order_by(Payroll.pay_period_start.desc()).first()
-        
-        # Monthly breakdown for current year
-        monthly_breakdown = db.session.query(
-            db.extract('month', Payroll.pay_period_start).label('month'),
-            db.func.sum(Payroll.net_pay).label('total_pay'),
-            db.func.sum(Payroll.tax_deduction).label('total_tax')
-        ).filter_by(user_id=current_user_id).filter(
-            db.extract('year', Payroll.pay_period_start) == current_year
-        ).group_by(db.extract('month', Payroll.pay_period_start)).all()
+        year_start, year_end = year_range(current_year)
+        
+        # One statement returns this year's records plus the latest one
+        # (ranked first by a window over all the user's records), each row
+        # also carrying the year-to-date totals maintained by create/update_payroll
+        rank = func.row_number().over(order_by=(Payroll.pay_period_start.desc(), Payroll.id.desc()))
+        ranked = db.select(Payroll.id, rank.label('rank'))\
+            .where(Payroll.user_id == current_user_id).subquery()
+        
+        def year_total(column):
+            return db.select(column).where(PayrollYearTotal.user_id == current_user_id,
+                                           PayrollYearTotal.year == current_year).scalar_subquery()
+        
+        in_year = db.and_(Payroll.pay_period_start >= year_start, Payroll.pay_period_start < year_end)
+        rows = db.session.query(
+            Payroll, ranked.c.rank, year_total(PayrollYearTotal.net_pay), year_total(PayrollYearTotal.tax_deduction)
+        ).join(ranked, ranked.c.id == Payroll.id)\
+            .filter(db.or_(ranked.c.rank == 1, in_year))\
+            .order_by(Payroll.pay_period_start).all()
+        
+        latest_payroll = None
+        ytd_pay = ytd_tax = None
+        monthly_breakdown = {}
+        for record, position, ytd_pay, ytd_tax in rows:
+            if position == 1:
+                latest_payroll = record
+            if year_start <= record.pay_period_start < year_end:
+                totals = monthly_breakdown.setdefault(record.pay_period_start.month, [0, 0])
+                totals[0] += record.net_pay or 0
+                totals[1] += record.tax_deduction or 0
         
         summary = {
-            'total_earnings_ytd': float(total_earnings),
-            'total_tax_ytd': float(total_tax),
+            'total_earnings_ytd': float(ytd_pay or 0),
+            'total_tax_ytd': float(ytd_tax or 0),
             'latest_payroll': latest_payroll.to_dict() if latest_payroll else None,
             'monthly_breakdown': [
                 {
@@ -167,7 +232,7 @@ def get_payroll_summary():
                     'total_pay': float(total_pay),
                     'total_tax': float(total_tax)
                 }
-                for month, total_pay, total_tax in monthly_breakdown
+                for month, (total_pay, total_tax) in sorted(monthly_breakdown.items())
             ]
         }
         
@@ -181,8 +246,7 @@ def get_payroll_summary():
 @jwt_required()
 def create_payroll():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied. Only HR can create payroll records.'}), 403
@@ -213,8 +277,7 @@ def create_payroll():
         overtime_pay = float(data.get('overtime_pay', 0))
         tax_deduction = float(data.get('tax_deduction', 0))
         
-        gross_pay = basic_salary + allowances + overtime_pay
-        net_pay = gross_pay - deductions - tax_deduction
+        gross_pay, net_pay = calculate_pay(basic_salary, allowances, deductions, overtime_pay, tax_deduction)
         
         # Create new payroll record
         payroll = Payroll(
@@ -233,9 +296,10 @@ def create_payroll():
         )
         
         db.session.add(payroll)
+        apply_payroll_change(None, payroll_snapshot(payroll))
         db.session.commit()
         
-        logging.info(f"Payroll record created for employee {employee.employee_id} by HR user {user.username}")
+        logging.info(f"Payroll record created for employee {employee.employee_id} by HR user {user.employee_id}")
         
         return jsonify(payroll.to_dict()), 201
     
@@ -247,8 +311,7 @@ def create_payroll():
 @jwt_required()
 def update_payroll(payroll_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied. Only HR can update payroll records.'}), 403
@@ -257,7 +320,12 @@ def update_payroll(payroll_id):
         if not payroll:
             return jsonify({'error': 'Payroll record not found'}), 404
         
+        # Reject edits made against an older version of the record
+        if if_match_fails(payroll):
+            return precondition_failed()
+        
         data = request.get_json()
+        before = payroll_snapshot(payroll)
         
         # Update fields if provided
         if 'basic_salary' in data:
@@ -276,25 +344,102 @@ def update_payroll(payroll_id):
             payroll.status = data['status']
         
         # Recalculate gross pay and net pay
-        payroll.gross_pay = payroll.basic_salary + payroll.allowances + payroll.overtime_pay
-        payroll.net_pay = payroll.gross_pay - payroll.deductions - payroll.tax_deduction
+        payroll.gross_pay, payroll.net_pay = calculate_pay(
+            payroll.basic_salary, payroll.allowances, payroll.deductions,
+            payroll.overtime_pay, payroll.tax_deduction
+        )
         
+        apply_payroll_change(before, payroll_snapshot(payroll))
         db.session.commit()
         
-        logging.info(f"Payroll record {payroll_id} updated by HR user {user.username}")
+        logging.info(f"Payroll record {payroll_id} updated by HR user {user.employee_id}")
         
-        return jsonify(payroll.to_dict()), 200
+        return versioned_response(payroll)
+    
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
     
     except Exception as e:
         logging.error(f"Update payroll error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@api_bp.route('/payroll/runs', methods=['POST'])
+@jwt_required()
+def create_payroll_run():
+    try:
+        current_user_id = int(get_jwt_identity())
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied. Only HR can run payroll.'}), 403
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Request body must be valid JSON'}), 400
+        
+        for field in ['pay_period_start', 'pay_period_end']:
+            if field not in data:
+                return jsonify({'error': f'Missing required field: {field}'}), 400
+        
+        try:
+            pay_period_start = datetime.strptime(data['pay_period_start'], '%Y-%m-%d').date()
+            pay_period_end = datetime.strptime(data['pay_period_end'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        if pay_period_start > pay_period_end:
+            return jsonify({'error': 'Pay period start must be before end'}), 400
+        
+        # Users with no earlier payroll record get this salary, or are skipped
+        default_basic_salary = data.get('default_basic_salary')
+        if default_basic_salary is not None:
+            try:
+                default_basic_salary = float(default_basic_salary)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid default_basic_salary'}), 400
+        
+        try:
+            run = run_payroll(pay_period_start, pay_period_end, current_user_id, default_basic_salary)
+        except PayrollRunInProgress as e:
+            return jsonify({'error': str(e)}), 409
+        
+        logging.info(f"Payroll run {run.id} completed by HR user {user.employee_id}")
+        
+        return jsonify(run.to_dict()), 201
+    
+    except Exception as e:
+        logging.error(f"Create payroll run error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/payroll/runs', methods=['GET'])
+@jwt_required()
+def get_payroll_runs():
+    try:
+        user = get_current_principal()
+        
+        if not user or user.role not in ['hr', 'admin']:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        try:
+            runs = paginate_query(PayrollRun.query, [PayrollRun.started_at, PayrollRun.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'runs': [run.to_dict() for run in runs.items],
+            **runs.meta()
+        }), 200
+    
+    except Exception as e:
+        logging.error(f"Get payroll runs error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @api_bp.route('/employees/list', methods=['GET'])
 @jwt_required()
 def get_employees_list():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
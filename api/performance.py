@@ -4,6 +4,9 @@ from models import User, PerformanceReview
 from app import db
 from datetime import datetime
 from api import api_bp
+from sqlalchemy.orm.exc import StaleDataError
+from utils import get_current_principal, paginate_query, versioned_response, if_match_fails, precondition_failed
+from serializers import serialize, serialize_all, parse_fields, select_fields
 import logging
 
 @api_bp.route('/performance/reviews', methods=['GET'])
@@ -11,7 +14,7 @@ import logging
 def get_performance_reviews():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -19,8 +22,6 @@ def get_performance_reviews():
         # Get query parameters
         user_id = request.args.get('user_id')
         status = request.args.get('status')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
         
         # Build query
         query = PerformanceReview.query
@@ -37,16 +38,16 @@ def get_performance_reviews():
             query = query.filter_by(status=status)
         
         # Get paginated results
-        reviews = query.order_by(PerformanceReview.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(PerformanceReview, request.args)
+            query = select_fields(query, PerformanceReview, fields, keep=[PerformanceReview.created_at])
+            reviews = paginate_query(query, [PerformanceReview.created_at, PerformanceReview.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'reviews': [review.to_dict() for review in reviews.items],
-            'total': reviews.total,
-            'pages': reviews.pages,
-            'current_page': page,
-            'per_page': per_page
+            'reviews': serialize_all(PerformanceReview, reviews.items, fields),
+            **reviews.meta()
         }), 200
     
     except Exception as e:
@@ -58,7 +59,7 @@ def get_performance_reviews():
 def create_performance_review():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -112,12 +113,18 @@ def create_performance_review():
 def get_performance_review(review_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        review = PerformanceReview.query.get(review_id)
+        try:
+            fields = parse_fields(PerformanceReview, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        review = select_fields(PerformanceReview.query, PerformanceReview, fields,
+                               keep=[PerformanceReview.user_id, PerformanceReview.version]).get(review_id)
         if not review:
             return jsonify({'error': 'Performance review not found'}), 404
         
@@ -125,7 +132,7 @@ def get_performance_review(review_id):
         if review.user_id != current_user_id and user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
-        return jsonify(review.to_dict()), 200
+        return versioned_response(review, serialize(review, fields))
     
     except Exception as e:
         logging.error(f"Get performance review error: {str(e)}")
@@ -136,7 +143,7 @@ def get_performance_review(review_id):
 def update_performance_review(review_id):
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -149,6 +156,10 @@ def update_performance_review(review_id):
         if review.reviewer_id != current_user_id and user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
         
+        # Reject edits made against an older version of the record
+        if if_match_fails(review):
+            return precondition_failed()
+        
         data = request.get_json()
         
         # Update fields
@@ -174,7 +185,11 @@ def update_performance_review(review_id):
             review.status = data['status']
         
         db.session.commit()
-        return jsonify(review.to_dict()), 200
+        return versioned_response(review)
+    
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
     
     except Exception as e:
         logging.error(f"Update performance review error: {str(e)}")
@@ -184,8 +199,7 @@ def update_performance_review(review_id):
 @jwt_required()
 def delete_performance_review(review_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -199,6 +213,10 @@ def delete_performance_review(review_id):
         
         return jsonify({'message': 'Performance review deleted successfully'}), 200
     
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
+    
     except Exception as e:
         logging.error(f"Delete performance review error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -208,7 +226,7 @@ def delete_performance_review(review_id):
 def get_performance_metrics():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -4,19 +4,31 @@ from models import User
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from api import api_bp
+from sqlalchemy.orm.exc import StaleDataError
+from utils import get_current_principal, forget_principals, conditional_get, freshness, precondition_failed
+from serializers import serialize, parse_fields
+from cache import summary_cache
+from rollups import move_department_rollups
 import logging
 
 @api_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@conditional_get(lambda principal: freshness(User.query.filter_by(id=principal.id), User.updated_at))
 def get_profile():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
+        user = principal.user if principal else None
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify(user.to_dict()), 200
+        try:
+            fields = parse_fields(User, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # The principal's row is already loaded, so only the output is trimmed
+        return jsonify(serialize(user, fields)), 200
     
     except Exception as e:
         logging.error(f"Get profile error: {str(e)}")
@@ -27,7 +39,8 @@ def get_profile():
 def update_profile():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
+        user = principal.user if principal else None
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -48,6 +61,10 @@ def update_profile():
                 return jsonify({'error': 'Email already exists'}), 409
             user.email = data['email']
         
+        # Principals read the department from cached auth state
+        department_changed = 'department' in data and data['department'] != user.department
+        if department_changed:
+            move_department_rollups([user.id], data['department'])
         if 'department' in data:
             user.department = data['department']
         
@@ -55,8 +72,15 @@ def update_profile():
             user.position = data['position']
         
         db.session.commit()
+        if department_changed:
+            forget_principals([user.id])
+        summary_cache.invalidate('users')
         return jsonify(user.to_dict()), 200
     
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
+    
     except Exception as e:
         logging.error(f"Update profile error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -65,8 +89,8 @@ def update_profile():
 @jwt_required()
 def change_password():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
+        user = principal.user if principal else None
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -90,6 +114,10 @@ def change_password():
         
         return jsonify({'message': 'Password updated successfully'}), 200
     
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
+    
     except Exception as e:
         logging.error(f"Change password error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -1,47 +1,48 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Job, JobApplication
+from models import Job, JobApplication
 from app import db
 from datetime import datetime
 from api import api_bp
+from utils import get_current_principal, paginate_query, conditional_get, freshness
+from serializers import serialize, serialize_all, parse_fields, select_fields
 import logging
 
+def _jobs_query():
+    status = request.args.get('status', 'active')
+    department = request.args.get('department')
+    
+    query = Job.query
+    
+    if status:
+        query = query.filter_by(status=status)
+    
+    if department:
+        query = query.filter_by(department=department)
+    
+    return query
+
 @api_bp.route('/recruitment/jobs', methods=['GET'])
 @jwt_required()
+@conditional_get(lambda principal: freshness(_jobs_query(), Job.updated_at))
 def get_jobs():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get query parameters
-        status = request.args.get('status', 'active')
-        department = request.args.get('department')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-        
-        # Build query
-        query = Job.query
-        
-        if status:
-            query = query.filter_by(status=status)
-        
-        if department:
-            query = query.filter_by(department=department)
-        
         # Get paginated results
-        jobs = query.order_by(Job.posted_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(Job, request.args)
+            query = select_fields(_jobs_query(), Job, fields, keep=[Job.posted_at])
+            jobs = paginate_query(query, [Job.posted_at, Job.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'jobs': [job.to_dict() for job in jobs.items],
-            'total': jobs.total,
-            'pages': jobs.pages,
-            'current_page': page,
-            'per_page': per_page
+            'jobs': serialize_all(Job, jobs.items, fields),
+            **jobs.meta()
         }), 200
     
     except Exception as e:
@@ -53,7 +54,7 @@ def get_jobs():
 def create_job():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -99,19 +100,24 @@ def create_job():
 
 @api_bp.route('/recruitment/jobs/<int:job_id>', methods=['GET'])
 @jwt_required()
+@conditional_get(lambda principal, job_id: freshness(Job.query.filter_by(id=job_id), Job.updated_at))
 def get_job(job_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        job = Job.query.get(job_id)
+        try:
+            fields = parse_fields(Job, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        job = select_fields(Job.query, Job, fields).get(job_id)
         if not job:
             return jsonify({'error': 'Job not found'}), 404
         
-        return jsonify(job.to_dict()), 200
+        return jsonify(serialize(job, fields)), 200
     
     except Exception as e:
         logging.error(f"Get job error: {str(e)}")
@@ -121,8 +127,7 @@ def get_job(job_id):
 @jwt_required()
 def update_job(job_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -220,8 +225,7 @@ def apply_for_job(job_id):
 @jwt_required()
 def get_applications():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -229,8 +233,6 @@ def get_applications():
         # Get query parameters
         job_id = request.args.get('job_id')
         status = request.args.get('status')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
         
         # Build query
         query = JobApplication.query
@@ -242,16 +244,16 @@ def get_applications():
             query = query.filter_by(status=status)
         
         # Get paginated results
-        applications = query.order_by(JobApplication.applied_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        try:
+            fields = parse_fields(JobApplication, request.args)
+            query = select_fields(query, JobApplication, fields, keep=[JobApplication.applied_at])
+            applications = paginate_query(query, [JobApplication.applied_at, JobApplication.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         return jsonify({
-            'applications': [app.to_dict() for app in applications.items],
-            'total': applications.total,
-            'pages': applications.pages,
-            'current_page': page,
-            'per_page': per_page
+            'applications': serialize_all(JobApplication, applications.items, fields),
+            **applications.meta()
         }), 200
     
     except Exception as e:
@@ -262,8 +264,7 @@ def get_applications():
 @jwt_required()
 def update_application(application_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'Access denied'}), 403
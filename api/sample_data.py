@@ -4,6 +4,9 @@ from models import User, Attendance, Leave, Announcement
 from app import db
 from datetime import datetime, timedelta
 from api import api_bp
+from utils import get_current_principal
+from rollups import attendance_snapshot, apply_attendance_change
+from cache import summary_cache
 import logging
 
 @api_bp.route('/sample-data/create', methods=['POST'])
@@ -12,7 +15,7 @@ def create_sample_data():
     """Create sample data for demonstration purposes"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         # Only allow admin to create sample data
         if not user or user.role != 'admin':
@@ -40,6 +43,7 @@ def create_sample_data():
                     status='present'
                 )
                 db.session.add(attendance)
+                apply_attendance_change(None, attendance_snapshot(attendance))
                 
             # Create yesterday's attendance as well
             existing_yesterday = Attendance.query.filter_by(
@@ -57,6 +61,7 @@ def create_sample_data():
                     status='present'
                 )
                 db.session.add(attendance_yesterday)
+                apply_attendance_change(None, attendance_snapshot(attendance_yesterday))
         
         # Create a sample leave request
         sample_leave = Leave.query.filter_by(status='pending').first()
@@ -85,6 +90,7 @@ def create_sample_data():
             db.session.add(announcement)
         
         db.session.commit()
+        summary_cache.invalidate('attendance', 'leaves', 'announcements')
         
         return jsonify({
             'message': 'Sample data created successfully',
@@ -1,16 +1,19 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Settings
+from models import Settings
 from app import db
 from api import api_bp
+from utils import get_current_principal, conditional_get, freshness
 import logging
 
 @api_bp.route('/settings', methods=['GET'])
 @jwt_required()
+@conditional_get(lambda principal: freshness(Settings.query.filter_by(user_id=principal.id),
+                                                  Settings.updated_at))
 def get_settings():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -34,7 +37,7 @@ def get_settings():
 def update_settings():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -1,29 +1,52 @@
 import os
+import json
 import logging
-from datetime import datetime
-from flask import request, jsonify
+from datetime import datetime, timedelta
+from flask import request, jsonify, Response, stream_with_context, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import func, case
+from sqlalchemy.orm import aliased, contains_eager, joinedload
 from werkzeug.utils import secure_filename
 from api import api_bp
 from app import db
 from models import Ticket, TicketComment, User
-from utils import allowed_file, admin_required, hr_or_admin_required
+from sqlalchemy.orm.exc import StaleDataError
+from utils import (allowed_file, admin_required, hr_or_admin_required, get_current_principal, paginate_query,
+                   versioned_response, if_match_fails, precondition_failed)
+from serializers import serializer_for, serialize, serialize_all, parse_fields, select_fields
+from events import event_broker
 
 # Configure file upload
 UPLOAD_FOLDER = 'uploads/tickets'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+STREAM_BATCH_SIZE = 500  # Rows fetched per round trip when streaming
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+def increment_comments_count(ticket):
+    """Bump the denormalized comment counter in SQL so concurrent comments don't race.
+    
+    This is a plain UPDATE rather than an ORM flush: it bumps the ticket's
+    version without checking it, so comments never fail with a conflict
+    but do invalidate If-Match tokens taken before them.
+    """
+    db.session.execute(
+        db.update(Ticket).where(Ticket.id == ticket.id).values(
+            comments_count=func.coalesce(Ticket.comments_count, 0) + 1,
+            updated_at=datetime.utcnow(),
+            version=Ticket.version + 1
+        ).execution_options(synchronize_session=False)
+    )
+
 @api_bp.route('/tickets/', methods=['POST'])
 @jwt_required()
 def create_ticket():
     """Create a new ticket"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -91,16 +114,34 @@ def create_ticket():
 @api_bp.route('/tickets/', methods=['GET'])
 @jwt_required()
 def list_tickets():
-    """List tickets with filtering support"""
+    """List tickets with filtering support.
+    
+    Paginated like the other listings (``page`` or ``cursor``). With
+    ``format=ndjson`` every matching ticket is streamed one JSON object
+    per line, read from a server-side cursor in fixed-size batches.
+    """
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Build query
-        query = Ticket.query
+        try:
+            fields = parse_fields(Ticket, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Build query - creator/assignee names come from the same joined query
+        creator = aliased(User)
+        assignee = aliased(User)
+        query = Ticket.query\
+            .outerjoin(creator, Ticket.creator)\
+            .outerjoin(assignee, Ticket.assignee)\
+            .options(
+                contains_eager(Ticket.creator.of_type(creator)).load_only(creator.first_name, creator.last_name),
+                contains_eager(Ticket.assignee.of_type(assignee)).load_only(assignee.first_name, assignee.last_name)
+            )
         
         # Apply filters from query parameters
         status = request.args.get('status')
@@ -130,27 +171,62 @@ def list_tickets():
                 (Ticket.assigned_to == current_user_id)
             )
         
-        # Order by creation date (newest first)
-        tickets = query.order_by(Ticket.created_at.desc()).all()
+        query = select_fields(query, Ticket, fields, keep=[Ticket.created_at])
+        
+        if request.args.get('format') == 'ndjson':
+            return stream_tickets_ndjson(query, fields)
+        
+        # Get paginated results (newest first)
+        try:
+            tickets = paginate_query(query, [Ticket.created_at, Ticket.id], request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        return jsonify([ticket.to_dict() for ticket in tickets]), 200
+        return jsonify({
+            'tickets': serialize_all(Ticket, tickets.items, fields),
+            **tickets.meta()
+        }), 200
         
     except Exception as e:
         logging.error(f"List tickets error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def stream_tickets_ndjson(query, fields=None):
+    """Stream the query results as NDJSON without materializing the full list"""
+    # A 2.0-style select is needed: legacy Query uniquifies eager joins, which yield_per forbids
+    statement = query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).statement\
+        .execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    
+    serialize_ticket = serializer_for(Ticket, fields)
+    
+    def generate():
+        try:
+            for ticket in db.session.scalars(statement):
+                yield current_app.json.dumps(serialize_ticket(ticket)) + '\n'
+        except Exception as e:
+            logging.error(f"Stream tickets error: {str(e)}")
+            yield json.dumps({'error': 'Internal server error'}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @api_bp.route('/tickets/<int:ticket_id>/', methods=['GET'])
 @jwt_required()
 def get_ticket_details(ticket_id):
     """Get full ticket details including comments timeline"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        ticket = Ticket.query.get(ticket_id)
+        try:
+            fields = parse_fields(Ticket, request.args, also=('comments',))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        ticket = select_fields(Ticket.query, Ticket, fields,
+                               keep=[Ticket.created_by, Ticket.assigned_to, Ticket.version]).get(ticket_id)
         if not ticket:
             return jsonify({'error': 'Ticket not found'}), 404
         
@@ -160,13 +236,15 @@ def get_ticket_details(ticket_id):
                 return jsonify({'error': 'Access denied'}), 403
         
         # Get ticket details with comments
-        ticket_data = ticket.to_dict()
+        ticket_data = serialize(ticket, fields)
         
         # Get comments ordered by creation date
-        comments = TicketComment.query.filter_by(ticket_id=ticket_id).order_by(TicketComment.created_at.asc()).all()
-        ticket_data['comments'] = [comment.to_dict() for comment in comments]
+        if fields is None or 'comments' in fields:
+            comments = TicketComment.query.options(joinedload(TicketComment.author))\
+                .filter_by(ticket_id=ticket_id).order_by(TicketComment.created_at.asc()).all()
+            ticket_data['comments'] = [comment.to_dict() for comment in comments]
         
-        return jsonify(ticket_data), 200
+        return versioned_response(ticket, ticket_data)
         
     except Exception as e:
         logging.error(f"Get ticket details error: {str(e)}")
@@ -178,7 +256,7 @@ def add_comment(ticket_id):
     """Add a comment to a ticket"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -207,13 +285,17 @@ def add_comment(ticket_id):
         
         db.session.add(comment)
         
-        # Update ticket's updated_at timestamp
-        ticket.updated_at = datetime.utcnow()
+        # Update ticket's updated_at timestamp and comment counter
+        increment_comments_count(ticket)
         
         db.session.commit()
         
+        comment_data = comment.to_dict()
+        event_broker.publish('ticket.comment', {'ticket_id': ticket_id, 'comment': comment_data},
+                             user_ids={ticket.created_by, ticket.assigned_to} - {current_user_id})
+        
         logging.info(f"Comment added to ticket {ticket_id} by user {current_user_id}")
-        return jsonify(comment.to_dict()), 201
+        return jsonify(comment_data), 201
         
     except Exception as e:
         logging.error(f"Add comment error: {str(e)}")
@@ -225,7 +307,7 @@ def update_ticket(ticket_id):
     """Update ticket status, assignment, priority, or category (admin/HR only)"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -238,8 +320,14 @@ def update_ticket(ticket_id):
         if not ticket:
             return jsonify({'error': 'Ticket not found'}), 404
         
+        # Reject edits made against an older version of the record
+        if if_match_fails(ticket):
+            return precondition_failed()
+        
         data = request.get_json()
         updated_fields = []
+        # A reassigned ticket's previous assignee hears about it too
+        watchers = {ticket.created_by, ticket.assigned_to}
         
         # Update status
         if 'status' in data:
@@ -283,21 +371,29 @@ def update_ticket(ticket_id):
         
         if updated_fields:
             ticket.updated_at = datetime.utcnow()
-            db.session.commit()
             
             # Add system comment about the update
-            update_comment = f"Ticket updated by {user.first_name} {user.last_name}: {', '.join(updated_fields)}"
+            author = user.user
+            update_comment = f"Ticket updated by {author.first_name} {author.last_name}: {', '.join(updated_fields)}"
             comment = TicketComment(
                 ticket_id=ticket_id,
                 user_id=current_user_id,
                 comment_text=update_comment
             )
             db.session.add(comment)
+            increment_comments_count(ticket)
             db.session.commit()
             
+            event_broker.publish('ticket.updated', {'ticket': serialize(ticket), 'changes': updated_fields},
+                                 user_ids=(watchers | {ticket.assigned_to}) - {current_user_id})
+            
             logging.info(f"Ticket {ticket_id} updated by user {current_user_id}: {', '.join(updated_fields)}")
         
-        return jsonify(ticket.to_dict()), 200
+        return versioned_response(ticket)
+    
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
         
     except Exception as e:
         logging.error(f"Update ticket error: {str(e)}")
@@ -328,13 +424,42 @@ def get_ticket_categories():
         logging.error(f"Get categories error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def compute_ticket_stats(query):
+    """Aggregate ticket counts for ``query`` in a single grouped SELECT"""
+    def count_where(condition):
+        return func.sum(case((condition, 1), else_=0))
+    
+    rows = query.with_entities(
+        Ticket.category,
+        func.count(Ticket.id),
+        count_where(Ticket.status == 'open'),
+        count_where(Ticket.status == 'in_progress'),
+        count_where(Ticket.status == 'closed'),
+        count_where(Ticket.assigned_to.is_(None)),
+        count_where(Ticket.priority == 'high'),
+        count_where(Ticket.priority == 'urgent')
+    ).group_by(Ticket.category).all()
+    
+    keys = ['total_tickets', 'open_tickets', 'in_progress_tickets', 'closed_tickets',
+            'unassigned_tickets', 'high_priority_tickets', 'urgent_tickets']
+    stats = dict.fromkeys(keys, 0)
+    categories = {}
+    
+    # One row per category, so summing them here is cheap
+    for category, *counts in rows:
+        categories[category] = counts[0]
+        for key, value in zip(keys, counts):
+            stats[key] += int(value or 0)
+    
+    stats['tickets_by_category'] = categories
+    return stats
+
 @api_bp.route('/tickets/stats/', methods=['GET'])
 @jwt_required()
 def get_ticket_stats():
-    """Get ticket statistics (admin/HR only)"""
+    """Get ticket statistics (admin/HR only), optionally filtered by date range and category"""
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -342,28 +467,30 @@ def get_ticket_stats():
         if user.role not in ['admin', 'hr']:
             return jsonify({'error': 'Access denied. Only admin and HR can view statistics'}), 403
         
-        # Get ticket statistics
-        stats = {
-            'total_tickets': Ticket.query.count(),
-            'open_tickets': Ticket.query.filter_by(status='open').count(),
-            'in_progress_tickets': Ticket.query.filter_by(status='in_progress').count(),
-            'closed_tickets': Ticket.query.filter_by(status='closed').count(),
-            'unassigned_tickets': Ticket.query.filter_by(assigned_to=None).count(),
-            'high_priority_tickets': Ticket.query.filter_by(priority='high').count(),
-            'urgent_tickets': Ticket.query.filter_by(priority='urgent').count(),
-        }
-        
-        # Get tickets by category
-        categories = {}
-        for ticket in Ticket.query.all():
-            if ticket.category in categories:
-                categories[ticket.category] += 1
-            else:
-                categories[ticket.category] = 1
+        query = Ticket.query
+        
+        date_from = request.args.get('date_from')
+        if date_from:
+            try:
+                from_date = datetime.strptime(date_from, '%Y-%m-%d')
+                query = query.filter(Ticket.created_at >= from_date)
+            except ValueError:
+                return jsonify({'error': 'Invalid date_from format. Use YYYY-MM-DD'}), 400
+        
+        date_to = request.args.get('date_to')
+        if date_to:
+            try:
+                # Inclusive of the whole end day
+                to_date = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+                query = query.filter(Ticket.created_at < to_date)
+            except ValueError:
+                return jsonify({'error': 'Invalid date_to format. Use YYYY-MM-DD'}), 400
         
-        stats['tickets_by_category'] = categories
+        category = request.args.get('category')
+        if category:
+            query = query.filter(Ticket.category == category)
         
-        return jsonify(stats), 200
+        return jsonify(compute_ticket_stats(query)), 200
         
     except Exception as e:
         logging.error(f"Get ticket stats error: {str(e)}")
@@ -375,7 +502,7 @@ def download_attachment(ticket_id):
     """Download ticket attachment"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -7,6 +7,7 @@ from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from serializers import FastJSONProvider
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -19,6 +20,7 @@ jwt = JWTManager()
 
 def create_app():
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     
     # Configuration
     app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
@@ -31,9 +33,46 @@ def create_app():
         "pool_recycle": 300,
         "pool_pre_ping": True,
     }
+    if database_url.startswith("postgresql"):
+        # A gevent worker serves up to --worker-connections requests at once;
+        # they share this pool and wait up to DB_POOL_TIMEOUT for a connection
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+            "pool_size": int(os.environ.get("DB_POOL_SIZE", 20)),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 30)),
+            "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        })
     app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "jwt-secret-key")
     app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=24)
     app.config["JWT_IDENTITY_CLAIM"] = "sub"
+    app.config["PRINCIPAL_CACHE_TTL"] = int(os.environ.get("PRINCIPAL_CACHE_TTL", 30))
+    app.config["CACHE_REDIS_URL"] = os.environ.get("CACHE_REDIS_URL")
+    app.config["SUMMARY_CACHE_TTL"] = int(os.environ.get("SUMMARY_CACHE_TTL", 60))
+    app.config["PAYROLL_RUN_LOCK_TIMEOUT"] = int(os.environ.get("PAYROLL_RUN_LOCK_TIMEOUT", 3600))
+    app.config["BULK_HASH_WORKERS"] = int(os.environ.get("BULK_HASH_WORKERS", 0)) or min(4, os.cpu_count() or 1)
+    app.config["EVENTS_REDIS_URL"] = os.environ.get("EVENTS_REDIS_URL") or app.config["CACHE_REDIS_URL"]
+    app.config["EVENTS_HEARTBEAT"] = float(os.environ.get("EVENTS_HEARTBEAT", 15))
+    app.config["EVENTS_MAX_CONNECTIONS"] = int(os.environ.get("EVENTS_MAX_CONNECTIONS", 1000))
+    app.config["EVENTS_TOKEN_TTL"] = int(os.environ.get("EVENTS_TOKEN_TTL", 60))
+    app.config["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY")
+    app.config["OPENAI_BASE_URL"] = os.environ.get("OPENAI_BASE_URL")
+    # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+    # do not change this unless explicitly requested by the user
+    app.config["CHATBOT_MODEL"] = os.environ.get("CHATBOT_MODEL", "gpt-4o")
+    app.config["CHATBOT_MAX_CONCURRENCY"] = int(os.environ.get("CHATBOT_MAX_CONCURRENCY", 8))
+    app.config["CHATBOT_TIMEOUT"] = float(os.environ.get("CHATBOT_TIMEOUT", 10))
+    app.config["CHATBOT_DEADLINE"] = float(os.environ.get("CHATBOT_DEADLINE", 30))
+    app.config["CHATBOT_QUEUE_TIMEOUT"] = float(os.environ.get("CHATBOT_QUEUE_TIMEOUT", 0.5))
+    app.config["CHATBOT_BREAKER_THRESHOLD"] = int(os.environ.get("CHATBOT_BREAKER_THRESHOLD", 5))
+    app.config["CHATBOT_BREAKER_RESET"] = float(os.environ.get("CHATBOT_BREAKER_RESET", 30))
+    app.config["CHATBOT_CACHE_SIZE"] = int(os.environ.get("CHATBOT_CACHE_SIZE", 500))
+    app.config["CHATBOT_CACHE_TTL"] = int(os.environ.get("CHATBOT_CACHE_TTL", 3600))
+    app.config["CHATBOT_CACHE_SIMILARITY"] = float(os.environ.get("CHATBOT_CACHE_SIMILARITY", 0.85))
+    app.config["CHATBOT_KNOWLEDGE_DIR"] = os.environ.get("CHATBOT_KNOWLEDGE_DIR")
+    app.config["CHATBOT_KNOWLEDGE_RELOAD"] = float(os.environ.get("CHATBOT_KNOWLEDGE_RELOAD", 5))
+    app.config["CHATBOT_KNOWLEDGE_MIN_SCORE"] = float(os.environ.get("CHATBOT_KNOWLEDGE_MIN_SCORE", 1.0))
+    app.config["CHATBOT_MEMORY_TURNS"] = int(os.environ.get("CHATBOT_MEMORY_TURNS", 20))
+    app.config["CHATBOT_MEMORY_TOKENS"] = int(os.environ.get("CHATBOT_MEMORY_TOKENS", 1000))
+    app.config["CHATBOT_MEMORY_TTL"] = int(os.environ.get("CHATBOT_MEMORY_TTL", 1800))
     
     # Enable CORS
     CORS(app, supports_credentials=True)
@@ -45,6 +84,24 @@ def create_app():
     db.init_app(app)
     jwt.init_app(app)
     
+    from cache import summary_cache
+    summary_cache.init_app(app)
+    
+    from events import event_broker
+    event_broker.init_app(app)
+    
+    from llm import init_llm
+    init_llm(app)
+    
+    from chat_cache import init_chat_cache
+    init_chat_cache(app)
+    
+    from knowledge import init_knowledge
+    init_knowledge(app)
+    
+    from chat_memory import init_chat_memory
+    init_chat_memory(app)
+    
     # Register blueprints
     from api import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
@@ -53,6 +110,10 @@ def create_app():
     from auth import auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
+    # Register CLI commands
+    from commands import register_commands
+    register_commands(app)
+    
     # Frontend route
     @app.route('/')
     def index():
@@ -70,6 +131,10 @@ def create_app():
         import models
         db.create_all()
         
+        # Databases created before newer model columns need them added
+        from commands import add_missing_columns
+        add_missing_columns()
+        
         # Create default admin user if not exists
         from models import User
         from werkzeug.security import generate_password_hash
@@ -0,0 +1,214 @@
+import csv
+import io
+import logging
+from datetime import date, datetime, time, timezone
+from app import db
+from models import User
+from rollups import rebuild_attendance_rollups
+
+# Rows parsed and written per transaction
+IMPORT_CHUNK_SIZE = 5000
+# Row errors kept in the report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+CSV_COLUMNS = ('employee_id', 'date', 'clock_in', 'clock_out', 'hours_worked', 'status', 'notes')
+REQUIRED_COLUMNS = ('employee_id', 'date')
+VALID_STATUSES = ('present', 'absent', 'late')
+
+# Columns written to Attendance, in COPY order
+WRITE_COLUMNS = ('user_id', 'date', 'clock_in', 'clock_out', 'hours_worked', 'status', 'notes',
+                 'created_at', 'updated_at')
+
+def _parse_clock(value, day):
+    """Accept HH:MM[:SS] (on the row's date) or a full ISO datetime"""
+    if not value:
+        return None
+    if 'T' in value or ' ' in value:
+        parsed = datetime.fromisoformat(value)
+    else:
+        parsed = datetime.combine(day, time.fromisoformat(value))
+    # Attendance stores naive UTC; an explicit offset is converted to it
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _parse_row(row, employee_ids):
+    """Validate one CSV row (a dict of stripped strings); return the
+    Attendance values or raise ValueError"""
+    employee_id = row['employee_id']
+    user_id = employee_ids.get(employee_id)
+    if user_id is None:
+        raise ValueError(f'Unknown employee_id {employee_id!r}')
+
+    try:
+        day = date.fromisoformat(row['date'])
+    except ValueError:
+        raise ValueError('Invalid date. Use YYYY-MM-DD')
+
+    try:
+        clock_in = _parse_clock(row['clock_in'], day)
+        clock_out = _parse_clock(row['clock_out'], day)
+    except ValueError:
+        raise ValueError('Invalid clock_in/clock_out. Use HH:MM or an ISO datetime')
+    if clock_in and clock_out and clock_out < clock_in:
+        raise ValueError('clock_out is before clock_in')
+
+    hours = row['hours_worked']
+    if hours:
+        try:
+            hours_worked = float(hours)
+        except ValueError:
+            raise ValueError('Invalid hours_worked')
+        if hours_worked < 0 or hours_worked > 24:
+            raise ValueError('hours_worked must be between 0 and 24')
+    elif clock_in and clock_out:
+        hours_worked = round((clock_out - clock_in).total_seconds() / 3600, 2)
+    else:
+        hours_worked = 0.0
+
+    status = row['status'].lower() or 'present'
+    if status not in VALID_STATUSES:
+        raise ValueError(f"Invalid status {status!r}. Use one of: {', '.join(VALID_STATUSES)}")
+
+    return {
+        'user_id': user_id,
+        'date': day,
+        'clock_in': clock_in,
+        'clock_out': clock_out,
+        'hours_worked': hours_worked,
+        'status': status,
+        'notes': row['notes'] or None
+    }
+
+def _sqlite_datetime(value):
+    # SQLAlchemy's SQLite storage format, so the driver-level executemany
+    # below can skip per-value bind processing
+    return value.isoformat(sep=' ', timespec='microseconds') if value else None
+
+def _upsert_executemany(rows, now):
+    columns = ', '.join(WRITE_COLUMNS)
+    placeholders = ', '.join('?' for _ in WRITE_COLUMNS)
+    updates = ', '.join(f'{name} = excluded.{name}' for name in WRITE_COLUMNS
+                        if name not in ('user_id', 'date', 'created_at'))
+    stamp = _sqlite_datetime(now)
+    db.session.connection().exec_driver_sql(
+        f'INSERT INTO attendance ({columns}) VALUES ({placeholders}) '
+        f'ON CONFLICT (user_id, date) DO UPDATE SET {updates}',
+        [(row['user_id'], row['date'].isoformat(), _sqlite_datetime(row['clock_in']),
+          _sqlite_datetime(row['clock_out']), row['hours_worked'], row['status'], row['notes'],
+          stamp, stamp) for row in rows]
+    )
+
+def _upsert_copy(rows, now):
+    """COPY the chunk into a temp table, then upsert it with one INSERT ... SELECT"""
+    connection = db.session.connection()
+    columns = ', '.join(WRITE_COLUMNS)
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in WRITE_COLUMNS
+                        if name not in ('user_id', 'date', 'created_at'))
+
+    connection.exec_driver_sql(
+        'CREATE TEMP TABLE IF NOT EXISTS attendance_import_stage '
+        '(LIKE attendance INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+    )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row['user_id'], row['date'], row['clock_in'] or '', row['clock_out'] or '',
+                         row['hours_worked'], row['status'], row['notes'] or '', now, now])
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY attendance_import_stage ({columns}) FROM STDIN WITH (FORMAT csv, NULL '')", buffer
+        )
+    finally:
+        cursor.close()
+
+    connection.exec_driver_sql(
+        f'INSERT INTO attendance ({columns}) SELECT {columns} FROM attendance_import_stage '
+        f'ON CONFLICT (user_id, date) DO UPDATE SET {updates}'
+    )
+
+def _write_chunk(rows, dialect):
+    # One row per key per statement: ON CONFLICT cannot touch a row twice
+    deduped = list({(row['user_id'], row['date']): row for row in rows}.values())
+    now = datetime.utcnow()
+    if dialect == 'postgresql':
+        _upsert_copy(deduped, now)
+    elif dialect == 'sqlite':
+        _upsert_executemany(deduped, now)
+    else:
+        raise RuntimeError(f'Attendance import does not support {dialect}')
+    db.session.commit()
+    return len(deduped)
+
+def _widen(span, day_from, day_to):
+    """The (first, last) date span covering ``span`` and the given days"""
+    if span is None:
+        return day_from, day_to
+    return min(span[0], day_from), max(span[1], day_to)
+
+def import_attendance_csv(stream, chunk_size=IMPORT_CHUNK_SIZE):
+    """Stream-import attendance rows from a CSV text stream.
+
+    Rows are matched to users by employee_id and upserted on
+    (user_id, date) one chunk per transaction, so memory stays bounded and
+    a failure keeps the chunks already committed. The attendance rollups
+    are rebuilt for the date range of the committed rows afterwards,
+    whether or not the import completed.
+
+    Returns a report with row counts and per-line errors.
+    """
+    reader = csv.reader(stream)
+    header = [name.strip().lower() for name in next(reader, [])]
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+    # Optional columns absent from the file read as ''
+    positions = [(name, header.index(name) if name in header else None) for name in CSV_COLUMNS]
+
+    # employee_id -> user id, loaded once for the whole import
+    employee_ids = dict(db.session.query(User.employee_id, User.id).all())
+    dialect = db.session.get_bind().dialect.name
+
+    report = {'processed': 0, 'imported': 0, 'error_count': 0, 'errors': []}
+    # Date span of the rows in ``chunk``, and of the rows committed so far
+    chunk, chunk_span, committed_span = [], None, None
+
+    try:
+        for fields in reader:
+            if not fields:
+                continue
+            report['processed'] += 1
+            row = {name: fields[index].strip() if index is not None and index < len(fields) else ''
+                   for name, index in positions}
+            try:
+                values = _parse_row(row, employee_ids)
+            except ValueError as e:
+                report['error_count'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': reader.line_num, 'error': str(e)})
+                continue
+
+            chunk.append(values)
+            chunk_span = _widen(chunk_span, values['date'], values['date'])
+
+            if len(chunk) >= chunk_size:
+                report['imported'] += _write_chunk(chunk, dialect)
+                committed_span = _widen(committed_span, *chunk_span)
+                chunk, chunk_span = [], None
+
+        if chunk:
+            report['imported'] += _write_chunk(chunk, dialect)
+            committed_span = _widen(committed_span, *chunk_span)
+    finally:
+        # Also after a failure, so the chunks already committed are counted
+        if committed_span is not None:
+            db.session.rollback()
+            rebuild_attendance_rollups(*committed_span)
+
+    logging.info(f"Attendance import: {report['processed']} rows, {report['imported']} upserted, "
+                 f"{report['error_count']} errors")
+    return report
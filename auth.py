@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required
 from werkzeug.security import check_password_hash, generate_password_hash
 from models import User
 from app import db
+from utils import get_current_principal, principal_claims
+from cache import summary_cache
 import logging
 
 auth_bp = Blueprint('auth', __name__)
@@ -23,7 +25,7 @@ def login():
             if not user.is_active:
                 return jsonify({'error': 'Account is deactivated'}), 401
             
-            access_token = create_access_token(identity=str(user.id))
+            access_token = create_access_token(identity=str(user.id), additional_claims=principal_claims(user))
             return jsonify({
                 'access_token': access_token,
                 'user': user.to_dict()
@@ -70,8 +72,9 @@ def register():
         
         db.session.add(user)
         db.session.commit()
+        summary_cache.invalidate('users')
         
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_access_token(identity=str(user.id), additional_claims=principal_claims(user))
         return jsonify({
             'access_token': access_token,
             'user': user.to_dict()
@@ -85,13 +88,12 @@ def register():
 @jwt_required()
 def get_current_user():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        principal = get_current_principal()
         
-        if not user:
+        if not principal or not principal.user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify(user.to_dict()), 200
+        return jsonify(principal.user.to_dict()), 200
     
     except Exception as e:
         logging.error(f"Get current user error: {str(e)}")
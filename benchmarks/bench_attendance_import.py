@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark the streaming CSV attendance import.
+
+Writes a CSV of `--rows` attendance rows for `--users` benchmark users,
+then times import_attendance_csv over it and reports rows per second.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_attendance_import.py --rows 1000000
+    python benchmarks/bench_attendance_import.py   # SQLite scratch file
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:////tmp/hr_bench_attendance_import.db"
+
+from app import create_app, db
+from bench_indexes import seed_users
+
+
+def write_csv(path, rows, employee_ids):
+    """Write `rows` attendance rows cycling through `employee_ids`"""
+    start = date.today() - timedelta(days=rows // len(employee_ids) + 1)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['employee_id', 'date', 'clock_in', 'clock_out', 'status'])
+        for i in range(rows):
+            day = start + timedelta(days=i // len(employee_ids))
+            writer.writerow([employee_ids[i % len(employee_ids)], day.isoformat(), '09:00', '17:30', 'present'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='CSV rows to import')
+    parser.add_argument('--users', type=int, default=2000, help='distinct employees')
+    parser.add_argument('--chunk-size', type=int, default=None, help='rows per transaction')
+    parser.add_argument('--csv', default='/tmp/hr_bench_attendance_import.csv', help='CSV scratch path')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        from models import Attendance, User
+        from attendance_import import import_attendance_csv, IMPORT_CHUNK_SIZE
+
+        user_ids = seed_users(args.users)
+        employee_ids = [row.employee_id for row in
+                        db.session.query(User.employee_id).filter(User.id.in_(user_ids))]
+        db.session.query(Attendance).delete()
+        db.session.commit()
+
+        write_csv(args.csv, args.rows, employee_ids)
+
+        for label in ('insert', 'upsert over existing rows'):
+            with open(args.csv, newline='') as f:
+                start = time.perf_counter()
+                report = import_attendance_csv(f, args.chunk_size or IMPORT_CHUNK_SIZE)
+                elapsed = time.perf_counter() - start
+            print(f"{label}: {report['processed']} rows in {elapsed:.2f}s "
+                  f"({report['processed'] / elapsed:,.0f} rows/s), {report['error_count']} errors")
+
+
+if __name__ == '__main__':
+    main()
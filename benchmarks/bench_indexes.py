@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot query shapes with and without the model indexes.
+
+Seeds a scratch database, drops the indexes declared in models.py, times
+each query and prints its plan, then rebuilds the indexes and repeats.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_indexes.py --rows 1000000
+    python benchmarks/bench_indexes.py --rows 200000   # SQLite scratch file
+"""
+
+import os
+import sys
+import time
+import argparse
+import random
+from datetime import datetime, date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:////tmp/hr_bench_indexes.db"
+
+from sqlalchemy import text
+
+from app import create_app, db
+
+QUERIES = {
+    'attendance_user_date': (
+        "SELECT * FROM attendance WHERE user_id = :user_id AND date = :day",
+        lambda ctx: {'user_id': ctx['user_id'], 'day': ctx['today']}
+    ),
+    'attendance_present_today': (
+        "SELECT COUNT(DISTINCT user_id) FROM attendance WHERE date = :day",
+        lambda ctx: {'day': ctx['today']}
+    ),
+    'leave_user_pending': (
+        "SELECT COUNT(*) FROM leave WHERE user_id = :user_id AND status = 'pending'",
+        lambda ctx: {'user_id': ctx['user_id']}
+    ),
+    'leave_pending_recent': (
+        "SELECT * FROM leave WHERE status = 'pending' ORDER BY created_at DESC LIMIT 5",
+        lambda ctx: {}
+    ),
+    'ticket_open': (
+        "SELECT COUNT(*) FROM ticket WHERE status = 'open'",
+        lambda ctx: {}
+    ),
+    'ticket_created_by': (
+        "SELECT * FROM ticket WHERE created_by = :user_id ORDER BY created_at DESC",
+        lambda ctx: {'user_id': ctx['user_id']}
+    ),
+    'ticket_assigned_to': (
+        "SELECT * FROM ticket WHERE assigned_to = :user_id ORDER BY created_at DESC",
+        lambda ctx: {'user_id': ctx['user_id']}
+    ),
+    'ticket_comments': (
+        "SELECT * FROM ticket_comment WHERE ticket_id = :ticket_id ORDER BY created_at",
+        lambda ctx: {'ticket_id': ctx['ticket_id']}
+    ),
+    'payroll_user_year': (
+        "SELECT * FROM payroll WHERE user_id = :user_id "
+        "AND pay_period_start >= :year_start AND pay_period_start < :year_end ORDER BY pay_period_start",
+        lambda ctx: {'user_id': ctx['user_id'], 'year_start': date(ctx['today'].year, 1, 1),
+                     'year_end': date(ctx['today'].year + 1, 1, 1)}
+    ),
+    # The literal matches the partial index's WHERE clause, which a bound parameter would not
+    'announcement_active_recent': (
+        "SELECT * FROM announcement WHERE is_active = {true} ORDER BY created_at DESC LIMIT 5",
+        lambda ctx: {}
+    ),
+}
+
+
+def seed_users(count):
+    """Create `count` benchmark users and return their ids"""
+    from models import User
+    now = datetime.utcnow()
+    existing = User.query.filter(User.username.like('bench_%')).count()
+    if existing < count:
+        db.session.execute(User.__table__.insert(), [{
+            'username': f'bench_{i}',
+            'email': f'bench_{i}@example.com',
+            'password_hash': '!',
+            'first_name': 'Bench',
+            'last_name': str(i),
+            'employee_id': f'BENCH{i:06d}',
+            'department': f'Dept {i % 20}',
+            'role': 'employee',
+            'is_active': True,
+            'auth_version': 0,
+            'created_at': now,
+            'updated_at': now
+        } for i in range(existing, count)])
+    db.session.commit()
+    return [row.id for row in db.session.query(User.id).filter(User.username.like('bench_%')).limit(count)]
+
+
+def insert_batches(model, rows):
+    """Insert the dicts from `rows` into `model`'s table 10000 at a time"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == 10000:
+            db.session.execute(model.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(model.__table__.insert(), batch)
+
+
+def month_start(today, months_back):
+    """First day of the month `months_back` months before `today`'s"""
+    index = today.year * 12 + today.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def seed(rows, users):
+    """Insert `rows` attendance records, rows / 10 leave, ticket, ticket
+    comment and payroll records, and rows / 100 announcements"""
+    from models import Attendance, Leave, Ticket, TicketComment, Payroll, Announcement
+    for model in (Attendance, Leave, TicketComment, Ticket, Payroll, Announcement):
+        db.session.query(model).delete()
+    db.session.commit()
+
+    today = date.today()
+    now = datetime.utcnow()
+    insert_batches(Attendance, ({
+        'user_id': users[i % len(users)],
+        'date': today - timedelta(days=i // len(users)),
+        'hours_worked': 8.0,
+        'status': 'present',
+        'created_at': now,
+        'updated_at': now
+    } for i in range(rows)))
+
+    db.session.execute(Leave.__table__.insert(), [{
+        'user_id': users[i % len(users)],
+        'leave_type': 'vacation',
+        'start_date': today,
+        'end_date': today,
+        'days_requested': 1,
+        'status': 'pending' if random.random() < 0.02 else 'approved',
+        'created_at': now - timedelta(minutes=i),
+        'updated_at': now
+    } for i in range(rows // 10)])
+
+    # Most tickets are closed; each user raises some and is assigned others
+    insert_batches(Ticket, ({
+        'title': f'Ticket {i}',
+        'description': 'Benchmark ticket',
+        'category': 'IT',
+        'priority': 'medium',
+        'status': 'open' if random.random() < 0.05 else 'closed',
+        'created_by': users[i % len(users)],
+        'assigned_to': users[(i * 7) % len(users)],
+        'comments_count': 0,
+        'created_at': now - timedelta(minutes=i),
+        'updated_at': now,
+        'version': 1
+    } for i in range(rows // 10)))
+    ticket_ids = [row.id for row in db.session.query(Ticket.id)]
+    insert_batches(TicketComment, ({
+        'ticket_id': ticket_ids[i % len(ticket_ids)],
+        'user_id': users[i % len(users)],
+        'comment_text': 'Benchmark comment',
+        'created_at': now - timedelta(minutes=i)
+    } for i in range(rows // 10)))
+
+    # One payslip per user and month, going back from the current month
+    insert_batches(Payroll, ({
+        'user_id': users[i % len(users)],
+        'pay_period_start': month_start(today, i // len(users)),
+        'pay_period_end': month_start(today, i // len(users)) + timedelta(days=27),
+        'basic_salary': 5000,
+        'gross_pay': 5000,
+        'net_pay': 4000,
+        'status': 'paid',
+        'created_at': now,
+        'updated_at': now,
+        'version': 1
+    } for i in range(rows // 10)))
+
+    insert_batches(Announcement, ({
+        'title': f'Announcement {i}',
+        'content': 'Benchmark announcement',
+        'author_id': users[i % len(users)],
+        'is_active': random.random() < 0.1,
+        'created_at': now - timedelta(hours=i),
+        'updated_at': now
+    } for i in range(rows // 100)))
+    db.session.commit()
+    return ticket_ids
+
+
+def explain(sql, params):
+    dialect = db.engine.dialect.name
+    prefix = 'EXPLAIN ANALYZE ' if dialect == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    rows = db.session.execute(text(prefix + sql), params).fetchall()
+    return '\n'.join('    ' + ' '.join(str(col) for col in row) for row in rows)
+
+
+def run_queries(label, ctx, repeat):
+    print(f"\n=== {label} ===")
+    true = 'true' if db.engine.dialect.name == 'postgresql' else '1'
+    for name, (sql, make_params) in QUERIES.items():
+        sql = sql.format(true=true)
+        params = make_params(ctx)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            db.session.execute(text(sql), params).fetchall()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+        print(f"{name}: {elapsed_ms:.3f} ms/query")
+        print(explain(sql, params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='attendance rows to seed')
+    parser.add_argument('--users', type=int, default=2000, help='distinct user ids')
+    parser.add_argument('--repeat', type=int, default=20, help='executions per query')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        from models import Attendance, Leave, Ticket, TicketComment, Payroll, Announcement
+        models = (Attendance, Leave, Ticket, TicketComment, Payroll, Announcement)
+        indexes = [index for model in models for index in model.__table__.indexes]
+
+        for index in indexes:
+            index.drop(bind=db.engine, checkfirst=True)
+
+        users = seed_users(args.users)
+        start = time.perf_counter()
+        ticket_ids = seed(args.rows, users)
+        print(f"Seeded {args.rows} attendance rows in {time.perf_counter() - start:.1f}s")
+
+        ctx = {'user_id': users[len(users) // 2], 'ticket_id': ticket_ids[len(ticket_ids) // 2],
+               'today': date.today()}
+        run_queries('without indexes', ctx, args.repeat)
+
+        start = time.perf_counter()
+        for index in indexes:
+            index.create(bind=db.engine, checkfirst=True)
+        if db.engine.dialect.name == 'postgresql':
+            for model in models:
+                db.session.execute(text(f"ANALYZE {model.__tablename__}"))
+        else:
+            db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        print(f"\nBuilt indexes in {time.perf_counter() - start:.1f}s")
+
+        run_queries('with indexes', ctx, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON serialization of list pages: to_dict() with the stdlib
+provider vs. the compiled per-model serializers with FastJSONProvider.
+
+Usage:
+    python benchmarks/bench_serializers.py --rows 1000
+    DATABASE_URL=postgresql://... python benchmarks/bench_serializers.py
+"""
+
+import os
+import sys
+import time
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:////tmp/hr_bench_serializers.db"
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import create_app, db
+
+
+def seed(count):
+    """Replace all payroll and attendance rows with `count` random ones each"""
+    from models import Attendance, Payroll, User
+    db.session.query(Payroll).delete()
+    db.session.query(Attendance).delete()
+    db.session.commit()
+
+    user_ids = [row.id for row in db.session.query(User.id).all()]
+    now = datetime.utcnow()
+    payroll, attendance = [], []
+    for i in range(count):
+        start = date(2000, 1, 1) + timedelta(days=31 * (i // len(user_ids)))
+        basic = random.randint(3000, 9000)
+        payroll.append({
+            'user_id': user_ids[i % len(user_ids)], 'pay_period_start': start,
+            'pay_period_end': start + timedelta(days=30), 'basic_salary': basic, 'allowances': 250,
+            'deductions': 100, 'overtime_hours': 2.5, 'overtime_pay': 120, 'gross_pay': basic + 370,
+            'tax_deduction': basic * 0.2, 'net_pay': basic * 0.8 + 270, 'status': 'paid',
+            'version': 1, 'created_at': now, 'updated_at': now
+        })
+        clock_in = datetime(2000, 1, 1, 9) + timedelta(days=i // len(user_ids))
+        attendance.append({
+            'user_id': user_ids[i % len(user_ids)], 'date': clock_in.date(), 'clock_in': clock_in,
+            'clock_out': clock_in + timedelta(hours=8, minutes=random.randint(0, 90)),
+            'hours_worked': 8.5, 'status': 'present', 'notes': None, 'created_at': now, 'updated_at': now
+        })
+    db.session.execute(Payroll.__table__.insert(), payroll)
+    db.session.execute(Attendance.__table__.insert(), attendance)
+    db.session.commit()
+
+
+def measure(label, func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+    print(f"  {label}: {elapsed_ms:.2f} ms/page")
+    return result, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per page')
+    parser.add_argument('--repeat', type=int, default=50, help='serializations per implementation')
+    args = parser.parse_args()
+
+    app = create_app()
+    stdlib = DefaultJSONProvider(app)
+    with app.app_context():
+        from models import Attendance, Payroll
+        from serializers import orjson, serialize_all
+
+        seed(args.rows)
+        print(f"Seeded {args.rows} payroll and attendance rows; orjson "
+              f"{'installed' if orjson else 'not installed (stdlib fallback)'}")
+
+        for model in (Payroll, Attendance):
+            records = model.query.all()
+            print(f"{model.__name__} ({len(records)} rows):")
+            old, old_ms = measure('to_dict + stdlib json',
+                                  lambda: stdlib.dumps([record.to_dict() for record in records]), args.repeat)
+            measure('to_dict + fast provider',
+                    lambda: app.json.dumps([record.to_dict() for record in records]), args.repeat)
+            new, new_ms = measure('compiled serializer + fast provider',
+                                  lambda: app.json.dumps(serialize_all(model, records)), args.repeat)
+            print(f"  speedup: {old_ms / new_ms:.1f}x")
+
+            if app.json.loads(old) != app.json.loads(new):
+                print("MISMATCH between implementations")
+                sys.exit(1)
+        print("Results match")
+
+
+if __name__ == '__main__':
+    main()
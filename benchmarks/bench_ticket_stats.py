@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark ticket statistics: the old per-metric counts vs. the single
+grouped aggregate used by GET /api/tickets/stats/.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_ticket_stats.py --tickets 100000
+    python benchmarks/bench_ticket_stats.py   # SQLite scratch file
+"""
+
+import os
+import sys
+import time
+import argparse
+import random
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.environ.get("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:////tmp/hr_bench_ticket_stats.db"
+
+from sqlalchemy import event
+
+from app import create_app, db
+
+CATEGORIES = ['IT Support', 'HR', 'Facilities', 'Finance', 'Equipment',
+              'Access Request', 'Software Issue', 'Hardware Issue', 'Network Issue', 'General']
+
+
+def seed(count):
+    """Replace all tickets with `count` random ones"""
+    from models import Ticket, TicketComment, User
+    db.session.query(TicketComment).delete()
+    db.session.query(Ticket).delete()
+    db.session.commit()
+
+    user_ids = [row.id for row in db.session.query(User.id).all()]
+    now = datetime.utcnow()
+    batch = []
+    for i in range(count):
+        batch.append({
+            'title': f'Ticket {i}',
+            'description': 'Benchmark ticket ' * 10,
+            'priority': random.choice(['low', 'medium', 'high', 'urgent']),
+            'category': random.choice(CATEGORIES),
+            'status': random.choice(['open', 'in_progress', 'closed']),
+            'created_by': random.choice(user_ids),
+            'assigned_to': random.choice(user_ids + [None]),
+            'comments_count': 0,
+            'created_at': now - timedelta(minutes=i),
+            'updated_at': now
+        })
+        if len(batch) == 10000:
+            db.session.execute(Ticket.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Ticket.__table__.insert(), batch)
+    db.session.commit()
+
+
+def legacy_stats():
+    """The previous implementation: seven COUNTs plus loading every ticket"""
+    from models import Ticket
+    stats = {
+        'total_tickets': Ticket.query.count(),
+        'open_tickets': Ticket.query.filter_by(status='open').count(),
+        'in_progress_tickets': Ticket.query.filter_by(status='in_progress').count(),
+        'closed_tickets': Ticket.query.filter_by(status='closed').count(),
+        'unassigned_tickets': Ticket.query.filter_by(assigned_to=None).count(),
+        'high_priority_tickets': Ticket.query.filter_by(priority='high').count(),
+        'urgent_tickets': Ticket.query.filter_by(priority='urgent').count(),
+    }
+    categories = {}
+    for ticket in Ticket.query.all():
+        categories[ticket.category] = categories.get(ticket.category, 0) + 1
+    stats['tickets_by_category'] = categories
+    return stats
+
+
+def measure(label, func, repeat):
+    statements = []
+
+    def before_cursor_execute(*args):
+        statements.append(args[2])
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+            db.session.expunge_all()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    print(f"{label}: {elapsed_ms:.1f} ms/call, {len(statements) // repeat} queries/call")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=100000, help='tickets to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='calls per implementation')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        from models import Ticket
+        from api.tickets import compute_ticket_stats
+
+        start = time.perf_counter()
+        seed(args.tickets)
+        print(f"Seeded {args.tickets} tickets in {time.perf_counter() - start:.1f}s")
+
+        old = measure('legacy (per-metric counts + full load)', legacy_stats, args.repeat)
+        new = measure('grouped aggregate', lambda: compute_ticket_stats(Ticket.query), args.repeat)
+
+        if old != new:
+            print("MISMATCH between implementations")
+            sys.exit(1)
+        print("Results match")
+
+
+if __name__ == '__main__':
+    main()
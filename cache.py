@@ -0,0 +1,132 @@
+import json
+import logging
+import threading
+import time
+from flask import current_app
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class LocalCacheBackend:
+    """Per-process TTL store, used when no shared Redis is configured"""
+
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, name):
+        with self._lock:
+            return self._generations.get(name, 0)
+
+    def get(self, name, scope, generation):
+        with self._lock:
+            entry = self._entries.get(name, {}).get((generation, scope))
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def set(self, name, scope, generation, value, ttl):
+        with self._lock:
+            # A value computed before an invalidation must not be stored
+            if self._generations.get(name, 0) != generation:
+                return
+            self._entries.setdefault(name, {})[(generation, scope)] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, name):
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            self._entries.pop(name, None)
+
+class RedisCacheBackend:
+    """Redis store shared by all workers.
+
+    Each fragment name has a generation counter that is part of every key,
+    so invalidating a name (INCR) drops all of its scopes at once. Callers
+    read the generation once, before computing, so a value computed across
+    an invalidation is written under the old generation and never served.
+    """
+
+    def __init__(self, url, prefix='hr:summary:'):
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def generation(self, name):
+        return int(self._client.get(f"{self._prefix}gen:{name}") or 0)
+
+    def _key(self, name, scope, generation):
+        return f"{self._prefix}{name}:{generation}:{scope}"
+
+    def get(self, name, scope, generation):
+        raw = self._client.get(self._key(name, scope, generation))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, name, scope, generation, value, ttl):
+        self._client.set(self._key(name, scope, generation), json.dumps(value), ex=ttl)
+
+    def invalidate(self, name):
+        self._client.incr(f"{self._prefix}gen:{name}")
+
+class SummaryCache:
+    """Cache for org-wide summary fragments shown on the dashboards.
+
+    Fragments are JSON-serializable values identified by a name (what was
+    computed) and a scope (who may see it, plus any date it depends on).
+    Write endpoints call ``invalidate`` with the names their change affects;
+    ``SUMMARY_CACHE_TTL`` bounds staleness for anything they miss.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SUMMARY_CACHE_TTL', 60)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+
+        backend = LocalCacheBackend()
+        redis_url = app.config['CACHE_REDIS_URL']
+        if redis_url:
+            if redis is None:
+                logging.warning("CACHE_REDIS_URL is set but the redis package is not installed. Using a per-process "
+                                "summary cache; workers may serve stale dashboard summaries.")
+            else:
+                backend = RedisCacheBackend(redis_url)
+
+        app.extensions['summary_cache'] = backend
+
+    def _backend(self):
+        return current_app.extensions['summary_cache']
+
+    def get_or_compute(self, name, scope, compute):
+        """Return the cached fragment, computing and storing it on a miss"""
+        backend = self._backend()
+
+        try:
+            generation = backend.generation(name)
+            value = backend.get(name, scope, generation)
+            if value is not None:
+                return value
+        except Exception as e:
+            logging.warning(f"Summary cache read error: {str(e)}")
+            return compute()
+
+        value = compute()
+        try:
+            backend.set(name, scope, generation, value, current_app.config['SUMMARY_CACHE_TTL'])
+        except Exception as e:
+            logging.warning(f"Summary cache write error: {str(e)}")
+        return value
+
+    def invalidate(self, *names):
+        """Drop every scope of the named fragments"""
+        backend = self._backend()
+        for name in names:
+            try:
+                backend.invalidate(name)
+            except Exception as e:
+                logging.warning(f"Summary cache invalidate error: {str(e)}")
+
+summary_cache = SummaryCache()
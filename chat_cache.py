@@ -0,0 +1,188 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from flask import current_app
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Words that carry no meaning for matching questions. Negations and "in"
+# are kept: "carry over leave" / "not carry over leave" and "clock in" /
+# "clock out" must not collapse into one question.
+STOPWORDS = frozenset("""
+a an the and or of to on at for from with by about as into per each every is are was were be been am do does did
+i me my we our you your it its this that these those there here what which who whom how when where why
+can could would should will shall may might must please tell know want need get got hi hello hey
+""".split())
+
+_SUFFIXES = ('ing', 'ies', 'ed', 's')
+
+def stem(word):
+    """Strip a plural or verb ending, so "leaves" and "leave" or
+    "approved" and "approve" become the same term"""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith('ss'):
+            word = word[:-len(suffix)] + ('y' if suffix == 'ies' else '')
+            break
+    if word.endswith('e') and not word.endswith('ee') and len(word) > 3:
+        word = word[:-1]
+    return word
+
+def tokenize(text):
+    """Lowercased, stemmed content words of ``text``"""
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+class _Entry:
+    __slots__ = ('terms', 'answer', 'expires_at', 'latency')
+
+    def __init__(self, terms, answer, expires_at, latency):
+        self.terms = terms
+        self.answer = answer
+        self.expires_at = expires_at
+        self.latency = latency
+
+class SemanticCache:
+    """Chatbot answers keyed on the normalized question.
+
+    A lookup first tries the exact token sequence, then the most similar
+    cached question by TF-IDF cosine (at least ``similarity``), using an
+    inverted index so only questions sharing a term are scored. Each
+    answer belongs to the ``scope`` it was stored under, any hashable
+    value naming what went into the prompt besides the question, and is
+    only served back within it. Entries expire after ``ttl`` seconds and
+    the least recently used are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries=500, ttl=3600, similarity=0.85):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        # (scope, question key) -> _Entry, oldest use first
+        self._entries = OrderedDict()
+        self._postings = {}
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._saved_seconds = 0.0
+
+    def get(self, question, scope):
+        """Cached answer for ``question`` within ``scope``, or None"""
+        terms = tokenize(question)
+        if not terms:
+            return None
+        key = ' '.join(terms)
+        now = time.monotonic()
+
+        with self._lock:
+            self._counters['lookups'] += 1
+            entry_key = (scope, key)
+            entry = self._live(entry_key, now)
+            if entry is not None:
+                return self._hit(entry_key, entry, 'exact_hits')
+
+            entry_key = self._most_similar(Counter(terms), scope, now)
+            if entry_key is not None:
+                return self._hit(entry_key, self._entries[entry_key], 'similar_hits')
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, question, answer, scope, latency=0.0):
+        """Store ``answer`` for questions like ``question`` within ``scope``"""
+        terms = tokenize(question)
+        if not terms or not answer:
+            return
+        entry_key = (scope, ' '.join(terms))
+
+        with self._lock:
+            self._remove(entry_key)
+            self._entries[entry_key] = _Entry(Counter(terms), answer, time.monotonic() + self.ttl, latency)
+            for term in set(terms):
+                self._postings.setdefault(term, set()).add(entry_key)
+            self._counters['stores'] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['lookups']
+            hits = self._counters['exact_hits'] + self._counters['similar_hits']
+            return {
+                'entries': len(self._entries),
+                'lookups': lookups,
+                'hits': hits,
+                'exact_hits': self._counters['exact_hits'],
+                'similar_hits': self._counters['similar_hits'],
+                'misses': self._counters['misses'],
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'latency_saved_seconds': round(self._saved_seconds, 3),
+                'stores': self._counters['stores'],
+                'evictions': self._counters['evictions'],
+                'expirations': self._counters['expirations']
+            }
+
+    def _hit(self, entry_key, entry, counter):
+        self._entries.move_to_end(entry_key)
+        self._counters[counter] += 1
+        self._saved_seconds += entry.latency
+        return entry.answer
+
+    def _live(self, entry_key, now):
+        entry = self._entries.get(entry_key)
+        if entry is not None and entry.expires_at <= now:
+            self._remove(entry_key)
+            self._counters['expirations'] += 1
+            return None
+        return entry
+
+    def _remove(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        for term in entry.terms:
+            keys = self._postings[term]
+            keys.discard(entry_key)
+            if not keys:
+                del self._postings[term]
+
+    def _idf(self, term):
+        return math.log((1 + len(self._entries)) / (1 + len(self._postings.get(term, ())))) + 1
+
+    def _most_similar(self, query_terms, scope, now):
+        candidates = set()
+        for term in query_terms:
+            candidates.update(key for key in self._postings.get(term, ()) if key[0] == scope)
+        if not candidates:
+            return None
+
+        idf = {term: self._idf(term) for term in query_terms}
+        query = {term: count * idf[term] for term, count in query_terms.items()}
+        query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+
+        best_key, best_score = None, self.similarity
+        for entry_key in candidates:
+            entry = self._live(entry_key, now)
+            if entry is None:
+                continue
+            dot, norm = 0.0, 0.0
+            for term, count in entry.terms.items():
+                weight = count * (idf[term] if term in idf else self._idf(term))
+                norm += weight * weight
+                dot += weight * query.get(term, 0.0)
+            score = dot / (query_norm * math.sqrt(norm))
+            if score >= best_score:
+                best_key, best_score = entry_key, score
+        return best_key
+
+def init_chat_cache(app):
+    app.extensions['chat_cache'] = SemanticCache(
+        max_entries=app.config.get('CHATBOT_CACHE_SIZE', 500),
+        ttl=app.config.get('CHATBOT_CACHE_TTL', 3600),
+        similarity=app.config.get('CHATBOT_CACHE_SIMILARITY', 0.85)
+    )
+
+def get_chat_cache():
+    """The current app's SemanticCache"""
+    return current_app.extensions['chat_cache']
@@ -0,0 +1,200 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from app import db
+from models import ChatSession
+from llm import get_llm, LLMUnavailable
+
+# Most recent turns never folded into the summary
+KEEP_RECENT_TURNS = 4
+# Length limit of a summary
+SUMMARY_MAX_TOKENS = 200
+# Attempts to record a turn when another writer updated the session first
+RECORD_ATTEMPTS = 3
+
+SUMMARY_PROMPT = """Summarize this conversation between an employee and an HR assistant in a few
+sentences. Keep names, dates, numbers and open questions; drop greetings and small talk."""
+
+def estimate_tokens(text):
+    """Rough token count of ``text``, at about four characters per token"""
+    return math.ceil(len(text) / 4) if text else 0
+
+def summarize(summary, turns, use_llm=True):
+    """Fold ``turns`` into the earlier ``summary``: with the LLM when it is
+    available and ``use_llm`` is set, otherwise by keeping the user's questions"""
+    llm = get_llm() if use_llm else None
+    if llm:
+        transcript = '\n'.join(f"{role}: {content}" for role, content in turns)
+        if summary:
+            transcript = f"Summary so far: {summary}\n\n{transcript}"
+        try:
+            return llm.complete([
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript}
+            ], max_tokens=SUMMARY_MAX_TOKENS, temperature=0.2)
+        except LLMUnavailable as e:
+            logging.warning(f"Chat summary falls back to questions: {str(e)}")
+
+    questions = '; '.join(content for role, content in turns if role == 'user')
+    text = f"{summary} The user also asked: {questions}" if summary else f"The user asked: {questions}"
+    # Keep the most recent part when the questions run long
+    limit = SUMMARY_MAX_TOKENS * 4
+    return text if len(text) <= limit else '...' + text[-limit:]
+
+class ChatMemory:
+    """Per-user chatbot conversations kept in the ChatSession table.
+
+    A session holds the last ``max_turns`` turns as a ring buffer, plus a
+    summary of older ones; turns pushed out of the ring are added to the
+    summary as they leave. Once a session's estimated size passes
+    ``token_budget``, a background worker folds all but the most recent
+    turns into the summary, so the history sent with each prompt stays
+    bounded however long the conversation runs. Sessions idle for
+    ``ttl`` seconds expire: they are ignored and deleted when next
+    loaded, and purged in bulk in the background.
+    """
+
+    def __init__(self, app, max_turns=20, token_budget=1000, ttl=1800):
+        self.app = app
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.ttl = ttl
+        # One worker keeps summaries of a session in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-memory')
+        self._summarizing = set()
+        self._purged_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _expired_before(self):
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def load(self, user_id):
+        """The user's live session, or None"""
+        session = ChatSession.query.filter_by(user_id=user_id).first()
+        if session is not None and session.last_active_at < self._expired_before():
+            db.session.delete(session)
+            db.session.commit()
+            return None
+        return session
+
+    def messages(self, session):
+        """Prompt messages carrying the conversation so far"""
+        if session is None:
+            return []
+        messages = []
+        if session.summary:
+            messages.append({"role": "system", "content": f"Earlier in this conversation: {session.summary}"})
+        messages.extend({"role": role, "content": content} for role, content in session.get_turns())
+        return messages
+
+    def tokens(self, session):
+        return estimate_tokens(session.summary) + sum(estimate_tokens(content) for _, content in session.get_turns())
+
+    def record(self, user_id, question, answer):
+        """Append a question and its answer to the user's session"""
+        for attempt in range(RECORD_ATTEMPTS):
+            session = self.load(user_id) or ChatSession(user_id=user_id)
+            turns = session.get_turns() + [['user', question], ['assistant', answer]]
+            evicted = turns[:-self.max_turns]
+            if evicted:
+                # No LLM call on the request path; the next background
+                # summary condenses these questions with the rest
+                session.summary = summarize(session.summary, evicted, use_llm=False)
+            session.set_turns(turns[-self.max_turns:])
+            session.last_active_at = datetime.utcnow()
+            db.session.add(session)
+            try:
+                db.session.commit()
+                break
+            except (StaleDataError, IntegrityError):
+                # A summary or a parallel request changed the session first
+                db.session.rollback()
+        else:
+            logging.warning(f"Chat turn for user {user_id} not recorded after {RECORD_ATTEMPTS} attempts")
+            return
+
+        if self.tokens(session) > self.token_budget:
+            self._submit_summary(session.id)
+        if time.monotonic() - self._purged_at >= self.ttl:
+            self._purged_at = time.monotonic()
+            self._executor.submit(self._in_app_context, self.purge_expired)
+
+    def record_later(self, user_id, question, answer):
+        """``record`` on the background worker, for callers outside a request"""
+        self._executor.submit(self._in_app_context, self.record, user_id, question, answer)
+
+    def reset(self, user_id):
+        """Forget the user's conversation; returns whether there was one"""
+        deleted = ChatSession.query.filter_by(user_id=user_id).delete()
+        db.session.commit()
+        return bool(deleted)
+
+    def purge_expired(self):
+        """Delete every expired session; returns how many"""
+        deleted = ChatSession.query.filter(ChatSession.last_active_at < self._expired_before())\
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def drain(self):
+        """Wait for the background work queued so far"""
+        self._executor.submit(lambda: None).result()
+
+    def _submit_summary(self, session_id):
+        with self._lock:
+            if session_id in self._summarizing:
+                return
+            self._summarizing.add(session_id)
+        self._executor.submit(self._in_app_context, self._summarize, session_id)
+
+    def _summarize(self, session_id):
+        try:
+            session = db.session.get(ChatSession, session_id)
+            if session is None or self.tokens(session) <= self.token_budget:
+                return
+            turns = session.get_turns()
+            older, summary = turns[:-KEEP_RECENT_TURNS], session.summary
+            if not older:
+                return
+            # Release the connection while the summary is written
+            db.session.rollback()
+
+            new_summary = summarize(summary, older)
+
+            session = db.session.get(ChatSession, session_id)
+            if session is None or session.summary != summary or session.get_turns()[:len(older)] != older:
+                # The ring moved on meanwhile; the next recorded turn tries again
+                return
+            session.summary = new_summary
+            session.set_turns(session.get_turns()[len(older):])
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+        finally:
+            with self._lock:
+                self._summarizing.discard(session_id)
+
+    def _in_app_context(self, function, *args):
+        try:
+            with self.app.app_context():
+                return function(*args)
+        except Exception as e:
+            logging.error(f"Chat memory background error: {str(e)}")
+
+def init_chat_memory(app):
+    app.extensions['chat_memory'] = ChatMemory(
+        app,
+        max_turns=app.config.get('CHATBOT_MEMORY_TURNS', 20),
+        token_budget=app.config.get('CHATBOT_MEMORY_TOKENS', 1000),
+        ttl=app.config.get('CHATBOT_MEMORY_TTL', 1800)
+    )
+
+def get_chat_memory():
+    """The current app's ChatMemory"""
+    return current_app.extensions['chat_memory']
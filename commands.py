@@ -0,0 +1,252 @@
+import logging
+import re
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import db
+
+def register_commands(app):
+    """Register maintenance CLI commands on the app"""
+    app.cli.add_command(add_missing_columns_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(recount_ticket_comments_command)
+    app.cli.add_command(rebuild_attendance_rollups_command)
+    app.cli.add_command(rebuild_payroll_totals_command)
+    app.cli.add_command(import_attendance_command)
+    app.cli.add_command(purge_chat_sessions_command)
+
+def add_missing_columns():
+    """Add model columns that existing tables lack, returning the DDL run.
+
+    db.create_all() only creates missing tables, so columns added to a
+    model since the database was created (such as User.auth_version or the
+    version counters) are added here with ALTER TABLE. Columns with a
+    server default keep NOT NULL; others are added as nullable, and
+    foreign keys are not enforced on added columns.
+    """
+    engine = db.engine
+    is_postgres = engine.dialect.name == 'postgresql'
+    quote = engine.dialect.identifier_preparer.quote
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    statements = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            ddl = (f"ALTER TABLE {quote(table.name)} ADD COLUMN {'IF NOT EXISTS ' if is_postgres else ''}"
+                   f"{quote(column.name)} {column.type.compile(dialect=engine.dialect)}")
+            if column.server_default is not None:
+                default = str(column.server_default.arg).replace("'", "''")
+                ddl += f" DEFAULT '{default}'"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            statements.append(ddl)
+
+    if statements:
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+                logging.info(f"Schema upgrade: {statement}")
+    return statements
+
+@click.command('add-missing-columns')
+@with_appcontext
+def add_missing_columns_command():
+    """Add model columns missing from an existing database (also run at startup)"""
+    statements = add_missing_columns()
+    for statement in statements:
+        click.echo(statement)
+    click.echo(f"Added {len(statements)} columns")
+
+def _postgres_index_state(conn, name):
+    """Return None if the index is missing, else whether it is valid"""
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+        "WHERE c.relname = :name"
+    ), {'name': name}).scalar()
+
+# Indexes replaced by a differently named model index, dropped once it exists
+RETIRED_INDEXES = ('ix_attendance_user_date',)
+
+# Keeps the latest row per (user, day) so the unique attendance index can be built
+DEDUPE_ATTENDANCE_SQL = (
+    'DELETE FROM attendance WHERE id NOT IN '
+    '(SELECT MAX(id) FROM attendance GROUP BY user_id, date)'
+)
+
+# (user_id, date) groups holding more than one attendance row
+DUPLICATE_ATTENDANCE_SQL = (
+    'SELECT user_id, date, COUNT(*) FROM attendance '
+    'GROUP BY user_id, date HAVING COUNT(*) > 1 ORDER BY user_id, date'
+)
+
+def duplicate_attendance():
+    """Return (user_id, date, row count) for each user and day with more
+    than one attendance row"""
+    return [tuple(row) for row in db.session.execute(text(DUPLICATE_ATTENDANCE_SQL))]
+
+def dedupe_attendance():
+    """Delete duplicate attendance rows for a user and day, keeping the
+    most recently inserted; rebuilds the rollups if any were removed"""
+    from rollups import rebuild_attendance_rollups
+
+    deleted = db.session.execute(text(DEDUPE_ATTENDANCE_SQL)).rowcount
+    db.session.commit()
+    if deleted:
+        rebuild_attendance_rollups()
+    return deleted
+
+@click.command('create-indexes')
+@click.option('--dry-run', is_flag=True, help='Print the DDL without executing it.')
+@click.option('--dedupe', is_flag=True,
+              help='Delete duplicate attendance rows, keeping the latest per user and day.')
+@with_appcontext
+def create_indexes_command(dry_run, dedupe):
+    """Build the model indexes on an existing database.
+
+    On PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY so
+    writes are not blocked. Invalid leftovers from an interrupted build
+    are dropped and rebuilt. Other databases use a plain CREATE INDEX.
+    Duplicate attendance rows block the unique (user_id, date) index: they
+    are reported and nothing is built unless --dedupe is given to delete
+    them. Retired indexes are dropped.
+    """
+    engine = db.engine
+    is_postgres = engine.dialect.name == 'postgresql'
+    indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+
+    duplicates = duplicate_attendance()
+    if duplicates:
+        extra = sum(count - 1 for _, _, count in duplicates)
+        click.echo(f"Found {len(duplicates)} user days with duplicate attendance rows "
+                   f"({extra} rows would be deleted):")
+        for user_id, day, count in duplicates:
+            click.echo(f"  user {user_id} on {day}: {count} rows")
+        if dry_run:
+            click.echo(DEDUPE_ATTENDANCE_SQL)
+        elif not dedupe:
+            raise click.ClickException(
+                'Duplicate attendance rows prevent the unique attendance index. '
+                'Resolve them, or rerun with --dedupe to keep the latest row per user and day.'
+            )
+        else:
+            deleted = dedupe_attendance()
+            click.echo(f"Deleted {deleted} duplicate attendance rows")
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for index in indexes:
+            if not is_postgres:
+                if dry_run:
+                    click.echo(str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect)))
+                else:
+                    index.create(bind=conn, checkfirst=True)
+                    click.echo(f"Ensured index {index.name}")
+                continue
+
+            state = _postgres_index_state(conn, index.name)
+            if state is True:
+                click.echo(f"Index {index.name} already exists")
+                continue
+
+            statements = []
+            if state is False:
+                statements.append(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+            ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+            statements.append(re.sub(r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY', ddl))
+
+            for statement in statements:
+                click.echo(statement)
+                if not dry_run:
+                    conn.execute(text(statement))
+
+            if not dry_run:
+                logging.info(f"Built index {index.name} concurrently")
+
+        for name in RETIRED_INDEXES:
+            statement = f'DROP INDEX {"CONCURRENTLY " if is_postgres else ""}IF EXISTS "{name}"'
+            click.echo(statement)
+            if not dry_run:
+                conn.execute(text(statement))
+
+@click.command('recount-ticket-comments')
+@with_appcontext
+def recount_ticket_comments_command():
+    """Backfill Ticket.comments_count from the TicketComment table"""
+    from models import Ticket, TicketComment
+
+    comment_count = db.select(db.func.count(TicketComment.id))\
+        .where(TicketComment.ticket_id == Ticket.id).scalar_subquery()
+    result = db.session.execute(db.update(Ticket).values(comments_count=comment_count))
+    db.session.commit()
+    click.echo(f"Recounted comments for {result.rowcount} tickets")
+
+@click.command('rebuild-attendance-rollups')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='First day to rebuild (widened to the start of its month).')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Last day to rebuild (widened to the end of its month).')
+@with_appcontext
+def rebuild_attendance_rollups_command(date_from, date_to):
+    """Recompute the attendance rollup tables from Attendance.
+
+    Use after a backfill or bulk import, or to populate the rollups on an
+    existing database. Without --from/--to every month is rebuilt.
+    """
+    from rollups import rebuild_attendance_rollups
+
+    daily, monthly = rebuild_attendance_rollups(
+        date_from.date() if date_from else None,
+        date_to.date() if date_to else None
+    )
+    click.echo(f"Rebuilt {daily} daily and {monthly} monthly attendance rollup rows")
+
+@click.command('rebuild-payroll-totals')
+@click.option('--year', type=int, help='Only rebuild this calendar year.')
+@with_appcontext
+def rebuild_payroll_totals_command(year):
+    """Recompute the per-user year-to-date payroll totals from Payroll"""
+    from rollups import rebuild_payroll_year_totals
+
+    rows = rebuild_payroll_year_totals(year)
+    click.echo(f"Rebuilt {rows} payroll year total rows")
+
+@click.command('import-attendance')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig', lazy=False))
+@click.option('--chunk-size', type=int, default=None, help='Rows per transaction.')
+@with_appcontext
+def import_attendance_command(csv_file, chunk_size):
+    """Upsert attendance from a CSV file (use - for stdin).
+
+    Columns: employee_id, date (required), clock_in, clock_out,
+    hours_worked, status, notes. Rows are keyed on (employee, date).
+    """
+    import time
+    from attendance_import import import_attendance_csv, IMPORT_CHUNK_SIZE
+    from cache import summary_cache
+
+    start = time.perf_counter()
+    report = import_attendance_csv(csv_file, chunk_size or IMPORT_CHUNK_SIZE)
+    elapsed = time.perf_counter() - start
+    summary_cache.invalidate('attendance')
+
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    rate = report['processed'] / elapsed if elapsed else 0
+    click.echo(f"Processed {report['processed']} rows in {elapsed:.1f}s ({rate:,.0f} rows/s): "
+               f"{report['imported']} upserted, {report['error_count']} errors")
+
+@click.command('purge-chat-sessions')
+@with_appcontext
+def purge_chat_sessions_command():
+    """Delete chatbot conversations idle for longer than CHATBOT_MEMORY_TTL"""
+    from chat_memory import get_chat_memory
+
+    deleted = get_chat_memory().purge_expired()
+    click.echo(f"Deleted {deleted} expired chat sessions")
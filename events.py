@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Frames held for a client that reads slower than events arrive; older ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+# Seconds between reconnect attempts of the Redis listener
+LISTENER_RETRY_DELAY = 1
+
+class Subscription:
+    """Pending SSE frames for one connected client"""
+
+    def __init__(self, hub, user_id):
+        self.user_id = user_id
+        self._hub = hub
+        self._frames = deque(maxlen=SUBSCRIBER_QUEUE_SIZE)
+        self._ready = threading.Condition()
+
+    def push(self, frame):
+        with self._ready:
+            self._frames.append(frame)
+            self._ready.notify()
+
+    def wait(self, timeout):
+        """Return the frames queued so far, waiting up to ``timeout``
+        seconds for the first one; an empty list means none arrived"""
+        with self._ready:
+            if not self._frames:
+                self._ready.wait(timeout)
+            frames = list(self._frames)
+            self._frames.clear()
+        return frames
+
+    def close(self):
+        self._hub.remove(self)
+
+class EventHub:
+    """The event stream subscribers of this process, indexed by user id.
+
+    A waiting subscriber is parked on a condition variable rather than
+    holding a thread of its own, so under a gevent worker each idle
+    connection costs one greenlet and a small queue.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, user_id, limit):
+        """Register a subscriber for ``user_id``, or return None when the
+        process already holds ``limit`` connections"""
+        with self._lock:
+            if self._count >= limit:
+                return None
+            subscription = Subscription(self, user_id)
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if not subscriptions or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+            self._count -= 1
+
+    def deliver(self, frame, user_ids=None):
+        """Queue ``frame`` for the given users' connections, or for every
+        connection when ``user_ids`` is None"""
+        with self._lock:
+            if user_ids is None:
+                targets = [s for subscriptions in self._subscribers.values() for s in subscriptions]
+            else:
+                targets = [s for user_id in user_ids for s in self._subscribers.get(user_id, ())]
+        for subscription in targets:
+            subscription.push(frame)
+
+    def __len__(self):
+        return self._count
+
+class LocalFanout:
+    """Delivers events to this process only, used when no shared Redis is configured"""
+
+    def publish(self, hub, message):
+        hub.deliver(message['frame'], message['user_ids'])
+
+    def start(self, hub):
+        pass
+
+class RedisFanout:
+    """Relays events between workers over a Redis pub/sub channel.
+
+    Publishing only writes to the channel; each worker runs one listener
+    thread (started on its first subscriber, after any fork) that hands
+    every message, including its own, to the local hub.
+    """
+
+    def __init__(self, url, channel='hr:events'):
+        self._client = redis.Redis.from_url(url)
+        self._channel = channel
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def publish(self, hub, message):
+        self._client.publish(self._channel, json.dumps(message))
+
+    def start(self, hub):
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, args=(hub,), name='event-listener', daemon=True).start()
+
+    def _listen(self, hub):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    hub.deliver(payload['frame'], payload['user_ids'])
+            except Exception as e:
+                logging.warning(f"Event listener error: {str(e)}")
+                time.sleep(LISTENER_RETRY_DELAY)
+
+class EventBroker:
+    """In-process pub/sub behind the server-sent event stream.
+
+    Write endpoints call ``publish`` after committing; the event is
+    encoded once as an SSE frame and queued on the connections of the
+    users it concerns (all users when ``user_ids`` is None). With
+    ``EVENTS_REDIS_URL`` set, events reach subscribers on every worker.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_REDIS_URL', app.config.get('CACHE_REDIS_URL'))
+        app.config.setdefault('EVENTS_HEARTBEAT', 15)
+        app.config.setdefault('EVENTS_MAX_CONNECTIONS', 1000)
+        app.config.setdefault('EVENTS_TOKEN_TTL', 60)
+
+        fanout = LocalFanout()
+        redis_url = app.config['EVENTS_REDIS_URL']
+        if redis_url:
+            if redis is None:
+                logging.warning("EVENTS_REDIS_URL is set but the redis package is not installed. "
+                                "Events only reach this worker's streams.")
+            else:
+                fanout = RedisFanout(redis_url)
+
+        app.extensions['event_broker'] = (EventHub(), fanout)
+
+    def subscribe(self, user_id):
+        """Open a subscription for ``user_id``; None when this worker is at
+        ``EVENTS_MAX_CONNECTIONS``"""
+        hub, fanout = current_app.extensions['event_broker']
+        fanout.start(hub)
+        return hub.add(user_id, current_app.config['EVENTS_MAX_CONNECTIONS'])
+
+    def _serializer(self):
+        secret = current_app.config.get('JWT_SECRET_KEY') or current_app.secret_key
+        return URLSafeTimedSerializer(secret, salt='event-stream')
+
+    def issue_token(self, user_id, auth_version):
+        """A token that only opens the event stream, valid for
+        ``EVENTS_TOKEN_TTL`` seconds, for clients that cannot send headers"""
+        return self._serializer().dumps({'uid': user_id, 'ver': auth_version})
+
+    def verify_token(self, token):
+        """(user_id, auth_version) of a token from ``issue_token``; None when
+        it is forged or expired"""
+        try:
+            data = self._serializer().loads(token, max_age=current_app.config['EVENTS_TOKEN_TTL'])
+        except BadSignature:
+            return None
+        return data['uid'], data['ver']
+
+    def publish(self, event, data, user_ids=None):
+        hub, fanout = current_app.extensions['event_broker']
+        frame = f"event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+        if user_ids is not None:
+            user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+        message = {'frame': frame, 'user_ids': user_ids}
+        try:
+            fanout.publish(hub, message)
+        except Exception as e:
+            logging.warning(f"Event publish error: {str(e)}")
+            hub.deliver(message['frame'], message['user_ids'])
+
+event_broker = EventBroker()
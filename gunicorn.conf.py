@@ -0,0 +1,12 @@
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+# gevent workers hold many open event streams and LLM calls per process
+worker_class = "gevent"
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+def post_fork(server, worker):
+    # psycopg2 waits on the socket in C, which blocks the worker's whole
+    # gevent hub; a wait callback makes each query yield to other greenlets
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -0,0 +1,173 @@
+import re
+from datetime import date
+from string import Formatter
+from sqlalchemy import func, select
+from app import db
+from models import Leave, Attendance, Payroll, Ticket
+from chat_cache import stem
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# The chatbot's offline answers. A message matching any keyword or synonym
+# of several intents gets the one with the highest priority. Templates are
+# formatted with ``user`` and any of the FACTS they name.
+INTENTS = (
+    {
+        'name': 'leave',
+        'priority': 60,
+        'keywords': ('leave', 'time off', 'vacation', 'sick'),
+        'synonyms': ('holiday', 'pto', 'day off', 'days off', 'absence'),
+        'template': "To apply for leave, go to the Leaves section in your dashboard. You can submit a leave "
+                    "request with your desired dates and reason. Your manager or HR will review and approve it. "
+                    "{pending_leaves}"
+    },
+    {
+        'name': 'attendance',
+        'priority': 50,
+        'keywords': ('attendance', 'clock in', 'clock out', 'timesheet'),
+        'synonyms': ('check in', 'check out', 'punch in', 'punch out', 'working hours'),
+        'template': "You can clock in and out using the Attendance section. Make sure to clock in when you start "
+                    "work and clock out when you finish. Your attendance records are automatically tracked. "
+                    "{attendance_today}"
+    },
+    {
+        'name': 'payroll',
+        'priority': 40,
+        'keywords': ('payroll', 'salary', 'payslip', 'pay'),
+        'synonyms': ('paycheck', 'wage', 'pay slip', 'compensation', 'paid'),
+        'template': "You can view your payroll information, including payslips and salary history, in the "
+                    "Payroll section of your dashboard. {latest_payslip}"
+    },
+    {
+        'name': 'tickets',
+        'priority': 35,
+        'keywords': ('ticket', 'support', 'issue'),
+        'synonyms': ('helpdesk', 'help desk', 'problem', 'broken'),
+        'template': "You can raise a ticket for IT, HR or facilities issues in the Tickets section and follow "
+                    "its progress there. {open_tickets}"
+    },
+    {
+        'name': 'profile',
+        'priority': 30,
+        'keywords': ('profile', 'update', 'personal information'),
+        'synonyms': ('contact details', 'emergency contact', 'address', 'phone number'),
+        'template': "You can update your personal information in the Profile section. This includes your "
+                    "contact details, emergency contacts, and other personal data."
+    },
+    {
+        'name': 'greeting',
+        'priority': 20,
+        'keywords': ('hello', 'hi', 'hey', 'good morning', 'good afternoon'),
+        'synonyms': ('good evening', 'greetings', 'howdy'),
+        'template': "Hello {user.first_name}! I'm here to help you with HR-related questions. "
+                    "How can I assist you today?"
+    },
+    {
+        'name': 'help',
+        'priority': 10,
+        'keywords': ('help', 'what can you do', 'assistance'),
+        'synonyms': ('assist', 'options', 'what can i ask'),
+        'template': "I can help you with:\n• Leave applications and policies\n• Attendance tracking\n"
+                    "• Payroll inquiries\n• Profile updates\n• General HR questions\n\nWhat would you like to know about?"
+    },
+)
+
+DEFAULT_TEMPLATE = ("I'm here to help with HR-related questions. You can ask me about leave policies, attendance, "
+                    "payroll, or general workplace questions. For specific issues, please contact HR directly.")
+
+def _count(n, singular, plural):
+    return f"{n} {singular if n == 1 else plural}"
+
+def _pending_leaves(user_id, today):
+    return select(func.count(Leave.id)).where(Leave.user_id == user_id, Leave.status == 'pending')
+
+def _attendance_today(user_id, today):
+    return select(Attendance.clock_in).where(Attendance.user_id == user_id, Attendance.date == today).limit(1)
+
+def _latest_payslip(user_id, today):
+    return select(Payroll.net_pay).where(Payroll.user_id == user_id).order_by(Payroll.pay_period_end.desc()).limit(1)
+
+def _open_tickets(user_id, today):
+    return select(func.count(Ticket.id)).where(Ticket.created_by == user_id, Ticket.status != 'closed')
+
+# Per-user facts templates can name: a query for (user id, today) selecting
+# one value, and a function rendering that value as a sentence
+FACTS = {
+    'pending_leaves': (_pending_leaves, lambda n: f"You have {_count(n, 'pending leave request', 'pending leave requests')}."
+                       if n else "You have no pending leave requests."),
+    'attendance_today': (_attendance_today, lambda clock_in: f"You clocked in today at {clock_in:%H:%M}."
+                         if clock_in else "You have not clocked in today."),
+    'latest_payslip': (_latest_payslip, lambda net_pay: f"Your latest payslip shows a net pay of {net_pay:,.2f}."
+                       if net_pay is not None else "No payslips have been issued to you yet."),
+    'open_tickets': (_open_tickets, lambda n: f"You have {_count(n, 'open ticket', 'open tickets')}."
+                     if n else "You have no open tickets."),
+}
+
+def _words(text):
+    return [stem(word) for word in _WORD.findall(text.lower())]
+
+class Intent:
+    __slots__ = ('name', 'priority', 'template', 'facts')
+
+    def __init__(self, name, priority, template):
+        self.name = name
+        self.priority = priority
+        self.template = template
+        fields = {field.split('.')[0].split('[')[0] for _, field, _, _ in Formatter().parse(template) if field}
+        unknown = fields - set(FACTS) - {'user'}
+        if unknown:
+            raise ValueError(f"Intent {name!r} uses unknown facts: {', '.join(sorted(unknown))}")
+        # Facts the template needs, so nothing else is queried
+        self.facts = tuple(sorted(fields & set(FACTS)))
+
+class IntentMatcher:
+    """Picks the intent of a message from a table like INTENTS.
+
+    Every keyword and synonym is compiled, once, into a trie over stemmed
+    words. Matching walks the trie from each word of the message, so its
+    cost grows with the message length (times the longest phrase) rather
+    than with the number of intents or phrases.
+    """
+
+    def __init__(self, intents, default_template=DEFAULT_TEMPLATE):
+        self.default = Intent('default', 0, default_template)
+        self._trie = {}
+        for spec in intents:
+            intent = Intent(spec['name'], spec['priority'], spec['template'])
+            for phrase in spec['keywords'] + spec.get('synonyms', ()):
+                node = self._trie
+                for word in _words(phrase):
+                    node = node.setdefault(word, {})
+                node[None] = intent
+
+    def match(self, message):
+        """The highest priority intent any phrase of ``message`` belongs to"""
+        words = _words(message)
+        best = self.default
+        for start in range(len(words)):
+            node = self._trie
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                intent = node.get(None)
+                if intent is not None and intent.priority > best.priority:
+                    best = intent
+        return best
+
+def load_facts(user, names, today=None):
+    """Rendered values of the named FACTS for ``user``, in one query"""
+    if not names:
+        return {}
+    today = today or date.today()
+    # Each fact is a scalar subquery of a single SELECT
+    columns = [FACTS[name][0](user.id, today).scalar_subquery().label(name) for name in names]
+    row = db.session.execute(select(*columns)).one()
+    return {name: FACTS[name][1](row._mapping[name]) for name in names}
+
+matcher = IntentMatcher(INTENTS)
+
+def respond(message, user):
+    """The offline answer to ``message`` for ``user``"""
+    intent = matcher.match(message)
+    return intent.template.format(user=user, **load_facts(user, intent.facts))
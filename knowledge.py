@@ -0,0 +1,224 @@
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from flask import current_app
+from chat_cache import tokenize
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Sections longer than this many words are split between paragraphs
+MAX_PASSAGE_WORDS = 150
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+class Passage:
+    """A section of a policy document, as returned by a search"""
+
+    __slots__ = ('source', 'title', 'text', 'terms', 'score')
+
+    def __init__(self, source, title, text, terms=None, score=0.0):
+        self.source = source
+        self.title = title
+        self.text = text
+        self.terms = terms
+        self.score = score
+
+    def to_dict(self):
+        return {'source': self.source, 'title': self.title, 'score': round(self.score, 3)}
+
+def split_passages(source, markdown):
+    """Passages of a markdown document: one per heading, with long
+    sections split between paragraphs"""
+    passages = []
+    document_title = os.path.splitext(source)[0].replace('_', ' ').replace('-', ' ').title()
+    title, lines = document_title, []
+
+    def flush():
+        paragraphs = [p.strip() for p in '\n'.join(lines).split('\n\n') if p.strip()]
+        chunk, words = [], 0
+        for paragraph in paragraphs:
+            count = len(paragraph.split())
+            if chunk and words + count > MAX_PASSAGE_WORDS:
+                passages.append(Passage(source, title, '\n\n'.join(chunk)))
+                chunk, words = [], 0
+            chunk.append(paragraph)
+            words += count
+        if chunk:
+            passages.append(Passage(source, title, '\n\n'.join(chunk)))
+
+    for line in markdown.splitlines():
+        heading = _HEADING.match(line)
+        if heading:
+            flush()
+            level, text = len(heading.group(1)), heading.group(2)
+            if level == 1:
+                document_title = title = text
+            else:
+                title = f"{document_title} - {text}"
+            lines = []
+        else:
+            lines.append(line)
+    flush()
+
+    for passage in passages:
+        # The heading is indexed too, so "overtime" finds a section titled Overtime
+        passage.terms = Counter(tokenize(f"{passage.title}\n{passage.text}"))
+    return [passage for passage in passages if passage.terms]
+
+class _Index:
+    """BM25 statistics over a fixed list of passages.
+
+    Postings are stored per term as parallel arrays of passage positions
+    and term frequencies (NumPy arrays when NumPy is installed), so a
+    query only touches the passages that contain one of its terms.
+    """
+
+    def __init__(self, passages):
+        self.passages = passages
+        lengths = [sum(passage.terms.values()) for passage in passages]
+        average = sum(lengths) / len(lengths) if lengths else 1.0
+
+        postings = {}
+        for position, passage in enumerate(passages):
+            for term, count in passage.terms.items():
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(position)
+                entry[1].append(count)
+
+        total = len(passages)
+        self.idf = {term: math.log(1 + (total - len(ids) + 0.5) / (len(ids) + 0.5))
+                    for term, (ids, counts) in postings.items()}
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / average) for length in lengths]
+        if np is not None:
+            self.norms = np.array(norms, dtype=np.float64)
+            self.postings = {term: (np.array(ids, dtype=np.intp), np.array(counts, dtype=np.float64))
+                             for term, (ids, counts) in postings.items()}
+        else:
+            self.norms = norms
+            self.postings = postings
+
+    def search(self, terms, k):
+        """Up to ``k`` (score, position) pairs, best first"""
+        terms = [term for term in set(terms) if term in self.postings]
+        if not terms:
+            return []
+
+        if np is not None:
+            scores = np.zeros(len(self.passages))
+            for term in terms:
+                ids, counts = self.postings[term]
+                scores[ids] += self.idf[term] * counts * (BM25_K1 + 1) / (counts + self.norms[ids])
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+            return sorted(((float(scores[i]), int(i)) for i in matched), key=lambda pair: (-pair[0], pair[1]))
+
+        scores = {}
+        for term in terms:
+            ids, counts = self.postings[term]
+            idf = self.idf[term]
+            for position, count in zip(ids, counts):
+                scores[position] = scores.get(position, 0.0) + \
+                    idf * count * (BM25_K1 + 1) / (count + self.norms[position])
+        return heapq.nsmallest(k, ((score, position) for position, score in scores.items()),
+                               key=lambda pair: (-pair[0], pair[1]))
+
+class KnowledgeBase:
+    """HR policy documents searched with BM25.
+
+    Every ``*.md`` file in ``directory`` is split into passages and
+    indexed. At most every ``reload_interval`` seconds a search checks
+    the directory; only files whose modification time or size changed
+    are read and tokenized again, and removed files are dropped, before
+    the index is rebuilt from the per-file passages. Searches keep using
+    the previous index while that happens. ``revision`` counts the
+    rebuilds, so answers derived from an older index can be told apart.
+    """
+
+    def __init__(self, directory, reload_interval=5, min_score=1.0):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.min_score = min_score
+        # file name -> ((mtime, size), passages)
+        self._files = {}
+        self._index = _Index([])
+        self.revision = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def search(self, question, k=3):
+        """The ``k`` passages most relevant to ``question`` scoring at
+        least ``min_score``, best first"""
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        index = self._index
+        return [Passage(index.passages[position].source, index.passages[position].title,
+                        index.passages[position].text, score=score)
+                for score, position in index.search(tokenize(question), k) if score >= self.min_score]
+
+    def reload(self):
+        """Pick up added, changed and removed files; returns whether the index changed"""
+        if not self._lock.acquire(blocking=False):
+            # Another thread is already reloading
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                entries = [entry for entry in os.scandir(self.directory)
+                           if entry.is_file() and entry.name.endswith('.md')]
+            except FileNotFoundError:
+                entries = []
+
+            files, changed = {}, False
+            for entry in entries:
+                stat = entry.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+                known = self._files.get(entry.name)
+                if known and known[0] == signature:
+                    files[entry.name] = known
+                    continue
+                try:
+                    with open(entry.path, encoding='utf-8') as f:
+                        files[entry.name] = (signature, split_passages(entry.name, f.read()))
+                except (OSError, UnicodeDecodeError) as e:
+                    logging.warning(f"Could not read policy document {entry.name}: {str(e)}")
+                    continue
+                changed = True
+
+            if not changed and files.keys() == self._files.keys():
+                return False
+            self._files = files
+            self._index = _Index([passage for name in sorted(files) for passage in files[name][1]])
+            self.revision += 1
+            logging.info(f"Indexed {len(self._index.passages)} policy passages from {len(files)} documents")
+            return True
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._index.passages)
+
+def init_knowledge(app):
+    """Index the policy documents in ``CHATBOT_KNOWLEDGE_DIR``, if set"""
+    directory = app.config.get('CHATBOT_KNOWLEDGE_DIR')
+    app.extensions['knowledge'] = KnowledgeBase(
+        directory,
+        reload_interval=app.config.get('CHATBOT_KNOWLEDGE_RELOAD', 5),
+        min_score=app.config.get('CHATBOT_KNOWLEDGE_MIN_SCORE', 1.0)
+    ) if directory else None
+
+def get_knowledge():
+    """The current app's KnowledgeBase, or None when no directory is configured"""
+    return current_app.extensions.get('knowledge')
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from flask import current_app
+
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
+class LLMUnavailable(Exception):
+    """The LLM cannot answer right now; callers fall back to local responses"""
+
+class CircuitBreaker:
+    """Stops calling a failing provider for a while.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``allow`` refuses calls for ``reset_timeout`` seconds. It then lets a
+    single trial call through (half-open): success closes it again, failure
+    reopens it for another ``reset_timeout``.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return self.CLOSED
+        if now - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        """End a call without an outcome, such as one the caller abandoned:
+        a half-open trial makes way for the next call, and the state and
+        failure count are left as they were"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.warning(f"LLM circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+class LLMClient:
+    """Chat completions streamed from an OpenAI-compatible API.
+
+    At most ``max_concurrency`` calls run at once; a call that cannot get a
+    slot within ``queue_timeout`` seconds, that the circuit breaker refuses,
+    or that fails raises LLMUnavailable instead of tying up the worker.
+    ``timeout`` bounds connecting and each wait for the next chunk, and
+    ``deadline`` the whole call.
+    """
+
+    def __init__(self, api_key, base_url=None, model='gpt-4o', max_concurrency=8, timeout=10,
+                 deadline=30, queue_timeout=0.5, breaker=None):
+        # Retries would multiply the latency a failing provider costs us
+        self._client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        self.model = model
+        self.deadline = deadline
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def stream(self, messages, max_tokens=300, temperature=0.7):
+        """Yield the reply's text as it arrives.
+
+        Raises LLMUnavailable, before the first piece or part way through.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise LLMUnavailable('All LLM slots are busy')
+        try:
+            if not self.breaker.allow():
+                raise LLMUnavailable('LLM circuit is open')
+
+            give_up_at = time.monotonic() + self.deadline
+            try:
+                chunks = self._client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True
+                )
+                try:
+                    for chunk in chunks:
+                        if time.monotonic() > give_up_at:
+                            raise TimeoutError(f'No complete reply within {self.deadline}s')
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                finally:
+                    chunks.close()
+            except GeneratorExit:
+                # The client went away; that says nothing about the provider
+                self.breaker.release()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                raise LLMUnavailable(str(e)) from e
+            self.breaker.record_success()
+        finally:
+            self._slots.release()
+
+    def complete(self, messages, max_tokens=300, temperature=0.7):
+        """The whole reply as one string; raises LLMUnavailable"""
+        return ''.join(self.stream(messages, max_tokens, temperature))
+
+def init_llm(app):
+    """Create the app's LLMClient from config, or leave it unset when no
+    API key is configured or the openai package is missing"""
+    client = None
+    if app.config.get('OPENAI_API_KEY'):
+        if OpenAI is None:
+            logging.warning("OpenAI package not installed. Using basic chatbot responses.")
+        else:
+            client = LLMClient(
+                app.config['OPENAI_API_KEY'],
+                base_url=app.config.get('OPENAI_BASE_URL'),
+                model=app.config.get('CHATBOT_MODEL', 'gpt-4o'),
+                max_concurrency=app.config.get('CHATBOT_MAX_CONCURRENCY', 8),
+                timeout=app.config.get('CHATBOT_TIMEOUT', 10),
+                deadline=app.config.get('CHATBOT_DEADLINE', 30),
+                queue_timeout=app.config.get('CHATBOT_QUEUE_TIMEOUT', 0.5),
+                breaker=CircuitBreaker(app.config.get('CHATBOT_BREAKER_THRESHOLD', 5),
+                                       app.config.get('CHATBOT_BREAKER_RESET', 30))
+            )
+    app.extensions['llm'] = client
+
+def get_llm():
+    """The current app's LLMClient, or None when the LLM is not configured"""
+    return current_app.extensions.get('llm')
@@ -1,4 +1,5 @@
 from datetime import datetime
+import json
 from app import db
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import func
@@ -16,8 +17,10 @@ class User(db.Model):
     role = db.Column(db.String(20), default='employee')  # employee, hr, admin
     hire_date = db.Column(db.Date, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    auth_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bumped on role/status change to revoke tokens
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # optimistic lock: ORM UPDATEs match and bump it
     
     # Relationships
     leaves = db.relationship('Leave', foreign_keys='Leave.user_id', backref='user', lazy=True)
@@ -25,6 +28,8 @@ class User(db.Model):
     payroll_records = db.relationship('Payroll', backref='user', lazy=True)
     performance_reviews = db.relationship('PerformanceReview', foreign_keys='PerformanceReview.user_id', backref='user', lazy=True)
     
+    __mapper_args__ = {'version_id_col': version}
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -39,7 +44,8 @@ class User(db.Model):
             'hire_date': self.hire_date.isoformat() if self.hire_date else None,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': self.updated_at.isoformat(),
+            'version': self.version
         }
 
 class Leave(db.Model):
@@ -55,9 +61,19 @@ class Leave(db.Model):
     approved_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # optimistic lock: ORM UPDATEs match and bump it
     
     approver = db.relationship('User', foreign_keys=[approved_by], backref='approved_leaves')
     
+    __table_args__ = (
+        db.Index('ix_leave_user_status', user_id, status),
+        db.Index('ix_leave_status_created', status, created_at),
+        db.Index('ix_leave_pending_created', created_at,
+                 postgresql_where=(status == 'pending'), sqlite_where=(status == 'pending')),
+    )
+    
+    __mapper_args__ = {'version_id_col': version}
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -71,7 +87,8 @@ class Leave(db.Model):
             'approved_by': self.approved_by,
             'approved_at': self.approved_at.isoformat() if self.approved_at else None,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': self.updated_at.isoformat(),
+            'version': self.version
         }
 
 class Attendance(db.Model):
@@ -86,6 +103,14 @@ class Attendance(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # Unique: one record per user per day, the key bulk imports upsert on.
+        # Named apart from the earlier non-unique ix_attendance_user_date so
+        # create-indexes builds it on existing databases.
+        db.Index('ix_attendance_user_date_unique', user_id, date, unique=True),
+        db.Index('ix_attendance_date', date),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -100,6 +125,40 @@ class Attendance(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+class AttendanceDailyRollup(db.Model):
+    """Attendance counts per day and department, maintained by rollups.py"""
+    date = db.Column(db.Date, primary_key=True)
+    department = db.Column(db.String(100), primary_key=True)  # '' for users without a department
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    present_count = db.Column(db.Integer, nullable=False, default=0)
+    hours_worked = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def to_dict(self):
+        return {
+            'date': self.date.isoformat(),
+            'department': self.department or None,
+            'record_count': self.record_count,
+            'present_count': self.present_count,
+            'hours_worked': round(self.hours_worked or 0.0, 2)
+        }
+
+class AttendanceMonthlyRollup(db.Model):
+    """Attendance counts per month and user, maintained by rollups.py"""
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    present_count = db.Column(db.Integer, nullable=False, default=0)
+    hours_worked = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def to_dict(self):
+        return {
+            'month': self.month.strftime('%Y-%m'),
+            'user_id': self.user_id,
+            'record_count': self.record_count,
+            'present_count': self.present_count,
+            'hours_worked': round(self.hours_worked or 0.0, 2)
+        }
+
 class Payroll(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -114,8 +173,16 @@ class Payroll(db.Model):
     tax_deduction = db.Column(db.Numeric(10, 2), default=0.0)
     net_pay = db.Column(db.Numeric(10, 2), nullable=False)
     status = db.Column(db.String(20), default='draft')  # draft, approved, paid
+    payroll_run_id = db.Column(db.Integer, db.ForeignKey('payroll_run.id'))  # set when generated by a run
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # optimistic lock: ORM UPDATEs match and bump it
+    
+    __table_args__ = (
+        db.Index('ix_payroll_user_period', user_id, pay_period_start),
+    )
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def to_dict(self):
         return {
@@ -132,8 +199,70 @@ class Payroll(db.Model):
             'tax_deduction': float(self.tax_deduction),
             'net_pay': float(self.net_pay),
             'status': self.status,
+            'payroll_run_id': self.payroll_run_id,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': self.updated_at.isoformat(),
+            'version': self.version
+        }
+
+class PayrollRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    pay_period_start = db.Column(db.Date, nullable=False)
+    pay_period_end = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, completed, failed
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    employee_count = db.Column(db.Integer, default=0)
+    created_count = db.Column(db.Integer, default=0)
+    updated_count = db.Column(db.Integer, default=0)
+    unchanged_count = db.Column(db.Integer, default=0)
+    skipped_count = db.Column(db.Integer, default=0)  # no salary to carry forward, or no longer a draft
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # At most one run in progress: the insert of a second 'running' row
+        # fails, which is the cross-process lock for payroll runs
+        db.Index('ix_payroll_run_active', status, unique=True,
+                 postgresql_where=(status == 'running'), sqlite_where=(status == 'running')),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'pay_period_start': self.pay_period_start.isoformat(),
+            'pay_period_end': self.pay_period_end.isoformat(),
+            'status': self.status,
+            'created_by': self.created_by,
+            'employee_count': self.employee_count,
+            'created_count': self.created_count,
+            'updated_count': self.updated_count,
+            'unchanged_count': self.unchanged_count,
+            'skipped_count': self.skipped_count,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class PayrollYearTotal(db.Model):
+    """Per-user payroll totals for a calendar year, maintained by rollups.py"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)  # year of pay_period_start
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    gross_pay = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    net_pay = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    tax_deduction = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    deductions = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'year': self.year,
+            'record_count': self.record_count,
+            'gross_pay': float(self.gross_pay),
+            'net_pay': float(self.net_pay),
+            'tax_deduction': float(self.tax_deduction),
+            'deductions': float(self.deductions)
         }
 
 class Settings(db.Model):
@@ -175,6 +304,12 @@ class Announcement(db.Model):
     
     author = db.relationship('User', backref='announcements')
     
+    __table_args__ = (
+        db.Index('ix_announcement_active_created', is_active, created_at),
+        db.Index('ix_announcement_live_created', created_at,
+                 postgresql_where=(is_active == True), sqlite_where=(is_active == True)),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -272,9 +407,12 @@ class PerformanceReview(db.Model):
     status = db.Column(db.String(20), default='draft')  # draft, submitted, approved
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # optimistic lock: ORM UPDATEs match and bump it
     
     reviewer = db.relationship('User', foreign_keys=[reviewer_id], backref='conducted_reviews')
     
+    __mapper_args__ = {'version_id_col': version}
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -289,7 +427,8 @@ class PerformanceReview(db.Model):
             'comments': self.comments,
             'status': self.status,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': self.updated_at.isoformat(),
+            'version': self.version
         }
 
 class Ticket(db.Model):
@@ -303,14 +442,24 @@ class Ticket(db.Model):
     assigned_to = db.Column(db.Integer, db.ForeignKey('user.id'))
     attachment_path = db.Column(db.String(255))  # Path to uploaded file
     attachment_name = db.Column(db.String(255))  # Original filename
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Denormalized, kept in step with TicketComment inserts
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # optimistic lock: ORM UPDATEs match and bump it
     
     # Relationships
     creator = db.relationship('User', foreign_keys=[created_by], backref='created_tickets')
     assignee = db.relationship('User', foreign_keys=[assigned_to], backref='assigned_tickets')
     comments = db.relationship('TicketComment', backref='ticket', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_ticket_status', status),
+        db.Index('ix_ticket_created_by', created_by),
+        db.Index('ix_ticket_assigned_to', assigned_to),
+    )
+    
+    __mapper_args__ = {'version_id_col': version}
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -327,7 +476,8 @@ class Ticket(db.Model):
             'attachment_name': self.attachment_name,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'comments_count': len(self.comments)
+            'version': self.version,
+            'comments_count': self.comments_count or 0
         }
 
 class TicketComment(db.Model):
@@ -340,6 +490,10 @@ class TicketComment(db.Model):
     # Relationships
     author = db.relationship('User', backref='ticket_comments')
     
+    __table_args__ = (
+        db.Index('ix_ticket_comment_ticket_created', ticket_id, created_at),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -349,3 +503,34 @@ class TicketComment(db.Model):
             'comment_text': self.comment_text,
             'created_at': self.created_at.isoformat()
         }
+
+class ChatSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    summary = db.Column(db.Text)  # Condensed older turns, once the token budget was exceeded
+    turns = db.Column(db.Text, nullable=False, default='[]')  # JSON ring buffer of [role, content] pairs, oldest first
+    last_active_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # optimistic lock: ORM UPDATEs match and bump it
+    
+    __table_args__ = (
+        db.Index('ix_chat_session_last_active', last_active_at),
+    )
+    
+    __mapper_args__ = {'version_id_col': version}
+    
+    def get_turns(self):
+        return json.loads(self.turns or '[]')
+    
+    def set_turns(self, turns):
+        self.turns = json.dumps(turns, separators=(',', ':'))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'summary': self.summary,
+            'turns': [{'role': role, 'content': content} for role, content in self.get_turns()],
+            'last_active_at': self.last_active_at.isoformat(),
+            'created_at': self.created_at.isoformat()
+        }
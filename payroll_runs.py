@@ -0,0 +1,226 @@
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from flask import current_app
+from sqlalchemy import and_, case, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from app import db
+from models import User, Attendance, Payroll, PayrollRun
+from rollups import PAYROLL_TOTAL_FIELDS, payroll_snapshot, apply_payroll_change
+
+# Hours per attendance record before the rest counts as overtime
+STANDARD_DAY_HOURS = 8
+# Hours in a standard month, used to derive the hourly rate from basic salary
+STANDARD_MONTH_HOURS = 160
+OVERTIME_MULTIPLIER = Decimal('1.5')
+
+# Fields a run computes; a draft whose values all match is left untouched
+RUN_FIELDS = ('basic_salary', 'allowances', 'deductions', 'overtime_hours', 'overtime_pay',
+              'gross_pay', 'tax_deduction', 'net_pay')
+
+CENT = Decimal('0.01')
+
+class PayrollRunInProgress(Exception):
+    """Raised when another payroll run holds the run lock"""
+
+def to_money(value):
+    """Convert a float/Decimal/None amount to a 2-place Decimal"""
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def calculate_pay(basic_salary, allowances=0, deductions=0, overtime_pay=0, tax_deduction=0):
+    """Return (gross_pay, net_pay) for a payroll record's components"""
+    gross_pay = to_money(basic_salary) + to_money(allowances) + to_money(overtime_pay)
+    net_pay = gross_pay - to_money(deductions) - to_money(tax_deduction)
+    return gross_pay, net_pay
+
+def _acquire_run_lock(period_start, period_end, created_by):
+    """Insert and commit the 'running' PayrollRun row, or raise PayrollRunInProgress.
+
+    The partial unique index on PayrollRun.status admits one running row,
+    so this works across processes and hosts. Runs left 'running' by a
+    crashed worker are failed after PAYROLL_RUN_LOCK_TIMEOUT seconds.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=current_app.config['PAYROLL_RUN_LOCK_TIMEOUT'])
+    db.session.execute(
+        db.update(PayrollRun)
+        .where(PayrollRun.status == 'running', PayrollRun.started_at < stale_before)
+        .values(status='failed', error='Lock expired', completed_at=datetime.utcnow())
+    )
+
+    run = PayrollRun(pay_period_start=period_start, pay_period_end=period_end,
+                     created_by=created_by, status='running', started_at=datetime.utcnow())
+    db.session.add(run)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise PayrollRunInProgress('Another payroll run is in progress')
+    return run
+
+def _compute_rows(period_start, period_end, default_basic_salary):
+    """One query over active users with their carried-forward pay and overtime.
+
+    Returns {user_id: values} for users that have a salary to pay and the
+    number of active users skipped because they have none.
+    """
+    # Each user's most recent payroll before this period supplies salary,
+    # allowances, deductions and tax
+    latest = db.select(
+        Payroll.user_id, func.max(Payroll.pay_period_start).label('pay_period_start')
+    ).where(Payroll.pay_period_start < period_start).group_by(Payroll.user_id).subquery()
+    previous = aliased(Payroll)
+
+    overtime = db.select(
+        Attendance.user_id,
+        func.sum(case(
+            (Attendance.hours_worked > STANDARD_DAY_HOURS, Attendance.hours_worked - STANDARD_DAY_HOURS),
+            else_=0
+        )).label('overtime_hours')
+    ).where(
+        Attendance.date >= period_start, Attendance.date <= period_end
+    ).group_by(Attendance.user_id).subquery()
+
+    results = db.session.execute(
+        db.select(
+            User.id, previous.basic_salary, previous.allowances, previous.deductions,
+            previous.tax_deduction, overtime.c.overtime_hours
+        ).select_from(User)
+        .outerjoin(latest, latest.c.user_id == User.id)
+        .outerjoin(previous, and_(previous.user_id == User.id,
+                                  previous.pay_period_start == latest.c.pay_period_start))
+        .outerjoin(overtime, overtime.c.user_id == User.id)
+        .where(User.is_active == True)
+        .order_by(User.id, previous.id)
+    ).all()
+
+    rows = {}
+    skipped = set()
+    for user_id, basic_salary, allowances, deductions, tax_deduction, overtime_hours in results:
+        if basic_salary is None:
+            if default_basic_salary is None:
+                skipped.add(user_id)
+                continue
+            basic_salary = default_basic_salary
+
+        basic_salary = to_money(basic_salary)
+        overtime_hours = round(float(overtime_hours or 0), 2)
+        hourly_rate = basic_salary / STANDARD_MONTH_HOURS
+        overtime_pay = to_money(hourly_rate * OVERTIME_MULTIPLIER * Decimal(str(overtime_hours)))
+        gross_pay, net_pay = calculate_pay(basic_salary, allowances, deductions, overtime_pay, tax_deduction)
+
+        # Later rows (higher previous.id) win if a user has duplicate records
+        rows[user_id] = {
+            'basic_salary': basic_salary,
+            'allowances': to_money(allowances),
+            'deductions': to_money(deductions),
+            'overtime_hours': overtime_hours,
+            'overtime_pay': overtime_pay,
+            'gross_pay': gross_pay,
+            'tax_deduction': to_money(tax_deduction),
+            'net_pay': net_pay
+        }
+        skipped.discard(user_id)
+
+    return rows, len(skipped)
+
+def _values_snapshot(user_id, period_start, values):
+    """``payroll_snapshot`` of the record a run writes from ``values``"""
+    return {
+        'user_id': user_id,
+        'year': period_start.year,
+        **{name: Decimal(str(values[name])) for name in PAYROLL_TOTAL_FIELDS}
+    }
+
+def _is_changed(existing, values):
+    for name in RUN_FIELDS:
+        current = getattr(existing, name)
+        if name == 'overtime_hours':
+            if round(float(current or 0), 2) != values[name]:
+                return True
+        elif to_money(current) != values[name]:
+            return True
+    return False
+
+def run_payroll(period_start, period_end, created_by, default_basic_salary=None):
+    """Generate draft Payroll rows for every active user in a pay period.
+
+    Rows are keyed by (user_id, pay_period_start, pay_period_end), so a
+    re-run inserts missing drafts, updates drafts whose computed values
+    changed and leaves the rest alone. Approved and paid records are never
+    modified. The year totals are adjusted by the written records' deltas.
+    All writes happen in one transaction; the PayrollRun row records the
+    outcome.
+    """
+    run = _acquire_run_lock(period_start, period_end, created_by)
+
+    try:
+        rows, skipped = _compute_rows(period_start, period_end, default_basic_salary)
+        employee_count = len(rows) + skipped
+
+        existing = {}
+        for payroll in Payroll.query.filter(
+            Payroll.pay_period_start == period_start,
+            Payroll.pay_period_end == period_end
+        ).order_by(Payroll.id):
+            existing.setdefault(payroll.user_id, payroll)
+
+        now = datetime.utcnow()
+        inserts, updates, unchanged = [], [], 0
+        # (before, after) year-total snapshots of every record written
+        changes = []
+        for user_id, values in rows.items():
+            payroll = existing.get(user_id)
+            if payroll is None:
+                changes.append((None, _values_snapshot(user_id, period_start, values)))
+                inserts.append({
+                    'user_id': user_id,
+                    'pay_period_start': period_start,
+                    'pay_period_end': period_end,
+                    'status': 'draft',
+                    'payroll_run_id': run.id,
+                    'created_at': now,
+                    'updated_at': now,
+                    **values
+                })
+            elif payroll.status != 'draft':
+                skipped += 1
+            elif _is_changed(payroll, values):
+                # The loaded version is matched in the WHERE clause and bumped,
+                # so a draft edited since it was read fails the run
+                updates.append({'id': payroll.id, 'version': payroll.version, 'payroll_run_id': run.id,
+                                'updated_at': now, **values})
+                changes.append((payroll_snapshot(payroll), _values_snapshot(user_id, period_start, values)))
+            else:
+                unchanged += 1
+
+        # Batched executemany; ORM bulk UPDATE matches on the primary key
+        if inserts:
+            db.session.execute(db.insert(Payroll), inserts)
+        if updates:
+            db.session.execute(db.update(Payroll), updates)
+        # Only the written records move the year totals, in this transaction
+        for before, after in changes:
+            apply_payroll_change(before, after)
+
+        run.employee_count = employee_count
+        run.created_count = len(inserts)
+        run.updated_count = len(updates)
+        run.unchanged_count = unchanged
+        run.skipped_count = skipped
+        run.status = 'completed'
+        run.completed_at = datetime.utcnow()
+        db.session.commit()
+
+        logging.info(f"Payroll run {run.id} for {period_start}..{period_end}: "
+                     f"{run.created_count} created, {run.updated_count} updated, "
+                     f"{run.unchanged_count} unchanged, {run.skipped_count} skipped")
+        return run
+
+    except Exception as e:
+        db.session.rollback()
+        run.status = 'failed'
+        run.error = str(e)
+        run.completed_at = datetime.utcnow()
+        db.session.commit()
+        raise
@@ -0,0 +1,224 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import case, func, cast, Date
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from models import User, Attendance, AttendanceDailyRollup, AttendanceMonthlyRollup, Payroll, PayrollYearTotal
+
+# Statuses counted as present in the rollups
+PRESENT_STATUSES = ('present', 'late')
+
+def month_start(day):
+    """First day of the month containing `day`"""
+    return day.replace(day=1)
+
+def attendance_snapshot(attendance):
+    """Capture what an attendance record contributes to the rollups.
+
+    Take a snapshot before changing a record and another after, then pass
+    both to ``apply_attendance_change``; use None as the before snapshot
+    of a new record.
+    """
+    department = db.session.query(User.department).filter_by(id=attendance.user_id).scalar()
+    return {
+        'user_id': attendance.user_id,
+        'date': attendance.date,
+        'department': department or '',
+        'present': 1 if attendance.status in PRESENT_STATUSES else 0,
+        'hours_worked': float(attendance.hours_worked or 0.0)
+    }
+
+def _increment(model, keys, deltas):
+    """Add `deltas` to the rollup row at `keys`, creating it if missing"""
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert(model).values(**keys, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in deltas}
+        )
+        db.session.execute(stmt)
+        return
+
+    row = db.session.get(model, tuple(keys.values()), with_for_update=True)
+    if row is None:
+        db.session.add(model(**keys, **deltas))
+    else:
+        for name, delta in deltas.items():
+            setattr(row, name, getattr(row, name) + delta)
+
+def _apply(snapshot, sign):
+    deltas = {
+        'record_count': sign,
+        'present_count': sign * snapshot['present'],
+        'hours_worked': sign * snapshot['hours_worked']
+    }
+    _increment(AttendanceDailyRollup,
+               {'date': snapshot['date'], 'department': snapshot['department']}, deltas)
+    _increment(AttendanceMonthlyRollup,
+               {'month': month_start(snapshot['date']), 'user_id': snapshot['user_id']}, deltas)
+
+def apply_attendance_change(before, after):
+    """Move an attendance record's contribution from `before` to `after`.
+
+    Either snapshot may be None (record created or deleted). Runs in the
+    caller's transaction so the rollups commit with the record itself.
+    """
+    if before == after:
+        return
+    if before is not None:
+        _apply(before, -1)
+    if after is not None:
+        _apply(after, 1)
+
+def move_department_rollups(user_ids, department):
+    """Move the daily rollup contributions of ``user_ids`` from their
+    current departments to ``department``.
+
+    Daily rows are keyed by the user's department, so call this in the
+    transaction that changes it, before the new department is flushed;
+    the rollups then match what a rebuild would write.
+    """
+    department = department or ''
+    old_department = func.coalesce(User.department, '')
+    present = func.sum(case((Attendance.status.in_(PRESENT_STATUSES), 1), else_=0))
+    hours = func.coalesce(func.sum(Attendance.hours_worked), 0.0)
+
+    # Pending changes to the users must not be flushed before the old
+    # departments are read
+    with db.session.no_autoflush:
+        rows = db.session.execute(
+            db.select(Attendance.date, old_department, func.count(Attendance.id), present, hours)
+            .join(User, User.id == Attendance.user_id)
+            .where(Attendance.user_id.in_(user_ids), old_department != department)
+            .group_by(Attendance.date, old_department)
+        ).all()
+
+        for day, previous, records, present_count, hours_worked in rows:
+            deltas = {'record_count': records, 'present_count': present_count, 'hours_worked': float(hours_worked)}
+            _increment(AttendanceDailyRollup, {'date': day, 'department': previous},
+                       {name: -delta for name, delta in deltas.items()})
+            _increment(AttendanceDailyRollup, {'date': day, 'department': department}, deltas)
+
+        if rows:
+            # Drop the rows left empty, as a rebuild would not write them
+            db.session.execute(db.delete(AttendanceDailyRollup).where(
+                AttendanceDailyRollup.record_count == 0,
+                AttendanceDailyRollup.date.between(min(row[0] for row in rows), max(row[0] for row in rows))
+            ))
+
+def _month_expression(column):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return func.date(column, 'start of month')
+    return cast(func.date_trunc('month', column), Date)
+
+def rebuild_attendance_rollups(date_from=None, date_to=None):
+    """Recompute both rollup tables from Attendance.
+
+    The range is widened to whole months so monthly rows are complete.
+    Returns the number of (daily, monthly) rows written.
+    """
+    if date_from is not None:
+        date_from = month_start(date_from)
+    if date_to is not None:
+        # Last day of date_to's month
+        date_to = month_start(date_to.replace(day=28) + timedelta(days=4)) - timedelta(days=1)
+
+    def in_range(column):
+        conditions = []
+        if date_from is not None:
+            conditions.append(column >= date_from)
+        if date_to is not None:
+            conditions.append(column <= date_to)
+        return conditions
+
+    db.session.execute(db.delete(AttendanceDailyRollup).where(*in_range(AttendanceDailyRollup.date)))
+    db.session.execute(db.delete(AttendanceMonthlyRollup).where(*in_range(AttendanceMonthlyRollup.month)))
+
+    present = func.sum(case((Attendance.status.in_(PRESENT_STATUSES), 1), else_=0))
+    hours = func.coalesce(func.sum(Attendance.hours_worked), 0.0)
+
+    department = func.coalesce(User.department, '')
+    daily = db.select(
+        Attendance.date, department, func.count(Attendance.id), present, hours
+    ).join(User, User.id == Attendance.user_id)\
+        .where(*in_range(Attendance.date))\
+        .group_by(Attendance.date, department)
+    daily_result = db.session.execute(db.insert(AttendanceDailyRollup).from_select(
+        ['date', 'department', 'record_count', 'present_count', 'hours_worked'], daily
+    ))
+
+    month = _month_expression(Attendance.date)
+    monthly = db.select(
+        month, Attendance.user_id, func.count(Attendance.id), present, hours
+    ).where(*in_range(Attendance.date))\
+        .group_by(month, Attendance.user_id)
+    monthly_result = db.session.execute(db.insert(AttendanceMonthlyRollup).from_select(
+        ['month', 'user_id', 'record_count', 'present_count', 'hours_worked'], monthly
+    ))
+
+    db.session.commit()
+    return daily_result.rowcount, monthly_result.rowcount
+
+# Payroll amounts summed into PayrollYearTotal
+PAYROLL_TOTAL_FIELDS = ('gross_pay', 'net_pay', 'tax_deduction', 'deductions')
+
+def year_range(year):
+    """Half-open [start, end) date bounds of a calendar year"""
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+def payroll_snapshot(payroll):
+    """Capture what a payroll record contributes to PayrollYearTotal.
+
+    Used the same way as ``attendance_snapshot``.
+    """
+    return {
+        'user_id': payroll.user_id,
+        'year': payroll.pay_period_start.year,
+        **{name: Decimal(str(getattr(payroll, name) or 0)) for name in PAYROLL_TOTAL_FIELDS}
+    }
+
+def _apply_payroll(snapshot, sign):
+    deltas = {'record_count': sign}
+    deltas.update({name: sign * snapshot[name] for name in PAYROLL_TOTAL_FIELDS})
+    _increment(PayrollYearTotal, {'user_id': snapshot['user_id'], 'year': snapshot['year']}, deltas)
+
+def apply_payroll_change(before, after):
+    """Move a payroll record's contribution from `before` to `after`"""
+    if before == after:
+        return
+    if before is not None:
+        _apply_payroll(before, -1)
+    if after is not None:
+        _apply_payroll(after, 1)
+
+def rebuild_payroll_year_totals(year=None, commit=True):
+    """Recompute PayrollYearTotal from Payroll, for one year or all.
+
+    Pass commit=False to run inside the caller's transaction. Returns the
+    number of rows written.
+    """
+    if year is not None:
+        start, end = year_range(year)
+        db.session.execute(db.delete(PayrollYearTotal).where(PayrollYearTotal.year == year))
+        conditions = [Payroll.pay_period_start >= start, Payroll.pay_period_start < end]
+    else:
+        db.session.execute(db.delete(PayrollYearTotal))
+        conditions = []
+
+    payroll_year = cast(func.extract('year', Payroll.pay_period_start), db.Integer)
+    totals = db.select(
+        Payroll.user_id, payroll_year, func.count(Payroll.id),
+        *[func.coalesce(func.sum(getattr(Payroll, name)), 0) for name in PAYROLL_TOTAL_FIELDS]
+    ).where(*conditions).group_by(Payroll.user_id, payroll_year)
+    result = db.session.execute(db.insert(PayrollYearTotal).from_select(
+        ['user_id', 'year', 'record_count', *PAYROLL_TOTAL_FIELDS], totals
+    ))
+
+    if commit:
+        db.session.commit()
+    return result.rowcount
@@ -0,0 +1,189 @@
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import Numeric, inspect
+from sqlalchemy.orm import load_only
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_flask_default = DefaultJSONProvider.default
+
+def _default(o):
+    # ISO 8601 like every to_dict, rather than Flask's HTTP date format
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    return _flask_default(o)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson when installed.
+
+    Output matches the stdlib provider (sorted keys, compact unless
+    debugging), except that dates and datetimes are written as ISO 8601
+    and Decimals as numbers on both paths. Anything orjson rejects, such
+    as integers beyond 64 bits, falls back to the stdlib encoder.
+    """
+
+    default = staticmethod(_default)
+
+    def _options(self, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _encode(self, obj, pretty=False):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options(pretty))
+        except TypeError:
+            dump_args = {'indent': 2} if pretty else {'separators': (',', ':')}
+            return super().dumps(obj, **dump_args).encode()
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._encode(obj, pretty) + b'\n', mimetype=self.mimetype)
+
+def compile_serializer(model, exclude=(), extra=None, only=None):
+    """Generate a function returning the same dict as ``model.to_dict()``.
+
+    The function body is built once from the mapped columns: a single dict
+    display with one read per column, Numeric columns converted to float
+    and dates left for the JSON provider to format (in C when orjson is
+    installed). ``extra`` maps further keys to ``(function of the instance,
+    columns it reads)``, for computed fields such as names of related
+    users. ``only`` restricts the output to those keys.
+    """
+    namespace = {}
+    fast_fields, fields = [], []
+    for attribute in inspect(model).column_attrs:
+        key = attribute.key
+        if key in exclude or (only is not None and key not in only):
+            continue
+        column_type = attribute.columns[0].type
+        if isinstance(column_type, Numeric) and column_type.asdecimal:
+            fast_fields.append(f"{key!r}: None if (value := state[{key!r}]) is None else float(value)")
+            fields.append(f"{key!r}: None if (value := obj.{key}) is None else float(value)")
+        else:
+            fast_fields.append(f"{key!r}: state[{key!r}]")
+            fields.append(f"{key!r}: obj.{key}")
+
+    for key, (function, _) in (extra or {}).items():
+        if only is not None and key not in only:
+            continue
+        namespace[f'_extra_{key}'] = function
+        fast_fields.append(f"{key!r}: _extra_{key}(obj)")
+        fields.append(f"{key!r}: _extra_{key}(obj)")
+
+    # Loaded column values sit in the instance __dict__; reading them there
+    # skips the instrumented attributes. Expired or deferred columns are
+    # missing from it, and those rows take the attribute path, which loads them.
+    source = (
+        "def serialize(obj):\n"
+        "    state = obj.__dict__\n"
+        "    try:\n"
+        f"        return {{{', '.join(fast_fields)}}}\n"
+        "    except KeyError:\n"
+        f"        return {{{', '.join(fields)}}}\n"
+    )
+    exec(compile(source, f'<serializer {model.__name__}>', 'exec'), namespace)
+    return namespace['serialize']
+
+def _full_name(user, default=None):
+    return f"{user.first_name} {user.last_name}" if user else default
+
+# How each model's to_dict differs from a plain dump of its columns
+SERIALIZER_OPTIONS = {
+    'User': {'exclude': ('password_hash', 'auth_version')},
+    'Announcement': {
+        'extra': {'author_name': (lambda announcement: _full_name(announcement.author, 'Unknown'), ('author_id',))}
+    },
+    'Ticket': {
+        'exclude': ('comments_count',),
+        'extra': {
+            'creator_name': (lambda ticket: _full_name(ticket.creator, 'Unknown'), ('created_by',)),
+            'assignee_name': (lambda ticket: _full_name(ticket.assignee), ('assigned_to',)),
+            'comments_count': (lambda ticket: ticket.comments_count or 0, ('comments_count',))
+        }
+    },
+}
+
+def _options(model):
+    return SERIALIZER_OPTIONS.get(model.__name__, {})
+
+def output_fields(model):
+    """Keys of the serialized ``model``, as returned by its to_dict"""
+    options = _options(model)
+    columns = [attribute.key for attribute in inspect(model).column_attrs
+               if attribute.key not in options.get('exclude', ())]
+    return columns + list(options.get('extra', {}))
+
+@lru_cache(maxsize=256)
+def serializer_for(model, fields=None):
+    """Compiled serializer for ``model`` (restricted to the ``fields``
+    tuple from parse_fields), generated on first use"""
+    return compile_serializer(model, only=fields, **_options(model))
+
+def serialize(record, fields=None):
+    """Serialize one record for a JSON response"""
+    return serializer_for(type(record), fields)(record)
+
+def serialize_all(model, records, fields=None):
+    """Serialize a page of ``model`` instances for a JSON response"""
+    return list(map(serializer_for(model, fields), records))
+
+def parse_fields(model, args, also=()):
+    """Keys requested with ``?fields=a,b`` as a sorted tuple, or None for all.
+
+    ``also`` names keys the view adds to the serialized record itself.
+    Raises ValueError for unknown names.
+    """
+    value = args.get('fields', '')
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    if not requested:
+        return None
+
+    unknown = requested - set(output_fields(model)) - set(also)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(sorted(requested))
+
+def select_fields(query, model, fields, keep=()):
+    """Narrow ``query`` to the columns behind ``fields`` with load_only, so
+    unrequested columns (large Text ones in particular) are never read.
+
+    ``keep`` lists further column attributes the view needs, such as sort
+    keys, owner ids for access checks or the version. Returns the query
+    unchanged when ``fields`` is None.
+    """
+    if fields is None:
+        return query
+
+    extra = _options(model).get('extra', {})
+    column_keys = {attribute.key for attribute in inspect(model).column_attrs}
+    keys = {attribute.key for attribute in keep}
+    for name in fields:
+        if name in extra:
+            keys.update(extra[name][1])
+        elif name in column_keys:
+            keys.add(name)
+    return query.options(load_only(*[getattr(model, key) for key in sorted(keys)]))
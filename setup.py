@@ -198,6 +198,12 @@ def main():
             db.session.commit()
             logging.info(f"✅ Created {payroll_count} payroll records")
             
+            # Seeded rows bypass the API, so build the rollup tables from them
+            from rollups import rebuild_attendance_rollups, rebuild_payroll_year_totals
+            rebuild_attendance_rollups()
+            rebuild_payroll_year_totals()
+            logging.info("✅ Built attendance and payroll rollups")
+            
             # Create sample job postings
             jobs = [
                 {
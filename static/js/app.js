@@ -134,10 +134,23 @@ const app = {
         }
 
         try {
-            const response = await axios.get(`/auth/me`);
-            this.currentUser = response.data;
+            // One round trip for the user, the dashboard stats and today's attendance
+            const response = await axios.post(`${this.baseURL}/batch`, {
+                requests: [
+                    { path: '/auth/me' },
+                    { path: '/api/dashboard/stats' },
+                    { path: '/api/attendance/today' }
+                ]
+            });
+            const [me, stats, today] = response.data.responses;
+            if (me.status !== 200) {
+                this.showLoginModal();
+                return;
+            }
+            this.currentUser = me.body;
             this.updateUI();
-            this.loadDashboard();
+            this.loadDashboard(stats.status === 200 ? stats.body : null, today);
+            this.connectEvents();
         } catch (error) {
             this.showLoginModal();
         }
@@ -169,6 +182,7 @@ const app = {
             
             this.updateUI();
             this.loadDashboard();
+            this.connectEvents();
         } catch (error) {
             errorDiv.textContent = error.response?.data?.error || 'Login failed';
             errorDiv.style.display = 'block';
@@ -181,9 +195,62 @@ const app = {
         this.token = null;
         this.currentUser = null;
         localStorage.removeItem('token');
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         this.showLoginModal();
     },
 
+    async connectEvents() {
+        // Server-sent events replace polling for announcements, tickets and leave decisions
+        if (!window.EventSource || this.eventSource || !this.token) return;
+
+        // EventSource cannot send headers, so the stream is opened with a
+        // short-lived token that is good for nothing else
+        let streamToken;
+        try {
+            const response = await axios.post(`${this.baseURL}/events/token`);
+            streamToken = response.data.token;
+        } catch (error) {
+            return;
+        }
+        if (this.eventSource || !this.token) return;
+
+        const source = new EventSource(`${this.baseURL}/events/stream?token=${encodeURIComponent(streamToken)}`);
+        this.eventSource = source;
+        source.addEventListener('error', () => {
+            // Reconnecting with an expired stream token fails for good; start over with a new one
+            if (source.readyState === EventSource.CLOSED && this.eventSource === source) {
+                this.eventSource = null;
+                setTimeout(() => this.connectEvents(), 5000);
+            }
+        });
+        source.addEventListener('session.revoked', () => {
+            source.close();
+            if (this.eventSource === source) {
+                this.eventSource = null;
+            }
+        });
+        this.eventSource.addEventListener('announcement.created', (event) => {
+            const announcement = JSON.parse(event.data);
+            this.showAlert(`New announcement: ${this.escapeHtml(announcement.title)}`, 'info');
+        });
+        this.eventSource.addEventListener('leave.decided', (event) => {
+            const leave = JSON.parse(event.data);
+            this.showAlert(`Your leave request was ${this.escapeHtml(leave.status)}`,
+                leave.status === 'approved' ? 'success' : 'warning');
+        });
+        this.eventSource.addEventListener('ticket.comment', (event) => {
+            const data = JSON.parse(event.data);
+            this.showAlert(`New comment on ticket #${data.ticket_id}`, 'info');
+        });
+        this.eventSource.addEventListener('ticket.updated', (event) => {
+            const data = JSON.parse(event.data);
+            this.showAlert(`Ticket #${data.ticket.id} was updated`, 'info');
+        });
+    },
+
     updateUI() {
         if (!this.currentUser) return;
 
@@ -377,13 +444,12 @@ const app = {
         }
     },
 
-    async loadDashboard() {
+    async loadDashboard(prefetchedStats = null, prefetchedToday = null) {
         try {
             this.showLoading();
             
             // Use the new dashboard stats API
-            const response = await axios.get(`${this.baseURL}/dashboard/stats`);
-            const data = response.data;
+            const data = prefetchedStats || (await axios.get(`${this.baseURL}/dashboard/stats`)).data;
 
             // Update dashboard stats with real data
             const pendingLeavesEl = document.getElementById('pendingLeaves');
@@ -412,7 +478,7 @@ const app = {
             this.updateAnnouncements(data.recent_announcements);
             
             // Load attendance data for today's status
-            this.loadTodayAttendance();
+            this.loadTodayAttendance(prefetchedToday);
             
             // Create sample data if user is admin and no attendance exists
             if (data.user.role === 'admin' && data.present_today === 0) {
@@ -475,7 +541,13 @@ const app = {
         }
     },
 
-    async loadTodayAttendance() {
+    async loadTodayAttendance(prefetched = null) {
+        if (prefetched) {
+            // Result of a batch sub-request; 404 means not clocked in yet
+            this.updateTodayAttendanceStatus(prefetched.status === 200 ? prefetched.body : null);
+            return;
+        }
+        
         try {
             const todayResponse = await axios.get(`${this.baseURL}/attendance/today`);
             this.updateTodayAttendanceStatus(todayResponse.data);
@@ -1287,12 +1359,42 @@ const app = {
         input.value = '';
 
         try {
-            const response = await axios.post(`${this.baseURL}/chatbot`, {
-                message: message
+            // Tokens are appended to the bot's bubble as the server relays them
+            const response = await fetch(`${this.baseURL}/chatbot/stream`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${this.token}`
+                },
+                body: JSON.stringify({ message: message })
             });
-            
-            // Add bot response to chat
-            this.addChatMessage('bot', response.data.response);
+            if (!response.ok || !response.body) {
+                throw new Error(`Chatbot request failed with status ${response.status}`);
+            }
+
+            const bubble = this.addChatMessage('bot', '');
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const frames = buffer.split('\n\n');
+                buffer = frames.pop();
+                for (const frame of frames) {
+                    const [eventLine, dataLine] = frame.split('\n');
+                    const data = JSON.parse(dataLine.slice('data: '.length));
+                    if (eventLine === 'event: token') {
+                        bubble.textContent += data.text;
+                    } else if (eventLine === 'event: error') {
+                        bubble.textContent += ` (${data.error})`;
+                    } else if (eventLine === 'event: done' && data.source === 'llm' && data.sources.length) {
+                        // Offline policy answers already name their source
+                        bubble.textContent += `\n\nSources: ${data.sources.map(source => source.title).join(', ')}`;
+                    }
+                }
+            }
         } catch (error) {
             this.addChatMessage('bot', 'Sorry, I encountered an error. Please try again.');
         }
@@ -1314,6 +1416,7 @@ const app = {
         
         chatMessages.appendChild(messageDiv);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return messageDiv.querySelector('.d-inline-block');
     },
 
     async loadAdmin() {
@@ -2075,8 +2178,9 @@ async function loadTicketData() {
 async function loadTickets() {
     try {
         const params = new URLSearchParams(currentTicketFilters);
+        params.set('per_page', 100);
         const response = await axios.get(`${app.baseURL}/tickets/?${params}`);
-        allTickets = response.data;
+        allTickets = response.data.tickets;
         displayTickets(allTickets);
     } catch (error) {
         console.error('Error loading tickets:', error);
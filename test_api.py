@@ -4,12 +4,23 @@ Unit tests for HR Management System API
 
 import unittest
 import json
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from app import create_app, db
-from models import User, Leave, Attendance, Payroll, Settings, Announcement, Job, JobApplication, PerformanceReview
-from werkzeug.security import generate_password_hash
+from models import User, Leave, Attendance, Payroll, Settings, Announcement, Job, JobApplication, PerformanceReview, Ticket, AttendanceDailyRollup, AttendanceMonthlyRollup, PayrollYearTotal, PayrollRun, ChatSession
+from rollups import attendance_snapshot, apply_attendance_change, rebuild_payroll_year_totals
+from werkzeug.security import generate_password_hash, check_password_hash
 import tempfile
 import os
+from contextlib import contextmanager
+from sqlalchemy import event
+from unittest import mock
+import time
+import llm
+import chat_cache
+import knowledge
+import intents
+import chat_memory
+import shutil
 
 
 class HRSystemTestCase(unittest.TestCase):
@@ -100,6 +111,22 @@ class HRSystemTestCase(unittest.TestCase):
     def get_headers(self, token):
         """Helper method to get authorization headers"""
         return {'Authorization': f'Bearer {token}'}
+    
+    @contextmanager
+    def count_queries(self):
+        """Helper context manager that records the SQL statements executed"""
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
 
 
 class AuthTestCase(HRSystemTestCase):
@@ -164,6 +191,142 @@ class AuthTestCase(HRSystemTestCase):
         self.assertEqual(response.status_code, 401)
 
 
+class PrincipalTestCase(HRSystemTestCase):
+    """Test principal resolution from JWT claims"""
+    
+    def test_token_carries_principal_claims(self):
+        """Test that login embeds role and employee details in the token"""
+        token = self.login_user('hr', 'hr123')
+        self.assertIsNotNone(token)
+        
+        with self.app.app_context():
+            from flask_jwt_extended import decode_token
+            claims = decode_token(token)
+        
+        self.assertEqual(claims['role'], 'hr')
+        self.assertEqual(claims['ver'], 0)
+        # Department and employee ID can change under a live token
+        self.assertNotIn('department', claims)
+        self.assertNotIn('employee_id', claims)
+    
+    def resolve_principal(self, token):
+        """Helper method resolving the principal of a token as a view would"""
+        from flask_jwt_extended import verify_jwt_in_request
+        from utils import get_current_principal
+        with self.app.test_request_context(headers=self.get_headers(token)):
+            verify_jwt_in_request()
+            return get_current_principal()
+    
+    def test_department_change_applies_to_live_token(self):
+        """Test a department change is seen by principals of existing tokens"""
+        admin_token = self.login_user('admin', 'admin123')
+        employee_token = self.login_user('employee', 'emp123')
+        self.assertEqual(self.resolve_principal(employee_token).department, 'Engineering')
+        
+        response = self.client.put('/api/profile', data=json.dumps({'department': 'Sales'}),
+                                   content_type='application/json', headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.resolve_principal(employee_token).department, 'Sales')
+        
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+        response = self.client.put(f'/api/admin/users/{employee_id}', data=json.dumps({'department': 'Finance'}),
+                                   content_type='application/json', headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.resolve_principal(employee_token).department, 'Finance')
+        
+        response = self.client.patch('/api/admin/users/bulk',
+                                    data=json.dumps({'user_ids': [employee_id], 'changes': {'department': 'Legal'}}),
+                                    content_type='application/json', headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.resolve_principal(employee_token).department, 'Legal')
+    
+    def test_missing_columns_added_to_existing_database(self):
+        """Test columns added to models since a database was created are added on upgrade"""
+        from sqlalchemy import inspect as inspect_schema, text
+        from commands import add_missing_columns
+        
+        with self.app.app_context():
+            db.session.execute(text('ALTER TABLE user DROP COLUMN auth_version'))
+            db.session.commit()
+            
+            statements = add_missing_columns()
+            self.assertEqual(len(statements), 1)
+            self.assertIn('auth_version', statements[0])
+            self.assertIn('auth_version', {column['name'] for column in inspect_schema(db.engine).get_columns('user')})
+            self.assertEqual(add_missing_columns(), [])
+        
+        self.assertIsNotNone(self.login_user('employee', 'emp123'))
+    
+    def test_deactivated_user_token_rejected(self):
+        """Test that deactivating a user invalidates their existing token"""
+        admin_token = self.login_user('admin', 'admin123')
+        employee_token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/profile',
+                                 headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 200)
+        
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            employee_id = employee.id
+        
+        response = self.client.put(f'/api/admin/users/{employee_id}',
+                                 data=json.dumps({'is_active': False}),
+                                 content_type='application/json',
+                                 headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get('/api/profile',
+                                 headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_role_change_invalidates_token(self):
+        """Test that a role change requires a fresh token"""
+        admin_token = self.login_user('admin', 'admin123')
+        hr_token = self.login_user('hr', 'hr123')
+        
+        with self.app.app_context():
+            hr_id = User.query.filter_by(username='hr').first().id
+        
+        response = self.client.put(f'/api/admin/users/{hr_id}',
+                                 data=json.dumps({'role': 'employee'}),
+                                 content_type='application/json',
+                                 headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get('/api/profile',
+                                 headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 404)
+        
+        new_token = self.login_user('hr', 'hr123')
+        response = self.client.get('/api/admin/users',
+                                 headers=self.get_headers(new_token))
+        self.assertEqual(response.status_code, 403)
+
+    def test_state_cached_before_commit_is_dropped(self):
+        """Test auth state re-cached while a revocation commits does not outlive it"""
+        from sqlalchemy.orm import Session
+        from utils import _get_auth_state
+        admin_token = self.login_user('admin', 'admin123')
+        employee_token = self.login_user('employee', 'emp123')
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+
+        def stale_read(session):
+            # Another request on this worker reading the committed, old state
+            with self.app.app_context():
+                _get_auth_state(employee_id)
+
+        event.listen(Session, 'before_commit', stale_read, once=True)
+        response = self.client.put(f'/api/admin/users/{employee_id}',
+                                 data=json.dumps({'is_active': False}),
+                                 content_type='application/json',
+                                 headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.resolve_principal(employee_token))
+
+
 class DeskTestCase(HRSystemTestCase):
     """Test desk/dashboard endpoints"""
     
@@ -308,6 +471,439 @@ class AttendanceTestCase(HRSystemTestCase):
         self.assertIn('error', data)
 
 
+class AttendanceRollupTestCase(HRSystemTestCase):
+    """Test the attendance rollup tables"""
+    
+    def rollup_rows(self):
+        with self.app.app_context():
+            daily = sorted((row.department, row.record_count, row.present_count)
+                           for row in AttendanceDailyRollup.query.all())
+            monthly = sorted((row.user_id, row.record_count, row.present_count)
+                             for row in AttendanceMonthlyRollup.query.all())
+            return daily, monthly
+    
+    def test_clock_in_and_update_maintain_rollups(self):
+        """Test that clock-in and HR edits update the rollups incrementally"""
+        employee_token = self.login_user('employee', 'emp123')
+        hr_token = self.login_user('hr', 'hr123')
+        
+        response = self.client.post('/api/attendance/clock-in',
+                                  headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 201)
+        attendance_id = json.loads(response.data)['id']
+        
+        daily, monthly = self.rollup_rows()
+        self.assertEqual(daily, [('Engineering', 1, 1)])
+        self.assertEqual(monthly[0][1:], (1, 1))
+        
+        response = self.client.get('/api/dashboard/stats', headers=self.get_headers(hr_token))
+        data = json.loads(response.data)
+        self.assertEqual(data['present_today'], 1)
+        self.assertEqual(data['monthly_attendance_records'], 1)
+        
+        response = self.client.put(f'/api/attendance/{attendance_id}',
+                                 data=json.dumps({'status': 'absent'}),
+                                 content_type='application/json',
+                                 headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 200)
+        
+        daily, monthly = self.rollup_rows()
+        self.assertEqual(daily, [('Engineering', 1, 0)])
+        self.assertEqual(monthly[0][1:], (1, 0))
+
+    def test_desk_summary_reads_monthly_rollup(self):
+        """Test the desk's monthly attendance count comes from the rollup"""
+        token = self.login_user('employee', 'emp123')
+
+        response = self.client.get('/api/desk/summary', headers=self.get_headers(token))
+        self.assertEqual(json.loads(response.data)['monthly_attendance_days'], 0)
+
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            month = date.today().replace(day=1)
+            db.session.add(AttendanceMonthlyRollup(month=month, user_id=employee.id, record_count=7,
+                                                   present_count=7, hours_worked=56.0))
+            db.session.commit()
+
+        response = self.client.get('/api/desk/summary', headers=self.get_headers(token))
+        self.assertEqual(json.loads(response.data)['monthly_attendance_days'], 7)
+
+    def test_rebuild_matches_incremental(self):
+        """Test that the rebuild command reproduces the maintained rollups"""
+        for username, password in [('employee', 'emp123'), ('hr', 'hr123')]:
+            token = self.login_user(username, password)
+            self.client.post('/api/attendance/clock-in', headers=self.get_headers(token))
+        
+        incremental = self.rollup_rows()
+        
+        result = self.app.test_cli_runner().invoke(args=['rebuild-attendance-rollups'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Rebuilt 2 daily and 2 monthly', result.output)
+        self.assertEqual(self.rollup_rows(), incremental)
+    
+    def test_department_change_moves_rollups(self):
+        """Test department changes move a user's attendance to the new department
+        as a rebuild would"""
+        admin_token = self.login_user('admin', 'admin123')
+        employee_token = self.login_user('employee', 'emp123')
+        for token in [employee_token, admin_token]:
+            self.client.post('/api/attendance/clock-in', headers=self.get_headers(token))
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+            for day in [date(2024, 3, 1), date(2024, 3, 4)]:
+                attendance = Attendance(user_id=employee_id, date=day, status='late', hours_worked=6.0)
+                db.session.add(attendance)
+                db.session.flush()
+                apply_attendance_change(None, attendance_snapshot(attendance))
+            db.session.commit()
+        
+        def rebuilt():
+            incremental = self.rollup_rows()
+            self.app.test_cli_runner().invoke(args=['rebuild-attendance-rollups'])
+            self.assertEqual(self.rollup_rows(), incremental)
+            return incremental[0]
+        
+        self.client.put('/api/profile', data=json.dumps({'department': 'Sales'}),
+                        content_type='application/json', headers=self.get_headers(employee_token))
+        self.assertIn(('Sales', 1, 1), rebuilt())
+        
+        self.client.put(f'/api/admin/users/{employee_id}', data=json.dumps({'department': 'Finance'}),
+                        content_type='application/json', headers=self.get_headers(admin_token))
+        self.assertNotIn('Sales', [row[0] for row in rebuilt()])
+        
+        self.client.patch('/api/admin/users/bulk',
+                          data=json.dumps({'user_ids': [employee_id], 'changes': {'department': 'Legal'}}),
+                          content_type='application/json', headers=self.get_headers(admin_token))
+        self.assertEqual([row for row in rebuilt() if row[0] == 'Legal'], [('Legal', 1, 1)] * 3)
+    
+    def test_attendance_report(self):
+        """Test the per-department report and its access control"""
+        employee_token = self.login_user('employee', 'emp123')
+        self.client.post('/api/attendance/clock-in', headers=self.get_headers(employee_token))
+        
+        response = self.client.get('/api/attendance/report', headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 403)
+        
+        hr_token = self.login_user('hr', 'hr123')
+        response = self.client.get('/api/attendance/report', headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['by_department'][0]['department'], 'Engineering')
+        self.assertEqual(data['by_department'][0]['present_count'], 1)
+        self.assertEqual(data['by_user'][0]['employee_id'], 'EMP003')
+
+
+class AttendanceImportTestCase(HRSystemTestCase):
+    """Test bulk CSV attendance import"""
+    
+    CSV = (
+        "employee_id,date,clock_in,clock_out,hours_worked,status,notes\n"
+        "EMP003,2024-03-01,09:00,17:30,,present,\n"
+        "EMP003,2024-03-02,,,4,late,\"Doctor, morning\"\n"
+        "EMP999,2024-03-01,09:00,17:00,,present,\n"
+        "EMP002,not-a-date,,,,present,\n"
+        "EMP002,2024-03-01,,,,holiday,\n"
+    )
+    
+    def upload(self, token, content):
+        from io import BytesIO
+        return self.client.post('/api/attendance/import',
+                              data={'file': (BytesIO(content.encode()), 'attendance.csv')},
+                              content_type='multipart/form-data',
+                              headers=self.get_headers(token))
+    
+    def test_import_reports_row_errors(self):
+        """Test valid rows are imported and bad rows reported by line"""
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.upload(token, self.CSV)
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)
+        self.assertEqual(report['processed'], 5)
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(report['error_count'], 3)
+        self.assertEqual([error['line'] for error in report['errors']], [4, 5, 6])
+        
+        with self.app.app_context():
+            records = Attendance.query.order_by(Attendance.date).all()
+            self.assertEqual([record.hours_worked for record in records], [8.5, 4.0])
+            self.assertEqual(records[1].notes, 'Doctor, morning')
+            rollup = db.session.get(AttendanceMonthlyRollup, (date(2024, 3, 1), records[0].user_id))
+            self.assertEqual((rollup.record_count, rollup.present_count), (2, 2))
+    
+    def test_import_upserts_on_user_and_date(self):
+        """Test re-importing a day updates the existing record"""
+        token = self.login_user('hr', 'hr123')
+        self.upload(token, self.CSV)
+        
+        response = self.upload(token, "employee_id,date,hours_worked,status\nEMP003,2024-03-01,6,absent\n")
+        self.assertEqual(json.loads(response.data)['imported'], 1)
+        
+        with self.app.app_context():
+            self.assertEqual(Attendance.query.count(), 2)
+            record = Attendance.query.filter_by(date=date(2024, 3, 1)).one()
+            self.assertEqual((record.hours_worked, record.status), (6.0, 'absent'))
+    
+    def test_failed_import_rebuilds_committed_rollups(self):
+        """Test rows committed before a failure are still counted in the rollups"""
+        from io import StringIO
+        import attendance_import
+        write_chunk = attendance_import._write_chunk
+        calls = []
+        
+        def failing_write(rows, dialect):
+            calls.append(rows)
+            if len(calls) > 1:
+                raise RuntimeError('connection lost')
+            return write_chunk(rows, dialect)
+        
+        with self.app.app_context(), mock.patch('attendance_import._write_chunk', side_effect=failing_write):
+            with self.assertRaises(RuntimeError):
+                attendance_import.import_attendance_csv(StringIO(self.CSV), chunk_size=1)
+            
+            record = Attendance.query.one()
+            rollup = db.session.get(AttendanceMonthlyRollup, (date(2024, 3, 1), record.user_id))
+            self.assertEqual((rollup.record_count, rollup.present_count), (1, 1))
+            self.assertEqual(AttendanceDailyRollup.query.filter_by(date=date(2024, 3, 1)).one().record_count, 1)
+    
+    def test_import_stores_offsets_as_utc(self):
+        """Test clock times with a UTC offset are stored as naive UTC"""
+        token = self.login_user('hr', 'hr123')
+        self.upload(token, "employee_id,date,clock_in,clock_out\n"
+                           "EMP003,2024-03-01,2024-03-01T09:00:00+02:00,2024-03-01T17:00:00+02:00\n")
+
+        with self.app.app_context():
+            record = Attendance.query.one()
+            self.assertEqual(record.clock_in, datetime(2024, 3, 1, 7, 0))
+            self.assertEqual(record.clock_out, datetime(2024, 3, 1, 15, 0))
+            self.assertEqual(record.hours_worked, 8.0)
+
+    def test_create_indexes_upgrades_old_attendance_index(self):
+        """Test create-indexes reports duplicates, dedupes only with --dedupe and
+        replaces the old non-unique index"""
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql('DROP INDEX ix_attendance_user_date_unique')
+                conn.exec_driver_sql('CREATE INDEX ix_attendance_user_date ON attendance (user_id, date)')
+            for hours in (4.0, 6.0):
+                db.session.add(Attendance(user_id=employee_id, date=date(2024, 3, 1), hours_worked=hours))
+            db.session.commit()
+
+        runner = self.app.test_cli_runner()
+        for args in (['create-indexes', '--dry-run'], ['create-indexes']):
+            result = runner.invoke(args=args)
+            self.assertIn(f'user {employee_id} on 2024-03-01: 2 rows', result.output)
+            with self.app.app_context():
+                self.assertEqual(Attendance.query.count(), 2)
+                indexes = {index['name'] for index in db.inspect(db.engine).get_indexes('attendance')}
+                self.assertNotIn('ix_attendance_user_date_unique', indexes)
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('--dedupe', result.output)
+
+        result = runner.invoke(args=['create-indexes', '--dedupe'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Deleted 1 duplicate attendance rows', result.output)
+
+        with self.app.app_context():
+            indexes = {index['name']: index['unique'] for index in db.inspect(db.engine).get_indexes('attendance')}
+            self.assertNotIn('ix_attendance_user_date', indexes)
+            self.assertTrue(indexes['ix_attendance_user_date_unique'])
+            self.assertEqual(Attendance.query.one().hours_worked, 6.0)
+            rollup = db.session.get(AttendanceMonthlyRollup, (date(2024, 3, 1), employee_id))
+            self.assertEqual(rollup.record_count, 1)
+
+        token = self.login_user('hr', 'hr123')
+        response = self.upload(token, "employee_id,date,hours_worked\nEMP003,2024-03-01,7\n")
+        self.assertEqual(json.loads(response.data)['imported'], 1)
+
+    def test_import_cli_and_validation(self):
+        """Test the CLI command and header/access checks"""
+        import tempfile
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write(self.CSV)
+        try:
+            result = self.app.test_cli_runner().invoke(args=['import-attendance', csv_file.name])
+        finally:
+            os.remove(csv_file.name)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('2 upserted, 3 errors', result.output)
+        
+        token = self.login_user('hr', 'hr123')
+        response = self.upload(token, "name,day\nx,y\n")
+        self.assertEqual(response.status_code, 400)
+        
+        token = self.login_user('employee', 'emp123')
+        self.assertEqual(self.upload(token, self.CSV).status_code, 403)
+
+
+class KeysetPaginationTestCase(HRSystemTestCase):
+    """Test cursor pagination on list endpoints"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            for day in range(1, 26):
+                db.session.add(Attendance(
+                    user_id=employee.id,
+                    date=date(2024, 3, day),
+                    hours_worked=8.0
+                ))
+            db.session.commit()
+    
+    def test_cursor_walks_all_rows(self):
+        """Test that following next_cursor visits every row once, newest first"""
+        token = self.login_user('employee', 'emp123')
+        
+        dates = []
+        cursor = ''
+        pages = 0
+        while cursor is not None:
+            response = self.client.get(f'/api/attendance?per_page=10&cursor={cursor}',
+                                     headers=self.get_headers(token))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertNotIn('total', data)
+            dates.extend(record['date'] for record in data['attendance'])
+            cursor = data['next_cursor']
+            pages += 1
+        
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(dates), 25)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+    
+    def test_cursor_with_total(self):
+        """Test that the total count is returned only when requested"""
+        token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/attendance?cursor=&include_total=true',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], 25)
+        self.assertIsNotNone(data['next_cursor'])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/attendance?cursor=not-a-cursor',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 400)
+    
+    def test_offset_mode_unchanged(self):
+        """Test that page-based requests keep the page/total response"""
+        token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/attendance?page=3&per_page=10',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], 25)
+        self.assertEqual(data['pages'], 3)
+        self.assertEqual(data['current_page'], 3)
+        self.assertEqual(len(data['attendance']), 5)
+
+
+class ExportTestCase(HRSystemTestCase):
+    """Test streaming exports"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            for username in ['employee', 'hr']:
+                user = User.query.filter_by(username=username).first()
+                for day in (1, 2):
+                    db.session.add(Attendance(user_id=user.id, date=date(2024, 4, day),
+                                              hours_worked=8.0, status='present',
+                                              notes='Badge, north door'))
+            db.session.commit()
+    
+    def test_export_csv(self):
+        """Test CSV export is streamed with employee columns"""
+        import csv
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.client.get('/api/exports/attendance?format=csv&date_from=2024-04-02',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        
+        rows = list(csv.reader(response.get_data(as_text=True).splitlines()))
+        self.assertEqual(rows[0][:4], ['employee_id', 'first_name', 'last_name', 'department'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][rows[0].index('notes')], 'Badge, north door')
+    
+    def test_export_ndjson_scoped_to_employee(self):
+        """Test employees only export their own rows"""
+        token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/exports/attendance?format=ndjson',
+                                 headers=self.get_headers(token))
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(records), 2)
+        self.assertEqual({record['employee_id'] for record in records}, {'EMP003'})
+        self.assertEqual(records[0]['date'], '2024-04-01')
+    
+    def test_export_xlsx(self):
+        """Test the XLSX export is a readable workbook"""
+        import io
+        import zipfile
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.client.get('/api/exports/attendance?format=xlsx',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.data)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 5)
+        self.assertIn('<t>EMP003</t>', sheet)
+
+    def set_notes(self, notes):
+        with self.app.app_context():
+            Attendance.query.update({'notes': notes})
+            db.session.commit()
+
+    def test_export_csv_quotes_formulas(self):
+        """Test CSV cells that a spreadsheet would run as formulas are quoted"""
+        import csv
+        self.set_notes('=HYPERLINK("http://evil.test","x")')
+        token = self.login_user('hr', 'hr123')
+
+        response = self.client.get('/api/exports/attendance?format=csv',
+                                 headers=self.get_headers(token))
+        rows = list(csv.reader(response.get_data(as_text=True).splitlines()))
+        self.assertEqual(rows[1][rows[0].index('notes')], '\'=HYPERLINK("http://evil.test","x")')
+        self.assertEqual(rows[1][rows[0].index('hours_worked')], '8.0')
+
+    def test_export_xlsx_strips_illegal_characters(self):
+        """Test XML-illegal control characters are dropped and text is otherwise kept in XLSX"""
+        import io
+        import zipfile
+        from xml.etree import ElementTree
+        self.set_notes('@SUM(A1)\x0b\x01 late')
+        token = self.login_user('hr', 'hr123')
+
+        response = self.client.get('/api/exports/attendance?format=xlsx',
+                                 headers=self.get_headers(token))
+        with zipfile.ZipFile(io.BytesIO(response.data)) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml')
+        texts = [node.text for node in ElementTree.fromstring(sheet).iter(
+            '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t')]
+        self.assertIn('@SUM(A1) late', texts)
+
+    def test_export_validation(self):
+        """Test unknown datasets and formats are rejected"""
+        token = self.login_user('hr', 'hr123')
+        self.assertEqual(self.client.get('/api/exports/salaries',
+                                         headers=self.get_headers(token)).status_code, 404)
+        self.assertEqual(self.client.get('/api/exports/payroll?format=pdf',
+                                         headers=self.get_headers(token)).status_code, 400)
+
+
 class ProfileTestCase(HRSystemTestCase):
     """Test profile endpoints"""
     
@@ -477,6 +1073,125 @@ class AdminTestCase(HRSystemTestCase):
         self.assertIn('error', data)
 
 
+class BulkUserTestCase(HRSystemTestCase):
+    """Test bulk user provisioning and bulk updates"""
+    
+    def new_user(self, i, **overrides):
+        return {
+            'username': f'bulk{i}', 'email': f'bulk{i}@test.com', 'password': f'pass{i}',
+            'first_name': 'Bulk', 'last_name': str(i), 'employee_id': f'BLK{i:03d}',
+            'department': 'Sales', **overrides
+        }
+    
+    def test_bulk_create_ndjson(self):
+        """Test NDJSON provisioning with parallel hashing and duplicate checks"""
+        self.app.config['BULK_HASH_WORKERS'] = 2
+        token = self.login_user('admin', 'admin123')
+        
+        records = [self.new_user(i) for i in range(10)]
+        records.append(self.new_user(10, username='employee'))        # existing username
+        records.append(self.new_user(11, email='bulk0@test.com'))     # repeats an earlier row
+        records.append({'username': 'incomplete'})
+        body = '\n'.join(json.dumps(record) for record in records) + '\nnot json\n'
+        
+        response = self.client.post('/api/admin/users/bulk', data=body,
+                                  content_type='application/x-ndjson',
+                                  headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)
+        self.assertEqual(report['processed'], 14)
+        self.assertEqual(report['created'], 10)
+        self.assertEqual(sorted(error['line'] for error in report['errors']), [11, 12, 13, 14])
+        
+        self.assertIsNotNone(self.login_user('bulk7', 'pass7'))
+
+    def test_hash_pool_shared_and_spawned(self):
+        """Test password hashing reuses one spawned pool across requests"""
+        import user_provisioning
+        from werkzeug.security import check_password_hash
+        self.app.config['BULK_HASH_WORKERS'] = 2
+        passwords = [f'secret{i}' for i in range(user_provisioning.MIN_PARALLEL_HASHES)]
+
+        with self.app.app_context():
+            first = user_provisioning.hash_passwords(passwords)
+            pool = user_provisioning._hash_pool
+            second = user_provisioning.hash_passwords(passwords)
+
+        self.assertIs(user_provisioning._hash_pool, pool)
+        self.assertEqual(pool._mp_context.get_start_method(), 'spawn')
+        self.assertTrue(all(check_password_hash(h, p) for h, p in zip(first + second, passwords * 2)))
+
+    def test_bulk_create_csv(self):
+        """Test CSV provisioning"""
+        token = self.login_user('hr', 'hr123')
+        body = ('username,email,password,first_name,last_name,employee_id,role\n'
+                'csv1,csv1@test.com,secret,Csv,One,CSV001,hr\n'
+                'csv2,csv2@test.com,secret,Csv,Two,CSV002,boss\n')
+        
+        response = self.client.post('/api/admin/users/bulk', data=body, content_type='text/csv',
+                                  headers=self.get_headers(token))
+        report = json.loads(response.data)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['errors'], [{'line': 3, 'error': "Invalid role 'boss'"}])
+        with self.app.app_context():
+            self.assertEqual(User.query.filter_by(username='csv1').one().role, 'hr')
+    
+    def test_bulk_update(self):
+        """Test set-based department/role/status changes revoke affected tokens"""
+        admin_token = self.login_user('admin', 'admin123')
+        employee_token = self.login_user('employee', 'emp123')
+        with self.app.app_context():
+            ids = [user.id for user in User.query.filter(User.username.in_(['hr', 'employee']))]
+        
+        response = self.client.patch('/api/admin/users/bulk',
+                                   data=json.dumps({'user_ids': ids, 'changes': {'department': 'Ops'}}),
+                                   content_type='application/json',
+                                   headers=self.get_headers(admin_token))
+        self.assertEqual(json.loads(response.data)['updated'], 2)
+        response = self.client.get('/api/profile', headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.patch('/api/admin/users/bulk',
+                                   data=json.dumps({'user_ids': ids, 'changes': {'role': 'hr'}}),
+                                   content_type='application/json',
+                                   headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual({user.department for user in User.query.filter(User.id.in_(ids))}, {'Ops'})
+        
+        response = self.client.get('/api/profile', headers=self.get_headers(employee_token))
+        self.assertNotEqual(response.status_code, 200)
+        
+        response = self.client.patch('/api/admin/users/bulk',
+                                   data=json.dumps({'user_ids': ids, 'changes': {'salary': 1}}),
+                                   content_type='application/json',
+                                   headers=self.get_headers(admin_token))
+        self.assertEqual(response.status_code, 400)
+    
+    def test_bulk_update_requires_boolean_status(self):
+        """Test is_active must be a JSON boolean, not a string"""
+        admin_token = self.login_user('admin', 'admin123')
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+        
+        for is_active in ('false', 0, None):
+            response = self.client.patch('/api/admin/users/bulk',
+                                       data=json.dumps({'user_ids': [employee_id], 'changes': {'is_active': is_active}}),
+                                       content_type='application/json',
+                                       headers=self.get_headers(admin_token))
+            self.assertEqual(response.status_code, 400)
+        with self.app.app_context():
+            self.assertTrue(db.session.get(User, employee_id).is_active)
+        
+        response = self.client.patch('/api/admin/users/bulk',
+                                   data=json.dumps({'user_ids': [employee_id], 'changes': {'is_active': False}}),
+                                   content_type='application/json',
+                                   headers=self.get_headers(admin_token))
+        self.assertEqual(json.loads(response.data)['updated'], 1)
+        with self.app.app_context():
+            self.assertFalse(db.session.get(User, employee_id).is_active)
+
+
 class PayrollTestCase(HRSystemTestCase):
     """Test payroll endpoints"""
     
@@ -528,47 +1243,866 @@ class PayrollTestCase(HRSystemTestCase):
         self.assertIn('total_earnings_ytd', data)
         self.assertIn('total_tax_ytd', data)
         self.assertIn('latest_payroll', data)
-
-
-class ChatbotTestCase(HRSystemTestCase):
-    """Test chatbot endpoints"""
+        # The only record is from an earlier year: still the latest, not in this year's breakdown
+        self.assertEqual(data['latest_payroll']['pay_period_start'][:4], '2024')
+        self.assertEqual(data['monthly_breakdown'], [])
     
-    def test_chat_with_bot(self):
-        """Test chatting with bot"""
+    def test_payroll_year_and_month_filters(self):
+        """Test year/month filters select by pay period range"""
         token = self.login_user('employee', 'emp123')
-        self.assertIsNotNone(token)
-        
-        chat_data = {
-            'message': 'Hello, how can I apply for leave?'
-        }
         
-        response = self.client.post('/api/chatbot',
-                                  data=json.dumps(chat_data),
-                                  content_type='application/json',
-                                  headers=self.get_headers(token))
+        for query, expected in [('year=2024', 1), ('year=2023', 0),
+                                ('year=2024&month=1', 1), ('year=2024&month=2', 0),
+                                ('month=1', 1)]:
+            response = self.client.get(f'/api/payroll?{query}', headers=self.get_headers(token))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(json.loads(response.data)['payroll']), expected, query)
         
-        self.assertEqual(response.status_code, 200)
-        data = json.loads(response.data)
-        self.assertIn('response', data)
-        self.assertIn('timestamp', data)
+        response = self.client.get('/api/payroll?month=13', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 400)
     
-    def test_chat_with_bot_empty_message(self):
-        """Test chatting with bot with empty message"""
-        token = self.login_user('employee', 'emp123')
-        self.assertIsNotNone(token)
-        
-        chat_data = {
-            'message': ''
-        }
+    def test_year_totals_maintained(self):
+        """Test create/update keep the year-to-date totals current"""
+        hr_token = self.login_user('hr', 'hr123')
+        employee_token = self.login_user('employee', 'emp123')
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
         
-        response = self.client.post('/api/chatbot',
-                                  data=json.dumps(chat_data),
+        this_year = datetime.now().year
+        response = self.client.post('/api/payroll',
+                                  data=json.dumps({
+                                      'user_id': employee_id,
+                                      'pay_period_start': f'{this_year}-01-01',
+                                      'pay_period_end': f'{this_year}-01-31',
+                                      'basic_salary': 4000,
+                                      'tax_deduction': 400
+                                  }),
                                   content_type='application/json',
-                                  headers=self.get_headers(token))
+                                  headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 201)
+        payroll_id = json.loads(response.data)['id']
         
-        self.assertEqual(response.status_code, 400)
+        self.client.get('/api/payroll/summary', headers=self.get_headers(employee_token))
+        with self.count_queries() as statements:
+            response = self.client.get('/api/payroll/summary', headers=self.get_headers(employee_token))
+        self.assertEqual(len(statements), 1)
         data = json.loads(response.data)
-        self.assertIn('error', data)
+        self.assertEqual(data['latest_payroll']['id'], payroll_id)
+        self.assertEqual(data['total_earnings_ytd'], 3600.0)
+        self.assertEqual(data['total_tax_ytd'], 400.0)
+        self.assertEqual(data['monthly_breakdown'], [{'month': 1, 'total_pay': 3600.0, 'total_tax': 400.0}])
+        
+        response = self.client.put(f'/api/payroll/{payroll_id}',
+                                 data=json.dumps({
+                                     'basic_salary': 5000, 'allowances': 0, 'overtime_pay': 0,
+                                     'deductions': 100, 'tax_deduction': 500
+                                 }),
+                                 content_type='application/json',
+                                 headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get('/api/payroll/summary', headers=self.get_headers(employee_token))
+        data = json.loads(response.data)
+        self.assertEqual(data['total_earnings_ytd'], 4400.0)
+        self.assertEqual(data['total_tax_ytd'], 500.0)
+        
+        with self.app.app_context():
+            maintained = db.session.get(PayrollYearTotal, (employee_id, this_year)).to_dict()
+        result = self.app.test_cli_runner().invoke(args=['rebuild-payroll-totals'])
+        self.assertEqual(result.exit_code, 0)
+        with self.app.app_context():
+            self.assertEqual(db.session.get(PayrollYearTotal, (employee_id, this_year)).to_dict(), maintained)
+            self.assertEqual(PayrollYearTotal.query.count(), 2)
+
+
+class PayrollRunTestCase(HRSystemTestCase):
+    """Test batch payroll runs"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            for username, basic_salary in [('employee', 3200.00), ('hr', 4800.00)]:
+                user = User.query.filter_by(username=username).first()
+                db.session.add(Payroll(
+                    user_id=user.id,
+                    pay_period_start=date(2024, 1, 1),
+                    pay_period_end=date(2024, 1, 31),
+                    basic_salary=basic_salary,
+                    allowances=200.00,
+                    deductions=0.00,
+                    gross_pay=basic_salary + 200,
+                    tax_deduction=300.00,
+                    net_pay=basic_salary - 100,
+                    status='paid'
+                ))
+            employee = User.query.filter_by(username='employee').first()
+            self.employee_id = employee.id
+            db.session.add(Attendance(user_id=employee.id, date=date(2024, 2, 5),
+                                      hours_worked=10.0, status='present'))
+            db.session.commit()
+            # The fixtures bypass the API, so seed their year totals
+            rebuild_payroll_year_totals()
+    
+    def start_run(self, token):
+        return self.client.post('/api/payroll/runs',
+                              data=json.dumps({
+                                  'pay_period_start': '2024-02-01',
+                                  'pay_period_end': '2024-02-29'
+                              }),
+                              content_type='application/json',
+                              headers=self.get_headers(token))
+    
+    def test_run_generates_drafts(self):
+        """Test a run creates drafts with carried-forward pay and overtime"""
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.start_run(token)
+        self.assertEqual(response.status_code, 201)
+        run = json.loads(response.data)
+        self.assertEqual(run['status'], 'completed')
+        self.assertEqual(run['created_count'], 2)
+        # The admin has no earlier payroll to carry forward
+        self.assertEqual(run['skipped_count'], 1)
+        
+        with self.app.app_context():
+            payroll = Payroll.query.filter_by(user_id=self.employee_id,
+                                              pay_period_start=date(2024, 2, 1)).one()
+            self.assertEqual(payroll.status, 'draft')
+            self.assertEqual(payroll.payroll_run_id, run['id'])
+            self.assertEqual(payroll.overtime_hours, 2.0)
+            # 3200 / 160 hours * 1.5 * 2 overtime hours
+            self.assertEqual(float(payroll.overtime_pay), 60.0)
+            self.assertEqual(float(payroll.gross_pay), 3460.0)
+            self.assertEqual(float(payroll.net_pay), 3160.0)
+            self.assertEqual(float(db.session.get(PayrollYearTotal, (self.employee_id, 2024)).net_pay), 6260.0)
+    
+    def test_rerun_is_idempotent(self):
+        """Test a re-run only updates drafts whose inputs changed"""
+        token = self.login_user('hr', 'hr123')
+        self.start_run(token)
+        
+        run = json.loads(self.start_run(token).data)
+        self.assertEqual((run['created_count'], run['updated_count'], run['unchanged_count']), (0, 0, 2))
+        
+        with self.app.app_context():
+            db.session.add(Attendance(user_id=self.employee_id, date=date(2024, 2, 6),
+                                      hours_worked=9.0, status='present'))
+            db.session.commit()
+        
+        run = json.loads(self.start_run(token).data)
+        self.assertEqual((run['created_count'], run['updated_count'], run['unchanged_count']), (0, 1, 1))
+        with self.app.app_context():
+            self.assertEqual(Payroll.query.filter_by(pay_period_start=date(2024, 2, 1)).count(), 2)
+
+    def totals(self):
+        with self.app.app_context():
+            return sorted((row.user_id, row.year, row.record_count, float(row.net_pay))
+                          for row in PayrollYearTotal.query.all())
+
+    def test_run_applies_deltas_to_year_totals(self):
+        """Test a run adjusts the year totals by its own records without a rebuild"""
+        token = self.login_user('hr', 'hr123')
+        with self.app.app_context():
+            # Stands in for a payroll change committed while the run is computing
+            db.session.execute(db.update(PayrollYearTotal).where(PayrollYearTotal.user_id == self.employee_id)
+                               .values(net_pay=PayrollYearTotal.net_pay + 100))
+            db.session.commit()
+
+        with mock.patch('rollups.rebuild_payroll_year_totals') as rebuild:
+            self.start_run(token)
+            with self.app.app_context():
+                db.session.add(Attendance(user_id=self.employee_id, date=date(2024, 2, 6),
+                                          hours_worked=9.0, status='present'))
+                db.session.commit()
+            run = json.loads(self.start_run(token).data)
+        rebuild.assert_not_called()
+        self.assertEqual(run['updated_count'], 1)
+
+        with self.app.app_context():
+            self.assertEqual(float(db.session.get(PayrollYearTotal, (self.employee_id, 2024)).net_pay), 6390.0)
+            db.session.execute(db.update(PayrollYearTotal).where(PayrollYearTotal.user_id == self.employee_id)
+                               .values(net_pay=PayrollYearTotal.net_pay - 100))
+            db.session.commit()
+        incremental = self.totals()
+        with self.app.app_context():
+            rebuild_payroll_year_totals()
+        self.assertEqual(self.totals(), incremental)
+
+    def test_concurrent_run_rejected(self):
+        """Test that a run in progress blocks another"""
+        token = self.login_user('hr', 'hr123')
+        with self.app.app_context():
+            db.session.add(PayrollRun(pay_period_start=date(2024, 2, 1), pay_period_end=date(2024, 2, 29),
+                                      created_by=self.employee_id, status='running',
+                                      started_at=datetime.utcnow()))
+            db.session.commit()
+        
+        response = self.start_run(token)
+        self.assertEqual(response.status_code, 409)
+        with self.app.app_context():
+            self.assertEqual(Payroll.query.filter_by(pay_period_start=date(2024, 2, 1)).count(), 0)
+    
+    def test_run_employee_forbidden(self):
+        """Test that employees cannot start payroll runs"""
+        token = self.login_user('employee', 'emp123')
+        self.assertEqual(self.start_run(token).status_code, 403)
+
+
+class EmployeeListingQueryCountTestCase(HRSystemTestCase):
+    """Test that HR listings use a constant number of queries"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            employees = []
+            for i in range(12):
+                employee = User(
+                    username=f'worker{i}',
+                    email=f'worker{i}@test.com',
+                    password_hash='!',
+                    first_name='Worker',
+                    last_name=str(i),
+                    employee_id=f'WRK{i:03d}',
+                    department='Operations'
+                )
+                db.session.add(employee)
+                employees.append(employee)
+            db.session.flush()
+            
+            for i, employee in enumerate(employees):
+                db.session.add(Payroll(
+                    user_id=employee.id,
+                    pay_period_start=date(2024, 1 + i % 12, 1),
+                    pay_period_end=date(2024, 1 + i % 12, 28),
+                    basic_salary=5000.00,
+                    gross_pay=5000.00,
+                    net_pay=4500.00
+                ))
+                db.session.add(Leave(
+                    user_id=employee.id,
+                    leave_type='vacation',
+                    start_date=date(2024, 6, 1),
+                    end_date=date(2024, 6, 2),
+                    days_requested=2,
+                    reason='Trip'
+                ))
+            db.session.commit()
+    
+    def assert_constant_queries(self, url, key):
+        token = self.login_user('hr', 'hr123')
+        # Warm the principal cache so only the listing itself is measured
+        self.client.get(url, headers=self.get_headers(token))
+        
+        counts = []
+        for per_page in (2, 12):
+            with self.count_queries() as statements:
+                response = self.client.get(f'{url}?per_page={per_page}',
+                                         headers=self.get_headers(token))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(len(data[key]), per_page)
+            counts.append(len(statements))
+        
+        self.assertEqual(counts[0], counts[1])
+        return data
+    
+    def test_payroll_listing_query_count(self):
+        """Test HR payroll listing does not query per employee"""
+        data = self.assert_constant_queries('/api/payroll', 'payroll')
+        self.assertEqual(data['payroll'][0]['department'], 'Operations')
+        self.assertTrue(data['payroll'][0]['employee_id'].startswith('WRK'))
+    
+    def test_leaves_listing_query_count(self):
+        """Test HR leaves listing does not query per employee"""
+        data = self.assert_constant_queries('/api/leaves', 'leaves')
+        self.assertEqual(data['leaves'][0]['user']['first_name'], 'Worker')
+
+
+class ChatbotTestCase(HRSystemTestCase):
+    """Test chatbot endpoints"""
+    
+    def test_chat_with_bot(self):
+        """Test chatting with bot"""
+        token = self.login_user('employee', 'emp123')
+        self.assertIsNotNone(token)
+        
+        chat_data = {
+            'message': 'Hello, how can I apply for leave?'
+        }
+        
+        response = self.client.post('/api/chatbot',
+                                  data=json.dumps(chat_data),
+                                  content_type='application/json',
+                                  headers=self.get_headers(token))
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertIn('response', data)
+        self.assertIn('timestamp', data)
+    
+    def test_chat_with_bot_empty_message(self):
+        """Test chatting with bot with empty message"""
+        token = self.login_user('employee', 'emp123')
+        self.assertIsNotNone(token)
+        
+        chat_data = {
+            'message': ''
+        }
+        
+        response = self.client.post('/api/chatbot',
+                                  data=json.dumps(chat_data),
+                                  content_type='application/json',
+                                  headers=self.get_headers(token))
+        
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertIn('error', data)
+
+
+class IntentMatcherTestCase(HRSystemTestCase):
+    """Test the chatbot's offline intent table"""
+    
+    def test_match_by_priority_and_synonym(self):
+        """Test the highest priority intent wins and synonyms match whole words"""
+        matcher = intents.matcher
+        self.assertEqual(matcher.match('Hello, how can I apply for leave?').name, 'leave')
+        self.assertEqual(matcher.match('Can I take some PTO?').name, 'leave')
+        self.assertEqual(matcher.match('When does the paycheck arrive?').name, 'payroll')
+        self.assertEqual(matcher.match('I forgot to punch out').name, 'attendance')
+        self.assertEqual(matcher.match('Is this the right place?').name, 'default')
+    
+    def test_unknown_fact_rejected(self):
+        """Test a template naming a fact that does not exist fails when compiled"""
+        with self.assertRaises(ValueError):
+            intents.IntentMatcher([{'name': 'x', 'priority': 1, 'keywords': ('x',), 'template': '{nope}'}])
+    
+    def test_facts_loaded_in_one_query(self):
+        """Test a template's live facts come from a single query"""
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            for day in (3, 10):
+                db.session.add(Leave(user_id=employee.id, leave_type='vacation', start_date=date(2024, 6, day),
+                                     end_date=date(2024, 6, day), days_requested=1, reason='Trip'))
+            db.session.commit()
+            db.session.refresh(employee)
+            
+            with self.count_queries() as statements:
+                answer = intents.respond('How do I request vacation?', employee)
+            self.assertIn('Leaves section', answer)
+            self.assertIn('You have 2 pending leave requests.', answer)
+            self.assertEqual(len(statements), 1)
+            
+            with self.count_queries() as statements:
+                self.assertIn('You have no open tickets.', intents.respond('My laptop is broken', employee))
+            self.assertEqual(len(statements), 1)
+            
+            self.assertIn('Hello John!', intents.respond('Hi there', employee))
+            with self.count_queries() as statements:
+                intents.respond('Hi there', employee)
+            self.assertEqual(statements, [])
+    
+    def test_chatbot_uses_intents(self):
+        """Test the chatbot falls back to the intent answers"""
+        token = self.login_user('employee', 'emp123')
+        response = self.client.post('/api/chatbot', data=json.dumps({'message': 'Did I clock in?'}),
+                                    content_type='application/json', headers=self.get_headers(token))
+        data = json.loads(response.data)
+        self.assertIn('You have not clocked in today.', data['response'])
+
+
+LEAVE_POLICY = """# Leave Policy
+
+Employees request leave from the Leaves section.
+
+## Annual leave
+
+Full-time employees accrue annual leave every month. Up to five unused days carry over to the next year.
+
+## Sick leave
+
+Sick leave of more than two days needs a medical certificate.
+"""
+
+PAYROLL_POLICY = """# Payroll
+
+## Pay dates
+
+Salaries are paid on the last working day of each month.
+"""
+
+
+class PolicyKnowledgeTestCase(HRSystemTestCase):
+    """Test the HR policy knowledge base"""
+    
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.write_policy('leave.md', LEAVE_POLICY)
+        self.write_policy('payroll.md', PAYROLL_POLICY)
+        self.knowledge = knowledge.KnowledgeBase(self.directory, reload_interval=0)
+        self.app.extensions['knowledge'] = self.knowledge
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+    
+    def write_policy(self, name, text):
+        """Helper method to write a policy document with a fresh modification time"""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        os.utime(path, ns=(time.time_ns(), time.time_ns()))
+    
+    def test_search_ranks_sections(self):
+        """Test each section is a passage and the best match comes first"""
+        self.assertEqual(len(self.knowledge), 4)
+        
+        passages = self.knowledge.search('Do I need a medical certificate when sick?')
+        self.assertEqual(passages[0].title, 'Leave Policy - Sick leave')
+        self.assertEqual(self.knowledge.search('When are salaries paid?')[0].title, 'Payroll - Pay dates')
+        self.assertEqual(self.knowledge.search('hello there'), [])
+
+    def test_numpy_and_fallback_rank_alike(self):
+        """Test the NumPy index and the pure-Python fallback return the same ranking"""
+        self.assertIsNotNone(knowledge.np)
+        passages = [passage for _, file_passages in self.knowledge._files.values() for passage in file_passages]
+        vectorized = knowledge._Index(passages)
+        with mock.patch.object(knowledge, 'np', None):
+            fallback = knowledge._Index(passages)
+
+        for question in ['Do I need a medical certificate when sick?', 'When are salaries paid?',
+                         'leave days carry over', 'overtime pay approval']:
+            terms = chat_cache.tokenize(question)
+            for k in (1, 2, 10):
+                with mock.patch.object(knowledge, 'np', None):
+                    expected = fallback.search(terms, k)
+                actual = vectorized.search(terms, k)
+                self.assertEqual([position for _, position in actual], [position for _, position in expected])
+                for (score, _), (expected_score, _) in zip(actual, expected):
+                    self.assertAlmostEqual(score, expected_score)
+
+    def test_incremental_reload(self):
+        """Test only changed files are read again and removed files are dropped"""
+        payroll_passages = self.knowledge._files['payroll.md'][1]
+        self.write_policy('leave.md', LEAVE_POLICY.replace('medical certificate', 'doctor note'))
+        
+        self.assertEqual(self.knowledge.search('doctor note')[0].title, 'Leave Policy - Sick leave')
+        self.assertIs(self.knowledge._files['payroll.md'][1], payroll_passages)
+        
+        os.remove(os.path.join(self.directory, 'payroll.md'))
+        self.assertEqual(self.knowledge.search('When are salaries paid?'), [])
+        self.assertFalse(self.knowledge.reload())
+    
+    def test_offline_answer_from_policy(self):
+        """Test the chatbot answers from the best passage without an LLM"""
+        token = self.login_user('employee', 'emp123')
+        response = self.client.post('/api/chatbot', data=json.dumps({'message': 'When are salaries paid?'}),
+                                    content_type='application/json', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertIn('last working day of each month', data['response'])
+        self.assertEqual([source['source'] for source in data['sources']], ['payroll.md'])
+        
+        response = self.client.post('/api/chatbot', data=json.dumps({'message': 'Hello'}),
+                                    content_type='application/json', headers=self.get_headers(token))
+        data = json.loads(response.data)
+        self.assertIn('Hello John', data['response'])
+        self.assertEqual(data['sources'], [])
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI chat completions API (streaming only)"""
+    
+    def __init__(self):
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        server = self
+        self.reset()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append(body)
+                time.sleep(server.delay)
+                if server.status != 200:
+                    payload = json.dumps({'error': {'message': 'Provider failure', 'type': 'server_error'}}).encode()
+                    self.send_response(server.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for delta in [{'role': 'assistant', 'content': ''}] + [{'content': token} for token in server.tokens]:
+                    chunk = {'id': 'chatcmpl-1', 'object': 'chat.completion.chunk', 'created': 0,
+                             'model': body['model'], 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+        
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/v1'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+    
+    def reset(self):
+        self.tokens = ['Hello', ' John', '!']
+        self.status = 200
+        self.delay = 0
+        self.requests = []
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@unittest.skipIf(llm.OpenAI is None, 'openai package not installed')
+class ChatbotLLMTestCase(HRSystemTestCase):
+    """Test the chatbot against a local stand-in for the OpenAI API"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeOpenAIServer()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+    
+    def setUp(self):
+        super().setUp()
+        self.server.reset()
+        self.use_llm()
+        self.token = self.login_user('employee', 'emp123')
+    
+    def use_llm(self, **options):
+        """Helper method to point the app at the stand-in server"""
+        self.llm = llm.LLMClient('test-key', base_url=self.server.base_url, **options)
+        self.app.extensions['llm'] = self.llm
+    
+    def chat(self, message='How do I apply for leave?'):
+        """Helper method returning the JSON endpoint's reply"""
+        response = self.client.post('/api/chatbot', data=json.dumps({'message': message}),
+                                    content_type='application/json', headers=self.get_headers(self.token))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['response']
+    
+    def forget(self):
+        """Helper method to end the conversation, so the next question stands alone"""
+        response = self.client.delete('/api/chatbot/session', headers=self.get_headers(self.token))
+        self.assertEqual(response.status_code, 200)
+    
+    def test_stream_relays_tokens(self):
+        """Test the streaming endpoint relays each token and names its source"""
+        response = self.client.post('/api/chatbot/stream', data=json.dumps({'message': 'Hi, which team am I in?'}),
+                                    content_type='application/json', headers=self.get_headers(self.token))
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        
+        events = [(frame.split('\n')[0][len('event: '):], json.loads(frame.split('data: ', 1)[1]))
+                  for frame in response.get_data(as_text=True).split('\n\n') if frame]
+        self.assertEqual([data['text'] for name, data in events if name == 'token'], ['Hello', ' John', '!'])
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(events[-1][1]['source'], 'llm')
+        self.assertIn('John Doe', self.server.requests[0]['messages'][0]['content'])
+        self.assertTrue(self.server.requests[0]['stream'])
+    
+    def test_json_endpoint_uses_llm(self):
+        """Test the JSON endpoint returns the assembled reply"""
+        self.assertEqual(self.chat(), 'Hello John!')
+    
+    def test_provider_errors_open_circuit(self):
+        """Test failures fall back to rule-based answers and stop calls once the circuit opens"""
+        self.use_llm(breaker=llm.CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        self.server.status = 500
+        
+        for _ in range(3):
+            self.assertIn('Leaves section', self.chat())
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.llm.breaker.state, llm.CircuitBreaker.OPEN)
+    
+    def test_circuit_recovers_after_trial_call(self):
+        """Test a successful half-open trial closes the circuit"""
+        self.use_llm(breaker=llm.CircuitBreaker(failure_threshold=1, reset_timeout=0.2))
+        self.server.status = 500
+        self.assertIn('Leaves section', self.chat())
+        self.assertEqual(self.llm.breaker.state, llm.CircuitBreaker.OPEN)
+        
+        self.server.status = 200
+        time.sleep(0.25)
+        self.assertEqual(self.chat(), 'Hello John!')
+        self.assertEqual(self.llm.breaker.state, llm.CircuitBreaker.CLOSED)
+    
+    def test_abandoned_stream_is_neutral(self):
+        """Test a reply the client walks away from neither closes nor opens the circuit"""
+        self.use_llm(breaker=llm.CircuitBreaker(failure_threshold=1, reset_timeout=0.2))
+        self.server.status = 500
+        self.assertIn('Leaves section', self.chat())
+        
+        self.server.status = 200
+        time.sleep(0.25)
+        stream = self.llm.stream([{'role': 'user', 'content': 'Hi'}])
+        self.assertEqual(next(stream), 'Hello')
+        stream.close()
+        self.assertEqual(self.llm.breaker.state, llm.CircuitBreaker.HALF_OPEN)
+        
+        # The trial slot was freed for the next call
+        self.assertEqual(self.chat(), 'Hello John!')
+        self.assertEqual(self.llm.breaker.state, llm.CircuitBreaker.CLOSED)
+    
+    def test_timeout_falls_back(self):
+        """Test a slow provider is abandoned after the per-call timeout"""
+        self.use_llm(timeout=0.2)
+        self.server.delay = 1
+        
+        started = time.monotonic()
+        self.assertIn('Leaves section', self.chat())
+        self.assertLess(time.monotonic() - started, 1)
+    
+    def test_busy_slots_fall_back(self):
+        """Test requests beyond the concurrency limit are answered locally"""
+        self.use_llm(max_concurrency=1, queue_timeout=0.05)
+        self.llm._slots.acquire()
+        try:
+            self.assertIn('Leaves section', self.chat())
+        finally:
+            self.llm._slots.release()
+        self.assertEqual(self.server.requests, [])
+    
+    def test_repeated_question_served_from_cache(self):
+        """Test repeated and reworded questions reuse the first answer"""
+        self.server.tokens = ['Submit it from the Leaves section.']
+        self.assertEqual(self.chat('How do I apply for leave?'), 'Submit it from the Leaves section.')
+        self.forget()
+        self.assertEqual(self.chat('how do I apply for leave'), 'Submit it from the Leaves section.')
+        self.forget()
+        self.assertEqual(self.chat('How can I apply for leaves?'), 'Submit it from the Leaves section.')
+        self.assertEqual(len(self.server.requests), 1)
+        
+        self.forget()
+        self.chat('How do I clock out?')
+        self.assertEqual(len(self.server.requests), 2)
+        
+        self.forget()
+        response = self.client.post('/api/chatbot/stream', data=json.dumps({'message': 'How do I apply for leave?'}),
+                                    content_type='application/json', headers=self.get_headers(self.token))
+        body = response.get_data(as_text=True)
+        self.assertIn('Submit it from the Leaves section.', body)
+        self.assertIn('"source": "cache"', body)
+        self.assertEqual(len(self.server.requests), 2)
+    
+    def test_general_answers_shared_between_users(self):
+        """Test general answers are asked without a profile and reused for everyone"""
+        self.server.tokens = ['Submit it from the Leaves section.']
+        self.chat('How do I apply for leave?')
+        self.assertNotIn('John Doe', self.server.requests[0]['messages'][0]['content'])
+        
+        self.token = self.login_user('hr', 'hr123')
+        self.assertEqual(self.chat('How do I apply for leave?'), 'Submit it from the Leaves section.')
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def test_personal_answers_not_shared_between_users(self):
+        """Test an answer built on the user's profile is only reused for that user"""
+        self.server.tokens = ['You are in Engineering.']
+        self.chat('Which department am I in?')
+        self.forget()
+        self.chat('Which department am I in?')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIn('John Doe', self.server.requests[0]['messages'][0]['content'])
+        
+        self.token = self.login_user('hr', 'hr123')
+        self.chat('Which department am I in?')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('HR Manager', self.server.requests[1]['messages'][0]['content'])
+    
+    def test_policy_change_invalidates_cached_answers(self):
+        """Test answers grounded in an older policy index are not reused"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'leave.md')
+        with open(path, 'w') as f:
+            f.write(LEAVE_POLICY)
+        self.app.extensions['knowledge'] = knowledge.KnowledgeBase(directory, reload_interval=0)
+        
+        self.chat('Can unused leave days carry over?')
+        self.forget()
+        self.chat('Can unused leave days carry over?')
+        self.assertEqual(len(self.server.requests), 1)
+        
+        with open(path, 'w') as f:
+            f.write(LEAVE_POLICY.replace('five', 'ten'))
+        self.forget()
+        self.chat('Can unused leave days carry over?')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('Up to ten unused days', self.server.requests[1]['messages'][0]['content'])
+    
+    def test_cache_metrics(self):
+        """Test HR can see the cache hit ratio and employees cannot"""
+        self.chat()
+        self.forget()
+        self.chat()
+        
+        response = self.client.get('/api/chatbot/metrics', headers=self.get_headers(self.token))
+        self.assertEqual(response.status_code, 403)
+        
+        hr_token = self.login_user('hr', 'hr123')
+        response = self.client.get('/api/chatbot/metrics', headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['cache']['lookups'], 2)
+        self.assertEqual(data['cache']['hits'], 1)
+        self.assertEqual(data['cache']['hit_ratio'], 0.5)
+        self.assertEqual(data['llm'], {'configured': True, 'circuit': 'closed'})
+    
+    def test_policy_passages_ground_llm(self):
+        """Test matching policy passages are sent to the LLM and listed as sources"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'leave.md'), 'w') as f:
+            f.write(LEAVE_POLICY)
+        self.app.extensions['knowledge'] = knowledge.KnowledgeBase(directory)
+        
+        response = self.client.post('/api/chatbot', data=json.dumps({'message': 'Can unused leave days carry over?'}),
+                                    content_type='application/json', headers=self.get_headers(self.token))
+        data = json.loads(response.data)
+        self.assertEqual(data['sources'][0]['title'], 'Leave Policy - Annual leave')
+        self.assertIn('Up to five unused days carry over', self.server.requests[0]['messages'][0]['content'])
+    
+    def test_follow_up_sees_conversation(self):
+        """Test earlier turns are sent with a follow-up and can be cleared"""
+        self.assertEqual(self.chat('How do I apply for leave?'), 'Hello John!')
+        self.server.tokens = ['Up to ten days.']
+        self.assertEqual(self.chat('And how many days can I take?'), 'Up to ten days.')
+        
+        messages = self.server.requests[1]['messages']
+        self.assertEqual([message['role'] for message in messages], ['system', 'user', 'assistant', 'user'])
+        self.assertEqual(messages[1]['content'], 'How do I apply for leave?')
+        self.assertEqual(messages[2]['content'], 'Hello John!')
+        
+        response = self.client.get('/api/chatbot/session', headers=self.get_headers(self.token))
+        self.assertEqual(len(json.loads(response.data)['turns']), 4)
+        
+        self.forget()
+        response = self.client.get('/api/chatbot/session', headers=self.get_headers(self.token))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_stream_records_turns(self):
+        """Test a streamed reply is added to the conversation in the background"""
+        response = self.client.post('/api/chatbot/stream', data=json.dumps({'message': 'Hi'}),
+                                    content_type='application/json', headers=self.get_headers(self.token))
+        response.get_data()
+        self.app.extensions['chat_memory'].drain()
+        
+        response = self.client.get('/api/chatbot/session', headers=self.get_headers(self.token))
+        turns = json.loads(response.data)['turns']
+        self.assertEqual(turns, [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello John!'}])
+    
+    def test_llm_summarizes_older_turns(self):
+        """Test the LLM condenses older turns once the token budget is exceeded"""
+        memory = chat_memory.ChatMemory(self.app, token_budget=20)
+        self.app.extensions['chat_memory'] = memory
+        for question in ('How do I apply for leave?', 'Who approves it?', 'How long does that take?'):
+            self.chat(question)
+        memory.drain()
+        
+        self.assertIn(chat_memory.SUMMARY_PROMPT, self.server.requests[-1]['messages'][0]['content'])
+        with self.app.app_context():
+            session = memory.load(User.query.filter_by(username='employee').first().id)
+            self.assertEqual(session.summary, 'Hello John!')
+            self.assertEqual(len(session.get_turns()), chat_memory.KEEP_RECENT_TURNS)
+
+
+class ChatMemoryTestCase(HRSystemTestCase):
+    """Test chatbot conversation memory without an LLM"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            self.user_id = User.query.filter_by(username='employee').first().id
+    
+    def test_ring_buffer_keeps_latest_turns(self):
+        """Test only the most recent turns are kept and evicted ones are summarized"""
+        memory = chat_memory.ChatMemory(self.app, max_turns=4, token_budget=1000)
+        with self.app.app_context():
+            for n in range(4):
+                memory.record(self.user_id, f'Question {n}', f'Answer {n}')
+            session = memory.load(self.user_id)
+            turns, summary = session.get_turns(), session.summary
+        self.assertEqual(turns, [['user', 'Question 2'], ['assistant', 'Answer 2'],
+                                 ['user', 'Question 3'], ['assistant', 'Answer 3']])
+        self.assertEqual(summary, 'The user asked: Question 0 The user also asked: Question 1')
+    
+    def test_summary_keeps_questions_offline(self):
+        """Test older turns are summarized in the background and the prompt stays small"""
+        memory = chat_memory.ChatMemory(self.app, token_budget=60)
+        with self.app.app_context():
+            for n in range(10):
+                memory.record(self.user_id, f'Question number {n} about leave', 'A fairly long answer ' * 3)
+                memory.drain()
+            
+            session = memory.load(self.user_id)
+            self.assertIn('Question number 0 about leave', session.summary)
+            self.assertLessEqual(len(session.get_turns()), chat_memory.KEEP_RECENT_TURNS + 2)
+            self.assertEqual(memory.messages(session)[0]['role'], 'system')
+    
+    def test_idle_sessions_expire(self):
+        """Test idle sessions are ignored on load and purged in bulk"""
+        memory = chat_memory.ChatMemory(self.app, ttl=60)
+        with self.app.app_context():
+            memory.record(self.user_id, 'Hello', 'Hi there')
+            session = memory.load(self.user_id)
+            session.last_active_at = datetime.utcnow() - timedelta(minutes=5)
+            db.session.commit()
+            self.assertEqual(memory.purge_expired(), 1)
+            
+            memory.record(self.user_id, 'Hello', 'Hi there')
+            session = memory.load(self.user_id)
+            session.last_active_at = datetime.utcnow() - timedelta(minutes=5)
+            db.session.commit()
+            self.assertIsNone(memory.load(self.user_id))
+            self.assertEqual(ChatSession.query.count(), 0)
+
+
+class SemanticCacheTestCase(unittest.TestCase):
+    """Test the chatbot answer cache on its own"""
+    
+    def test_distinct_questions_do_not_match(self):
+        """Test questions differing in a key word are kept apart"""
+        cache = chat_cache.SemanticCache()
+        cache.put('How do I clock in?', 'Use the Clock In button.', 1)
+        self.assertIsNone(cache.get('How do I clock out?', 1))
+        self.assertEqual(cache.get('how do i clock in', 1), 'Use the Clock In button.')
+    
+    def test_answers_stay_in_their_scope(self):
+        """Test exact and similar lookups only see answers of the same scope"""
+        cache = chat_cache.SemanticCache()
+        cache.put('How do I clock in?', 'Use the Clock In button.', (1, None))
+        self.assertIsNone(cache.get('How do I clock in?', (2, None)))
+        self.assertIsNone(cache.get('How can I clock in today?', (1, 2)))
+        self.assertEqual(cache.get('How do I clock in?', (1, None)), 'Use the Clock In button.')
+    
+    def test_entries_expire(self):
+        """Test entries are dropped after the TTL"""
+        cache = chat_cache.SemanticCache(ttl=0.1)
+        cache.put('What is the leave policy?', 'Twenty days a year.', 1)
+        self.assertEqual(cache.get('What is the leave policy?', 1), 'Twenty days a year.')
+        time.sleep(0.15)
+        self.assertIsNone(cache.get('What is the leave policy?', 1))
+        self.assertEqual(cache.stats()['expirations'], 1)
+    
+    def test_least_recently_used_evicted(self):
+        """Test the cache keeps at most max_entries answers"""
+        cache = chat_cache.SemanticCache(max_entries=2)
+        cache.put('leave policy', 'A', 1)
+        cache.put('payroll date', 'B', 1)
+        cache.get('leave policy', 1)
+        cache.put('holiday list', 'C', 1)
+        
+        self.assertEqual(cache.get('leave policy', 1), 'A')
+        self.assertIsNone(cache.get('payroll date', 1))
+        self.assertEqual(cache.stats()['evictions'], 1)
 
 
 class SettingsTestCase(HRSystemTestCase):
@@ -666,5 +2200,851 @@ class AnnouncementsTestCase(HRSystemTestCase):
         self.assertEqual(response.status_code, 403)
 
 
+class SummaryCacheTestCase(HRSystemTestCase):
+    """Test caching and invalidation of the dashboard summaries"""
+    
+    def test_missing_redis_client_warns(self):
+        """Test a configured Redis URL without the redis package is reported at startup"""
+        from flask import Flask
+        import cache
+        app = Flask(__name__)
+        app.config['CACHE_REDIS_URL'] = 'redis://localhost:6379/0'
+        with mock.patch.object(cache, 'redis', None), self.assertLogs(level='WARNING') as logs:
+            cache.SummaryCache(app)
+        self.assertIn('CACHE_REDIS_URL is set', logs.output[0])
+        self.assertIsInstance(app.extensions['summary_cache'], cache.LocalCacheBackend)
+
+    def test_invalidate_during_compute_not_cached(self):
+        """Test that a value computed across an invalidation is not served afterwards"""
+        from cache import summary_cache
+
+        def stale_compute():
+            summary_cache.invalidate('stats')
+            return 'stale'
+
+        with self.app.app_context():
+            self.assertEqual(summary_cache.get_or_compute('stats', 'org', stale_compute), 'stale')
+            self.assertEqual(summary_cache.get_or_compute('stats', 'org', lambda: 'fresh'), 'fresh')
+            self.assertEqual(summary_cache.get_or_compute('stats', 'org', lambda: 'later'), 'fresh')
+
+    def test_repeat_dashboard_uses_cache(self):
+        """Test that a repeated dashboard request skips the summary queries"""
+        token = self.login_user('hr', 'hr123')
+        
+        with self.count_queries() as first:
+            response = self.client.get('/api/dashboard/stats', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        
+        with self.count_queries() as second:
+            response = self.client.get('/api/dashboard/stats', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(second), len(first))
+        
+        data = json.loads(response.data)
+        self.assertEqual(data['total_employees'], 3)
+        self.assertEqual(data['total_departments'], 3)
+    
+    def test_announcement_invalidates_summary(self):
+        """Test that creating an announcement refreshes the cached list"""
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.client.get('/api/desk/summary', headers=self.get_headers(token))
+        self.assertEqual(json.loads(response.data)['recent_announcements'], [])
+        
+        self.client.post('/api/announcements',
+                         data=json.dumps({'title': 'Fresh', 'content': 'News'}),
+                         content_type='application/json',
+                         headers=self.get_headers(token))
+        
+        response = self.client.get('/api/desk/summary', headers=self.get_headers(token))
+        announcements = json.loads(response.data)['recent_announcements']
+        self.assertEqual([ann['title'] for ann in announcements], ['Fresh'])
+    
+    def test_leave_request_invalidates_summary(self):
+        """Test that a new leave request refreshes the pending count"""
+        hr_token = self.login_user('hr', 'hr123')
+        employee_token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/admin/dashboard', headers=self.get_headers(hr_token))
+        self.assertEqual(json.loads(response.data)['pending_leaves'], 0)
+        
+        self.client.post('/api/leaves',
+                         data=json.dumps({
+                             'leave_type': 'vacation',
+                             'start_date': date.today().isoformat(),
+                             'end_date': date.today().isoformat(),
+                             'reason': 'Trip'
+                         }),
+                         content_type='application/json',
+                         headers=self.get_headers(employee_token))
+        
+        response = self.client.get('/api/admin/dashboard', headers=self.get_headers(hr_token))
+        self.assertEqual(json.loads(response.data)['pending_leaves'], 1)
+
+
+class ConditionalGetTestCase(HRSystemTestCase):
+    """Test ETag/Last-Modified handling on read endpoints"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            hr = User.query.filter_by(username='hr').first()
+            employee = User.query.filter_by(username='employee').first()
+            db.session.add(Announcement(title='Office closed', content='Friday', author_id=hr.id))
+            db.session.add(Payroll(user_id=employee.id, pay_period_start=date(2024, 1, 1),
+                                   pay_period_end=date(2024, 1, 31), basic_salary=5000.00,
+                                   gross_pay=5000.00, net_pay=5000.00, status='paid'))
+            db.session.commit()
+            self.payroll_id = Payroll.query.first().id
+    
+    def get_with(self, url, token, **headers):
+        return self.client.get(url, headers={**self.get_headers(token), **headers})
+    
+    def test_if_none_match_returns_304(self):
+        """Test a matching ETag is answered without fetching the rows"""
+        token = self.login_user('employee', 'emp123')
+        
+        response = self.get_with('/api/profile', token)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('Last-Modified', response.headers)
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        
+        with self.count_queries() as statements:
+            response = self.get_with('/api/profile', token, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        # Only the aggregate validator query ran
+        self.assertEqual(len(statements), 1)
+        self.assertIn('max(', statements[0].lower())
+    
+    def test_etag_changes_after_update(self):
+        """Test an update invalidates the previous ETag"""
+        token = self.login_user('employee', 'emp123')
+        # The first read creates the default settings row
+        self.get_with('/api/settings', token)
+        etag = self.get_with('/api/settings', token).headers['ETag']
+        self.assertEqual(self.get_with('/api/settings', token, **{'If-None-Match': etag}).status_code, 304)
+        
+        self.client.put('/api/settings', data=json.dumps({'theme': 'dark'}),
+                        content_type='application/json', headers=self.get_headers(token))
+        
+        response = self.get_with('/api/settings', token, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json.loads(response.data)['theme'], 'dark')
+    
+    def test_delete_changes_listing_etag(self):
+        """Test removing a row changes the listing ETag through the count"""
+        hr_token = self.login_user('hr', 'hr123')
+        response = self.client.post('/api/announcements', data=json.dumps({
+            'title': 'Parking', 'content': 'Level 2 closed'
+        }), content_type='application/json', headers=self.get_headers(hr_token))
+        announcement_id = json.loads(response.data)['id']
+        etag = self.get_with('/api/announcements', hr_token).headers['ETag']
+        
+        self.client.delete(f'/api/announcements/{announcement_id}', headers=self.get_headers(hr_token))
+        
+        response = self.get_with('/api/announcements', hr_token, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['total'], 1)
+    
+    def test_if_modified_since(self):
+        """Test If-Modified-Since is honored when no ETag is sent"""
+        token = self.login_user('employee', 'emp123')
+        last_modified = self.get_with('/api/recruitment/jobs?status=', token).headers.get('Last-Modified')
+        # No jobs: the view always runs
+        self.assertIsNone(last_modified)
+        
+        last_modified = self.get_with('/api/announcements', token).headers['Last-Modified']
+        self.assertEqual(self.get_with('/api/announcements', token,
+                                       **{'If-Modified-Since': last_modified}).status_code, 304)
+        self.assertEqual(self.get_with('/api/announcements', token,
+                                       **{'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}).status_code, 200)
+    
+    def test_etag_is_scoped_to_principal(self):
+        """Test ETags are not shared between users or bypass access checks"""
+        employee_token = self.login_user('employee', 'emp123')
+        hr_token = self.login_user('hr', 'hr123')
+        employee_etag = self.get_with('/api/payroll', employee_token).headers['ETag']
+        hr_response = self.get_with('/api/payroll', hr_token, **{'If-None-Match': employee_etag})
+        self.assertEqual(hr_response.status_code, 200)
+        self.assertNotEqual(hr_response.headers['ETag'], employee_etag)
+        
+        # A record outside the caller's scope still gets the view's 403
+        admin_token = self.login_user('admin', 'admin123')
+        with self.app.app_context():
+            admin = User.query.filter_by(username='admin').first()
+            db.session.add(Payroll(user_id=admin.id, pay_period_start=date(2024, 1, 1),
+                                   pay_period_end=date(2024, 1, 31), basic_salary=9000.00,
+                                   gross_pay=9000.00, net_pay=9000.00, status='paid'))
+            db.session.commit()
+            admin_payroll_id = Payroll.query.filter_by(user_id=admin.id).first().id
+        admin_etag = self.get_with(f'/api/payroll/{admin_payroll_id}', admin_token).headers['ETag']
+        response = self.get_with(f'/api/payroll/{admin_payroll_id}', employee_token,
+                                 **{'If-None-Match': admin_etag})
+        self.assertEqual(response.status_code, 403)
+    
+    def test_invalid_parameters_reach_view(self):
+        """Test parameter errors are reported even with a conditional header"""
+        token = self.login_user('hr', 'hr123')
+        response = self.get_with('/api/payroll?year=abc', token, **{'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['error'], 'Invalid year parameter')
+
+
+class OptimisticConcurrencyTestCase(HRSystemTestCase):
+    """Test version ETags and If-Match on update endpoints"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            hr = User.query.filter_by(username='hr').first()
+            leave = Leave(user_id=employee.id, leave_type='vacation', start_date=date(2024, 5, 6),
+                          end_date=date(2024, 5, 7), days_requested=2, reason='Trip')
+            payroll = Payroll(user_id=employee.id, pay_period_start=date(2024, 5, 1),
+                              pay_period_end=date(2024, 5, 31), basic_salary=5000.00,
+                              gross_pay=5000.00, net_pay=5000.00)
+            review = PerformanceReview(user_id=employee.id, reviewer_id=hr.id,
+                                       review_period_start=date(2024, 1, 1),
+                                       review_period_end=date(2024, 6, 30))
+            ticket = Ticket(title='Printer', description='Jammed', category='IT Support',
+                            created_by=employee.id)
+            db.session.add_all([leave, payroll, review, ticket])
+            db.session.commit()
+            self.leave_id, self.payroll_id = leave.id, payroll.id
+            self.review_id, self.ticket_id = review.id, ticket.id
+            self.employee_id = employee.id
+        self.token = self.login_user('hr', 'hr123')
+    
+    def send(self, method, url, data, **headers):
+        return self.client.open(url, method=method, data=json.dumps(data), content_type='application/json',
+                                headers={**self.get_headers(self.token), **headers})
+    
+    def test_if_match_update_and_conflict(self):
+        """Test an update with a stale If-Match is rejected with 412"""
+        response = self.client.get(f'/api/leaves/{self.leave_id}', headers=self.get_headers(self.token))
+        etag = response.headers['ETag']
+        self.assertEqual(etag, '"1"')
+        
+        response = self.send('PUT', f'/api/leaves/{self.leave_id}', {'status': 'approved'}, **{'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"2"')
+        self.assertEqual(json.loads(response.data)['version'], 2)
+        
+        response = self.send('PUT', f'/api/leaves/{self.leave_id}', {'status': 'rejected'}, **{'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Leave, self.leave_id).status, 'approved')
+    
+    def test_update_is_single_conditional_statement(self):
+        """Test the version check is part of the UPDATE itself"""
+        with self.count_queries() as statements:
+            response = self.send('PUT', f'/api/payroll/{self.payroll_id}', {'allowances': 250},
+                                 **{'If-Match': '"1"'})
+        self.assertEqual(response.status_code, 200)
+        updates = [statement for statement in statements if statement.startswith('UPDATE payroll ')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('payroll.version = ?', updates[0])
+        self.assertFalse(any('FOR UPDATE' in statement for statement in statements))
+    
+    def test_concurrent_write_returns_412(self):
+        """Test a write committed between load and flush is detected"""
+        def concurrent_edit(before, after):
+            # Another request commits its own edit of the row in the meantime
+            db.session.connection().exec_driver_sql(
+                'UPDATE payroll SET version = version + 1 WHERE id = ?', (self.payroll_id,))
+        
+        with mock.patch('api.payroll.apply_payroll_change', side_effect=concurrent_edit):
+            response = self.send('PUT', f'/api/payroll/{self.payroll_id}', {'allowances': 250})
+        self.assertEqual(response.status_code, 412)
+        with self.app.app_context():
+            self.assertEqual(float(db.session.get(Payroll, self.payroll_id).allowances), 0)
+    
+    def test_concurrent_write_without_if_match_returns_412(self):
+        """Test profile writes also roll back a conflicting write"""
+        def concurrent_edit(table, row_id):
+            def edit(*args, **kwargs):
+                db.session.connection().exec_driver_sql(
+                    f'UPDATE {table} SET version = version + 1 WHERE id = ?', (row_id,))
+                return 'hash'
+            return edit
+        
+        employee_token = self.login_user('employee', 'emp123')
+        with mock.patch('api.profile.generate_password_hash', side_effect=concurrent_edit('user', self.employee_id)):
+            response = self.client.put('/api/profile/change-password',
+                                       data=json.dumps({'current_password': 'emp123', 'new_password': 'newpass1'}),
+                                       content_type='application/json', headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 412)
+        
+        with mock.patch('api.profile.move_department_rollups', side_effect=concurrent_edit('user', self.employee_id)):
+            response = self.client.put('/api/profile', data=json.dumps({'department': 'Sales'}),
+                                       content_type='application/json', headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 412)
+        
+        with self.app.app_context():
+            employee = db.session.get(User, self.employee_id)
+            self.assertEqual(employee.department, 'Engineering')
+            self.assertTrue(check_password_hash(employee.password_hash, 'emp123'))
+    
+    def test_missing_or_wildcard_if_match(self):
+        """Test requests without If-Match, or with *, still update"""
+        response = self.send('PUT', f'/api/performance/reviews/{self.review_id}', {'overall_rating': 4})
+        self.assertEqual(response.status_code, 200)
+        response = self.send('PUT', f'/api/admin/users/{self.employee_id}', {'position': 'Lead'},
+                             **{'If-Match': '*'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"2"')
+        # Weak ETags never match If-Match
+        response = self.send('PUT', f'/api/admin/users/{self.employee_id}', {'position': 'Manager'},
+                             **{'If-Match': 'W/"2"'})
+        self.assertEqual(response.status_code, 412)
+    
+    def test_ticket_comment_moves_version(self):
+        """Test comments invalidate If-Match tokens without conflicting themselves"""
+        url = f'/api/tickets/{self.ticket_id}/'
+        etag = self.client.get(url, headers=self.get_headers(self.token)).headers['ETag']
+        
+        response = self.send('POST', f'{url}comments/', {'comment_text': 'Looking into it'})
+        self.assertEqual(response.status_code, 201)
+        
+        response = self.send('PATCH', url, {'status': 'closed'}, **{'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        
+        etag = self.client.get(url, headers=self.get_headers(self.token)).headers['ETag']
+        response = self.send('PATCH', url, {'status': 'closed'}, **{'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['comments_count'], 2)
+    
+    def test_payroll_detail_uses_version_etag(self):
+        """Test the conditional GET on payroll detail serves the version ETag"""
+        url = f'/api/payroll/{self.payroll_id}'
+        response = self.client.get(url, headers=self.get_headers(self.token))
+        self.assertEqual(response.headers['ETag'], '"1"')
+        response = self.client.get(url, headers={**self.get_headers(self.token), 'If-None-Match': '"1"'})
+        self.assertEqual(response.status_code, 304)
+
+
+class SerializerTestCase(HRSystemTestCase):
+    """Test the compiled serializers and the JSON provider"""
+    
+    def test_compiled_serializers_match_to_dict(self):
+        """Test every compiled serializer produces the model's to_dict"""
+        from serializers import serializer_for
+        with self.app.app_context():
+            hr = User.query.filter_by(username='hr').first()
+            records = [
+                Leave(user_id=hr.id, leave_type='sick', start_date=date(2024, 3, 4),
+                      end_date=date(2024, 3, 5), days_requested=2),
+                Attendance(user_id=hr.id, date=date(2024, 3, 4), clock_in=datetime(2024, 3, 4, 9, 0, 0, 120),
+                           hours_worked=7.5),
+                Payroll(user_id=hr.id, pay_period_start=date(2024, 3, 1), pay_period_end=date(2024, 3, 31),
+                        basic_salary=5000.25, gross_pay=5000.25, net_pay=4100.10),
+                PerformanceReview(user_id=hr.id, reviewer_id=hr.id, review_period_start=date(2024, 1, 1),
+                                  review_period_end=date(2024, 6, 30)),
+                Announcement(title='Notice', content='Body', author_id=hr.id),
+                Job(title='Engineer', description='Build', department='IT', posted_by=hr.id, salary_min=1000),
+                Ticket(title='Laptop', description='Broken', category='IT Support', created_by=hr.id, assigned_to=hr.id),
+                Settings(user_id=hr.id)
+            ]
+            db.session.add_all(records)
+            db.session.commit()
+            
+            for record in records + [hr]:
+                model = type(record)
+                # Loaded instances, then expired ones that fall back to attribute access
+                db.session.refresh(record)
+                expected = json.loads(self.app.json.dumps(record.to_dict()))
+                self.assertEqual(json.loads(self.app.json.dumps(serializer_for(model)(record))), expected, model)
+                db.session.expire(record)
+                self.assertEqual(json.loads(self.app.json.dumps(serializer_for(model)(record))), expected, model)
+    
+    def test_provider_encoding(self):
+        """Test dates, Decimals and oversized integers encode like to_dict output"""
+        from decimal import Decimal
+        with self.app.app_context():
+            encoded = self.app.json.dumps({'b': datetime(2024, 3, 4, 9, 30), 'a': Decimal('12.50'),
+                                           'c': date(2024, 3, 4), 'd': 2 ** 70})
+        self.assertEqual(encoded, '{"a":12.5,"b":"2024-03-04T09:30:00","c":"2024-03-04","d":%d}' % 2 ** 70)
+    
+    def test_list_endpoint_output(self):
+        """Test list endpoints keep the to_dict representation"""
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            db.session.add(Payroll(user_id=employee.id, pay_period_start=date(2024, 3, 1),
+                                   pay_period_end=date(2024, 3, 31), basic_salary=5000.00,
+                                   gross_pay=5000.00, net_pay=5000.00))
+            db.session.commit()
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.client.get('/api/payroll', headers=self.get_headers(token))
+        record = json.loads(response.data)['payroll'][0]
+        self.assertEqual(record['basic_salary'], 5000.0)
+        self.assertEqual(record['pay_period_start'], '2024-03-01')
+        self.assertEqual(record['employee_id'], 'EMP003')
+        self.assertNotIn('password_hash', json.loads(self.client.get(
+            '/api/admin/users', headers=self.get_headers(token)).data)['users'][0])
+
+
+class SparseFieldsetTestCase(HRSystemTestCase):
+    """Test the fields= parameter on list and detail endpoints"""
+    
+    def create_applications(self, count):
+        """Helper method to add applications with long cover letters"""
+        with self.app.app_context():
+            hr = User.query.filter_by(username='hr').first()
+            job = Job(title='Engineer', description='Build', department='IT', posted_by=hr.id)
+            db.session.add(job)
+            db.session.flush()
+            db.session.add_all([
+                JobApplication(job_id=job.id, applicant_name=f'Applicant {i}', applicant_email=f'a{i}@example.com',
+                               cover_letter='x' * 5000, applied_at=datetime(2024, 3, 1 + i))
+                for i in range(count)
+            ])
+            db.session.commit()
+    
+    def test_list_fields_trim_json_and_columns(self):
+        """Test a list returns only the requested keys and skips other columns in SQL"""
+        self.create_applications(3)
+        token = self.login_user('hr', 'hr123')
+        
+        with self.count_queries() as statements:
+            response = self.client.get('/api/recruitment/applications?fields=applicant_name,status',
+                                       headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        applications = json.loads(response.data)['applications']
+        self.assertEqual(len(applications), 3)
+        for application in applications:
+            self.assertEqual(set(application), {'applicant_name', 'status'})
+        # The rows themselves; the COUNT(*) wraps the unnarrowed query, which the database flattens
+        selects = [statement for statement in statements
+                   if statement.startswith('SELECT job_application.')]
+        self.assertTrue(selects)
+        self.assertFalse(any('cover_letter' in statement for statement in selects))
+    
+    def test_keyset_pagination_with_fields(self):
+        """Test keyset pages still work when the sort key is not requested"""
+        self.create_applications(5)
+        token = self.login_user('hr', 'hr123')
+        
+        names, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(f'/api/recruitment/applications?fields=applicant_name&per_page=2&cursor={cursor}',
+                                       headers=self.get_headers(token))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            names.extend(application['applicant_name'] for application in data['applications'])
+            cursor = data['next_cursor']
+        self.assertEqual(sorted(names), [f'Applicant {i}' for i in range(5)])
+    
+    def test_detail_fields(self):
+        """Test a ticket detail honours fields= and only loads comments when asked"""
+        token = self.login_user('employee', 'emp123')
+        response = self.client.post('/api/tickets/', data={'title': 'Printer', 'description': 'y' * 2000,
+                                                           'category': 'IT Support'},
+                                    headers=self.get_headers(token))
+        ticket_id = json.loads(response.data)['id']
+        
+        with self.count_queries() as statements:
+            response = self.client.get(f'/api/tickets/{ticket_id}/?fields=title,creator_name',
+                                       headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'title': 'Printer', 'creator_name': 'John Doe'})
+        self.assertTrue(response.headers.get('ETag'))
+        self.assertFalse(any('FROM ticket_comment' in statement for statement in statements))
+        self.assertFalse(any('ticket.description' in statement for statement in statements))
+        
+        response = self.client.get(f'/api/tickets/{ticket_id}/?fields=title,comments',
+                                   headers=self.get_headers(token))
+        self.assertEqual(json.loads(response.data), {'title': 'Printer', 'comments': []})
+    
+    def test_hr_view_extra_fields(self):
+        """Test keys added by HR views can be requested"""
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            db.session.add(Payroll(user_id=employee.id, pay_period_start=date(2024, 3, 1),
+                                   pay_period_end=date(2024, 3, 31), basic_salary=5000.00,
+                                   gross_pay=5000.00, net_pay=5000.00))
+            db.session.commit()
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.client.get('/api/payroll?fields=net_pay,employee_id', headers=self.get_headers(token))
+        self.assertEqual(json.loads(response.data)['payroll'], [{'net_pay': 5000.0, 'employee_id': 'EMP003'}])
+        
+        response = self.client.get('/api/leaves?fields=status', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+    
+    def test_unknown_field(self):
+        """Test unknown field names are rejected"""
+        token = self.login_user('employee', 'emp123')
+        response = self.client.get('/api/attendance?fields=date,salary', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('salary', json.loads(response.data)['error'])
+        
+        response = self.client.get('/api/profile?fields=password_hash', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchTestCase(HRSystemTestCase):
+    """Test the batch request endpoint"""
+    
+    def batch(self, token, requests):
+        """Helper method to post a batch"""
+        return self.client.post('/api/batch', data=json.dumps({'requests': requests}),
+                                content_type='application/json', headers=self.get_headers(token))
+    
+    def test_startup_batch(self):
+        """Test the SPA startup calls are answered in one response with one principal lookup"""
+        import utils
+        token = self.login_user('employee', 'emp123')
+        
+        with mock.patch('utils._get_auth_state', wraps=utils._get_auth_state) as auth_state:
+            response = self.batch(token, [
+                {'path': '/auth/me'},
+                {'path': '/api/dashboard/stats'},
+                {'path': '/api/dashboard/quick-actions'},
+                {'path': '/api/settings'},
+                {'path': '/api/attendance/today'},
+                {'path': '/api/announcements?per_page=5'}
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(auth_state.call_count, 1)
+        
+        results = json.loads(response.data)['responses']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 200, 404, 200])
+        self.assertEqual(results[0]['body']['username'], 'employee')
+        self.assertEqual(results[3]['body']['theme'], 'light')
+        self.assertIn('announcements', results[5]['body'])
+    
+    def test_conditional_and_write_sub_requests(self):
+        """Test sub-requests carry conditional headers and JSON bodies"""
+        token = self.login_user('employee', 'emp123')
+        # The first GET creates the default settings row
+        self.client.get('/api/settings', headers=self.get_headers(token))
+        etag = self.client.get('/api/settings', headers=self.get_headers(token)).headers['ETag']
+        
+        results = json.loads(self.batch(token, [
+            {'path': '/api/settings', 'headers': {'If-None-Match': etag}},
+            {'method': 'PUT', 'path': '/api/settings', 'body': {'theme': 'dark'}},
+            {'path': '/api/settings', 'headers': {'If-None-Match': etag}}
+        ]).data)['responses']
+        
+        self.assertEqual([result['status'] for result in results], [304, 200, 200])
+        self.assertNotIn('body', results[0])
+        self.assertEqual(results[0]['headers']['ETag'], etag)
+        self.assertEqual(results[2]['body']['theme'], 'dark')
+    
+    def test_sub_requests_use_batch_credentials(self):
+        """Test sub-requests cannot swap in another Authorization header"""
+        token = self.login_user('employee', 'emp123')
+        hr_token = self.login_user('hr', 'hr123')
+        
+        results = json.loads(self.batch(token, [
+            {'path': '/api/admin/users', 'headers': {'Authorization': f'Bearer {hr_token}'}}
+        ]).data)['responses']
+        self.assertEqual(results[0]['status'], 403)
+
+    def test_failed_sub_request_is_rolled_back(self):
+        """Test a later write does not commit what a failed sub-request left behind"""
+        token = self.login_user('admin', 'admin123')
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+        start = date.today() + timedelta(days=7)
+
+        results = json.loads(self.batch(token, [
+            {'method': 'PUT', 'path': f'/api/admin/users/{employee_id}',
+             'body': {'first_name': 'HACKED', 'email': 'hr@test.com'}},
+            {'method': 'POST', 'path': '/api/leaves',
+             'body': {'leave_type': 'vacation', 'start_date': start.isoformat(),
+                      'end_date': (start + timedelta(days=2)).isoformat(), 'reason': 'Family vacation'}}
+        ]).data)['responses']
+
+        self.assertEqual([result['status'] for result in results], [409, 201])
+        with self.app.app_context():
+            employee = db.session.get(User, employee_id)
+            self.assertEqual(employee.first_name, 'John')
+            self.assertEqual(employee.email, 'employee@test.com')
+
+    def test_invalid_batches(self):
+        """Test malformed, oversized and nested batches are rejected"""
+        token = self.login_user('employee', 'emp123')
+        
+        self.assertEqual(self.batch(token, []).status_code, 400)
+        self.assertEqual(self.batch(token, [{'path': 'api/settings'}]).status_code, 400)
+        self.assertEqual(self.batch(token, [{'method': 'TRACE', 'path': '/api/settings'}]).status_code, 400)
+        self.assertEqual(self.batch(token, [{'path': '/api/settings'}] * 21).status_code, 400)
+        
+        results = json.loads(self.batch(token, [{'method': 'POST', 'path': '/api/batch'}]).data)['responses']
+        self.assertEqual(results[0]['status'], 400)
+        
+        response = self.client.post('/api/batch', data=json.dumps({'requests': [{'path': '/auth/me'}]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class EventStreamTestCase(HRSystemTestCase):
+    """Test the server-sent event stream"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app.config['EVENTS_HEARTBEAT'] = 0.05
+    
+    def stream_token(self, token):
+        """Helper method to get a stream token"""
+        response = self.client.post('/api/events/token', headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['token']
+    
+    def open_stream(self, token):
+        """Helper method to open a stream and read its opening frame"""
+        response = self.client.get(f'/api/events/stream?token={self.stream_token(token)}', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        frames = (frame for chunk in response.response for frame in chunk.decode().split('\n\n') if frame)
+        self.assertTrue(next(frames).startswith('retry:'))
+        return response, frames
+    
+    def read_event(self, frames, event, limit=20):
+        """Helper method returning the data of the next ``event`` frame, or None
+        if only keep-alives arrive"""
+        for _ in range(limit):
+            frame = next(frames)
+            if frame.startswith(f'event: {event}\n'):
+                return json.loads(frame.split('data: ', 1)[1])
+        return None
+    
+    def test_announcement_reaches_every_stream(self):
+        """Test a new announcement is pushed to connected users"""
+        employee_token = self.login_user('employee', 'emp123')
+        hr_token = self.login_user('hr', 'hr123')
+        response, frames = self.open_stream(employee_token)
+        
+        self.client.post('/api/announcements', data=json.dumps({'title': 'Office closed', 'content': 'Friday'}),
+                         content_type='application/json', headers=self.get_headers(hr_token))
+        
+        self.assertEqual(self.read_event(frames, 'announcement.created')['title'], 'Office closed')
+        response.close()
+        with self.app.app_context():
+            self.assertEqual(len(self.app.extensions['event_broker'][0]), 0)
+    
+    def test_events_are_scoped_to_users(self):
+        """Test leave decisions and ticket comments only reach the users involved"""
+        employee_token = self.login_user('employee', 'emp123')
+        admin_token = self.login_user('admin', 'admin123')
+        hr_token = self.login_user('hr', 'hr123')
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            leave = Leave(user_id=employee.id, leave_type='vacation', start_date=date(2030, 1, 7),
+                          end_date=date(2030, 1, 8), days_requested=2)
+            db.session.add(leave)
+            db.session.commit()
+            leave_id = leave.id
+        ticket = json.loads(self.client.post('/api/tickets/', data={'title': 'VPN', 'description': 'Down',
+                                                                    'category': 'IT Support'},
+                                             headers=self.get_headers(employee_token)).data)
+        
+        employee_response, employee_frames = self.open_stream(employee_token)
+        admin_response, admin_frames = self.open_stream(admin_token)
+        
+        self.client.put(f'/api/leaves/{leave_id}', data=json.dumps({'status': 'approved'}),
+                        content_type='application/json', headers=self.get_headers(hr_token))
+        self.client.post(f'/api/tickets/{ticket["id"]}/comments/', data=json.dumps({'comment_text': 'On it'}),
+                         content_type='application/json', headers=self.get_headers(hr_token))
+        
+        self.assertEqual(self.read_event(employee_frames, 'leave.decided')['status'], 'approved')
+        comment = self.read_event(employee_frames, 'ticket.comment')
+        self.assertEqual(comment['ticket_id'], ticket['id'])
+        self.assertEqual(comment['comment']['comment_text'], 'On it')
+        self.assertIsNone(self.read_event(admin_frames, 'leave.decided', limit=3))
+        employee_response.close()
+        admin_response.close()
+    
+    def test_stream_authentication_and_limit(self):
+        """Test the stream needs a token and refuses connections past the limit"""
+        self.assertEqual(self.client.get('/api/events/stream').status_code, 401)
+        
+        token = self.login_user('employee', 'emp123')
+        self.app.config['EVENTS_MAX_CONNECTIONS'] = 1
+        response, _ = self.open_stream(token)
+        self.assertEqual(self.client.get('/api/events/stream', headers=self.get_headers(token)).status_code, 503)
+        response.close()
+        response = self.client.get('/api/events/stream', headers=self.get_headers(token), buffered=False)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+    
+    def test_stream_token_only_opens_the_stream(self):
+        """Test the JWT is not accepted in the URL and stream tokens are
+        refused elsewhere and once expired"""
+        token = self.login_user('employee', 'emp123')
+        self.assertEqual(self.client.get(f'/api/events/stream?jwt={token}').status_code, 401)
+        self.assertEqual(self.client.get('/api/events/stream?token=forged').status_code, 401)
+        
+        stream_token = self.stream_token(token)
+        self.assertIn(self.client.get('/auth/me', headers=self.get_headers(stream_token)).status_code, [401, 422])
+        
+        self.app.config['EVENTS_TOKEN_TTL'] = -1
+        self.assertEqual(self.client.get(f'/api/events/stream?token={stream_token}').status_code, 401)
+    
+    def test_stream_ends_when_user_is_deactivated(self):
+        """Test an open stream is closed once its user is deactivated"""
+        employee_token = self.login_user('employee', 'emp123')
+        admin_token = self.login_user('admin', 'admin123')
+        with self.app.app_context():
+            employee_id = User.query.filter_by(username='employee').first().id
+        response, frames = self.open_stream(employee_token)
+        
+        self.client.put(f'/api/admin/users/{employee_id}', data=json.dumps({'is_active': False}),
+                        content_type='application/json', headers=self.get_headers(admin_token))
+        
+        self.assertIsNotNone(self.read_event(frames, 'session.revoked'))
+        self.assertIsNone(next(frames, None))
+        response.close()
+        with self.app.app_context():
+            self.assertEqual(len(self.app.extensions['event_broker'][0]), 0)
+
+
+class TicketsTestCase(HRSystemTestCase):
+    """Test ticket endpoints"""
+    
+    def create_ticket(self, token, title='Broken laptop'):
+        """Helper method to create a ticket"""
+        response = self.client.post('/api/tickets/',
+                                  data={
+                                      'title': title,
+                                      'description': 'Screen stays black',
+                                      'category': 'IT Support'
+                                  },
+                                  headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.data)
+    
+    def test_comments_count_maintained(self):
+        """Test that comments and ticket updates bump the comment counter"""
+        employee_token = self.login_user('employee', 'emp123')
+        hr_token = self.login_user('hr', 'hr123')
+        ticket = self.create_ticket(employee_token)
+        self.assertEqual(ticket['comments_count'], 0)
+        
+        response = self.client.post(f"/api/tickets/{ticket['id']}/comments/",
+                                  data=json.dumps({'comment_text': 'Still broken'}),
+                                  content_type='application/json',
+                                  headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 201)
+        
+        response = self.client.patch(f"/api/tickets/{ticket['id']}/",
+                                   data=json.dumps({'status': 'in_progress'}),
+                                   content_type='application/json',
+                                   headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['comments_count'], 2)
+        
+        response = self.client.get('/api/tickets/',
+                                 headers=self.get_headers(hr_token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['tickets'][0]['comments_count'], 2)
+        self.assertEqual(data['tickets'][0]['creator_name'], 'John Doe')
+    
+    def test_list_tickets_paginated(self):
+        """Test that the ticket listing is paginated"""
+        employee_token = self.login_user('employee', 'emp123')
+        for i in range(3):
+            self.create_ticket(employee_token, title=f'Ticket {i}')
+        
+        response = self.client.get('/api/tickets/?per_page=2',
+                                 headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(len(data['tickets']), 2)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['tickets'][0]['title'], 'Ticket 2')
+    
+    def test_list_tickets_ndjson_stream(self):
+        """Test streaming every ticket as NDJSON"""
+        employee_token = self.login_user('employee', 'emp123')
+        for i in range(3):
+            self.create_ticket(employee_token, title=f'Ticket {i}')
+        
+        response = self.client.get('/api/tickets/?format=ndjson',
+                                 headers=self.get_headers(employee_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).strip().split('\n')
+        titles = [json.loads(line)['title'] for line in lines]
+        self.assertEqual(titles, ['Ticket 2', 'Ticket 1', 'Ticket 0'])
+
+
+class TicketStatsTestCase(HRSystemTestCase):
+    """Test ticket statistics"""
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            employee = User.query.filter_by(username='employee').first()
+            hr = User.query.filter_by(username='hr').first()
+            tickets = [
+                ('IT Support', 'open', 'high', None, datetime(2024, 1, 10)),
+                ('IT Support', 'closed', 'urgent', hr.id, datetime(2024, 2, 10)),
+                ('HR', 'in_progress', 'medium', hr.id, datetime(2024, 2, 20)),
+                ('HR', 'open', 'urgent', None, datetime(2024, 3, 5)),
+            ]
+            for category, status, priority, assigned_to, created_at in tickets:
+                db.session.add(Ticket(
+                    title='Issue',
+                    description='Details',
+                    category=category,
+                    status=status,
+                    priority=priority,
+                    created_by=employee.id,
+                    assigned_to=assigned_to,
+                    created_at=created_at
+                ))
+            db.session.commit()
+    
+    def test_ticket_stats(self):
+        """Test stats computed in a single query"""
+        token = self.login_user('hr', 'hr123')
+        self.client.get('/api/tickets/stats/', headers=self.get_headers(token))
+        
+        with self.count_queries() as statements:
+            response = self.client.get('/api/tickets/stats/',
+                                     headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        
+        data = json.loads(response.data)
+        self.assertEqual(data['total_tickets'], 4)
+        self.assertEqual(data['open_tickets'], 2)
+        self.assertEqual(data['in_progress_tickets'], 1)
+        self.assertEqual(data['closed_tickets'], 1)
+        self.assertEqual(data['unassigned_tickets'], 2)
+        self.assertEqual(data['high_priority_tickets'], 1)
+        self.assertEqual(data['urgent_tickets'], 2)
+        self.assertEqual(data['tickets_by_category'], {'IT Support': 2, 'HR': 2})
+    
+    def test_ticket_stats_filters(self):
+        """Test date range and category filters"""
+        token = self.login_user('hr', 'hr123')
+        
+        response = self.client.get('/api/tickets/stats/?date_from=2024-02-01&date_to=2024-02-20&category=HR',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total_tickets'], 1)
+        self.assertEqual(data['in_progress_tickets'], 1)
+        self.assertEqual(data['tickets_by_category'], {'HR': 1})
+    
+    def test_ticket_stats_employee_forbidden(self):
+        """Test that employees cannot view stats"""
+        token = self.login_user('employee', 'emp123')
+        
+        response = self.client.get('/api/tickets/stats/',
+                                 headers=self.get_headers(token))
+        self.assertEqual(response.status_code, 403)
+
+
 if __name__ == '__main__':
     unittest.main()
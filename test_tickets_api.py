@@ -65,7 +65,7 @@ def test_list_tickets(token):
         response = requests.get(f"{API_URL}/tickets/", headers=headers)
         
         if response.status_code == 200:
-            tickets = response.json()
+            tickets = response.json()['tickets']
             print(f"✓ Retrieved {len(tickets)} tickets")
             return tickets
         else:
@@ -0,0 +1,203 @@
+import csv
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import or_
+from werkzeug.security import generate_password_hash
+from app import db
+from models import User
+from utils import forget_principals
+from rollups import move_department_rollups
+
+# Users validated, hashed and inserted per transaction
+PROVISION_BATCH_SIZE = 500
+# Row errors kept in the report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+# Below this many passwords a batch is hashed inline rather than in the pool
+MIN_PARALLEL_HASHES = 8
+
+REQUIRED_FIELDS = ('username', 'email', 'password', 'first_name', 'last_name', 'employee_id')
+VALID_ROLES = ('employee', 'hr', 'admin')
+# Columns a bulk update may set
+BULK_UPDATE_FIELDS = ('department', 'role', 'is_active')
+
+def read_user_records(stream, fmt):
+    """Yield (line, record) pairs from an NDJSON or CSV text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, {key.strip().lower(): (value or '').strip()
+                                    for key, value in record.items() if key}
+        return
+
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError:
+            yield line, None
+            continue
+        yield line, record if isinstance(record, dict) else None
+
+def _validate(record):
+    if record is None:
+        raise ValueError('Invalid record')
+    for field in REQUIRED_FIELDS:
+        if not record.get(field):
+            raise ValueError(f'{field} is required')
+    role = record.get('role') or 'employee'
+    if role not in VALID_ROLES:
+        raise ValueError(f"Invalid role {role!r}")
+    return {
+        'username': str(record['username']),
+        'email': str(record['email']),
+        'password': str(record['password']),
+        'first_name': str(record['first_name']),
+        'last_name': str(record['last_name']),
+        'employee_id': str(record['employee_id']),
+        'department': record.get('department') or '',
+        'position': record.get('position') or '',
+        'role': role
+    }
+
+def _find_duplicates(batch):
+    """Return {(field, value)} already taken, using one IN query for the batch"""
+    usernames = [record['username'] for _, record in batch]
+    emails = [record['email'] for _, record in batch]
+    employee_ids = [record['employee_id'] for _, record in batch]
+
+    taken = set()
+    for username, email, employee_id in db.session.query(User.username, User.email, User.employee_id)\
+            .filter(or_(User.username.in_(usernames), User.email.in_(emails),
+                        User.employee_id.in_(employee_ids))):
+        taken.update({('username', username), ('email', email), ('employee_id', employee_id)})
+    return taken
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+def _get_hash_pool(workers):
+    """Return the process pool shared by every provisioning request.
+
+    Created on first use and sized once. Workers are spawned, not forked:
+    a fork of a gevent worker carries its hub and patched threading into
+    the child.
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _hash_pool
+
+def hash_passwords(passwords):
+    """Hash a batch of passwords, in the shared pool when it is worth it"""
+    workers = current_app.config.get('BULK_HASH_WORKERS') or 1
+    if workers <= 1 or len(passwords) < MIN_PARALLEL_HASHES:
+        return [generate_password_hash(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(_get_hash_pool(workers).map(generate_password_hash, passwords, chunksize=chunksize))
+
+def _insert_batch(batch, report):
+    taken = _find_duplicates(batch)
+
+    accepted = []
+    for line, record in batch:
+        duplicate = next((field for field in ('username', 'email', 'employee_id')
+                          if (field, record[field]) in taken), None)
+        if duplicate:
+            _add_error(report, line, f"{duplicate.replace('_', ' ').capitalize()} already exists")
+            continue
+        # Later rows in the same upload cannot reuse these values either
+        taken.update({('username', record['username']), ('email', record['email']),
+                      ('employee_id', record['employee_id'])})
+        accepted.append(record)
+
+    if not accepted:
+        return
+
+    hashes = hash_passwords([record.pop('password') for record in accepted])
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User), [
+        {**record, 'password_hash': password_hash, 'is_active': True, 'auth_version': 0,
+         'hire_date': now.date(), 'created_at': now, 'updated_at': now}
+        for record, password_hash in zip(accepted, hashes)
+    ])
+    db.session.commit()
+    report['created'] += len(accepted)
+
+def _add_error(report, line, error):
+    report['error_count'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line, 'error': error})
+
+def provision_users(records, batch_size=PROVISION_BATCH_SIZE):
+    """Create users from (line, record) pairs in batches.
+
+    Each batch is checked for existing username/email/employee_id with a
+    single query, its passwords are hashed in the shared process pool, and it is
+    inserted with one executemany and committed. Invalid or duplicate
+    records are reported by line and skipped.
+    """
+    report = {'processed': 0, 'created': 0, 'error_count': 0, 'errors': []}
+
+    batch = []
+    for line, record in records:
+        report['processed'] += 1
+        try:
+            batch.append((line, _validate(record)))
+        except ValueError as e:
+            _add_error(report, line, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            _insert_batch(batch, report)
+            batch = []
+
+    if batch:
+        _insert_batch(batch, report)
+
+    logging.info(f"Bulk user provisioning: {report['processed']} records, {report['created']} created, "
+                 f"{report['error_count']} errors")
+    return report
+
+def bulk_update_users(user_ids, changes):
+    """Apply department/role/is_active changes to many users in one UPDATE.
+
+    Role and status changes bump auth_version in the same statement so
+    tokens issued before the change stop resolving; cached principals are
+    dropped on any change so a new department applies at once, and the
+    attendance rollups move with it. Returns the
+    number of rows updated.
+    """
+    values = {name: changes[name] for name in BULK_UPDATE_FIELDS if name in changes}
+    if 'role' in values and values['role'] not in VALID_ROLES:
+        raise ValueError(f"Invalid role {values['role']!r}")
+    if 'is_active' in values and not isinstance(values['is_active'], bool):
+        raise ValueError('is_active must be true or false')
+    if not values:
+        raise ValueError(f"No changes given. Allowed fields: {', '.join(BULK_UPDATE_FIELDS)}")
+
+    if 'department' in values:
+        move_department_rollups(user_ids, values['department'])
+
+    revoke_tokens = 'role' in values or 'is_active' in values
+    if revoke_tokens:
+        values['auth_version'] = User.auth_version + 1
+    values['updated_at'] = datetime.utcnow()
+    # Outstanding If-Match tokens for these users are stale now
+    values['version'] = User.version + 1
+
+    result = db.session.execute(
+        db.update(User).where(User.id.in_(user_ids)).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    forget_principals(user_ids)
+    return result.rowcount
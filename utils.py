@@ -1,14 +1,142 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from datetime import date, datetime, timezone
 from functools import wraps
-from flask import jsonify
-from flask_jwt_extended import get_jwt_identity
+from flask import jsonify, g, current_app, request, make_response
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import Date, DateTime, func, tuple_
+from sqlalchemy.engine import Row
+from app import db
 from models import User
 
+# Upper bound on cached principal states per worker
+PRINCIPAL_CACHE_MAX_SIZE = 10000
+
+_principal_lock = threading.Lock()
+
+class Principal:
+    """Authenticated caller resolved from the JWT claims.
+    
+    Carries the fields views need for authorization checks so that most
+    requests never load the full User row. The row is still available
+    lazily through ``principal.user`` for views that render it.
+    Department and employee ID come from the database (through the auth
+    state cache) rather than the token, since users can change them
+    without being issued a new one.
+    """
+    
+    __slots__ = ('id', 'role', 'employee_id', 'department', 'auth_version', '_user')
+    
+    def __init__(self, id, role, employee_id, department, auth_version, user=None):
+        self.id = id
+        self.role = role
+        self.employee_id = employee_id
+        self.department = department
+        self.auth_version = auth_version
+        self._user = user
+    
+    @property
+    def user(self):
+        """Full User row for the principal, loaded on first access"""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+    
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.role, user.employee_id, user.department,
+                   user.auth_version or 0, user=user)
+
+def principal_claims(user):
+    """Additional JWT claims describing the user's authorization state"""
+    return {
+        'role': user.role,
+        'ver': user.auth_version or 0
+    }
+
+def _principal_cache():
+    return current_app.extensions.setdefault('principal_cache', {})
+
+def _get_auth_state(user_id):
+    """Return (auth_version, is_active, employee_id, department) for a user,
+    cached for a short TTL"""
+    cache = _principal_cache()
+    now = time.monotonic()
+    
+    with _principal_lock:
+        entry = cache.get(user_id)
+    if entry and entry[-1] > now:
+        return entry[:-1]
+    
+    row = db.session.query(User.auth_version, User.is_active, User.employee_id, User.department)\
+        .filter(User.id == user_id).first()
+    if row is None:
+        return None
+    
+    state = (row.auth_version or 0, row.is_active, row.employee_id, row.department)
+    ttl = current_app.config.get('PRINCIPAL_CACHE_TTL', 30)
+    with _principal_lock:
+        if len(cache) >= PRINCIPAL_CACHE_MAX_SIZE:
+            cache.clear()
+        cache[user_id] = state + (now + ttl,)
+    return state
+
+def get_current_principal():
+    """Resolve the principal for the current request.
+    
+    Returns None when the user no longer exists, has been deactivated, or
+    the token was issued before the user's role or status changed.
+    """
+    if 'principal' in g:
+        return g.principal
+    
+    user_id = int(get_jwt_identity())
+    claims = get_jwt()
+    principal = None
+    
+    if 'ver' not in claims:
+        # Tokens issued before claims were added carry only the identity
+        user = db.session.get(User, user_id)
+        if user and user.is_active is not False:
+            principal = Principal.from_user(user)
+    else:
+        state = _get_auth_state(user_id)
+        if state is not None:
+            auth_version, is_active, employee_id, department = state
+            if is_active is not False and auth_version == claims['ver']:
+                principal = Principal(user_id, claims.get('role'), employee_id, department, auth_version)
+    
+    g.principal = principal
+    return principal
+
+def principal_is_current(user_id, auth_version):
+    """Whether a principal resolved at ``auth_version`` still holds: the user
+    exists, is active and has had no tokens revoked since"""
+    state = _get_auth_state(user_id)
+    return state is not None and state[1] is not False and state[0] == auth_version
+
+def invalidate_principal(user):
+    """Bump the user's auth version so previously issued tokens stop
+    resolving. Callers commit, then call ``forget_principals`` so no
+    request re-caches the old state in between."""
+    user.auth_version = (user.auth_version or 0) + 1
+
+def forget_principals(user_ids):
+    """Drop cached auth state after auth_version, department or employee ID
+    changed in an UPDATE"""
+    with _principal_lock:
+        cache = _principal_cache()
+        for user_id in user_ids:
+            cache.pop(user_id, None)
+
 def admin_required(f):
     """Decorator to require admin role"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['admin']:
             return jsonify({'error': 'Admin access required'}), 403
@@ -21,8 +149,7 @@ def hr_required(f):
     """Decorator to require HR or admin role"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'HR access required'}), 403
@@ -51,26 +178,222 @@ def validate_json_data(required_fields):
         return decorated_function
     return decorator
 
-def paginate_query(query, page, per_page):
-    """Helper function to paginate query results"""
-    try:
-        page = int(page) if page else 1
-        per_page = int(per_page) if per_page else 10
+class PageResult:
+    """One page of a listing, produced by paginate_query"""
+    
+    def __init__(self, items, per_page, page=None, total=None, pages=None, next_cursor=None, keyset=False):
+        self.items = items
+        self.per_page = per_page
+        self.page = page
+        self.total = total
+        self.pages = pages
+        self.next_cursor = next_cursor
+        self.keyset = keyset
+    
+    def meta(self):
+        """Pagination fields to merge into the JSON response"""
+        if self.keyset:
+            meta = {'next_cursor': self.next_cursor, 'per_page': self.per_page}
+            if self.total is not None:
+                meta['total'] = self.total
+            return meta
         
-        # Limit per_page to prevent abuse
-        per_page = min(per_page, 100)
+        return {
+            'total': self.total,
+            'pages': self.pages,
+            'current_page': self.page,
+            'per_page': self.per_page
+        }
+
+def _row_entity(item):
+    """The mapped entity of a result row (first column for multi-entity queries)"""
+    return item[0] if isinstance(item, Row) else item
+
+def encode_cursor(values):
+    """Encode sort key values into an opaque URL-safe cursor"""
+    payload = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_keys):
+    """Decode a cursor back into typed sort key values"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    
+    if not isinstance(payload, list) or len(payload) != len(sort_keys):
+        raise ValueError('Invalid cursor')
+    
+    values = []
+    for column, value in zip(sort_keys, payload):
+        try:
+            if isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif isinstance(column.type, Date):
+                value = date.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        values.append(value)
+    return values
+
+def paginate_query(query, sort_keys, args, default_per_page=10, max_per_page=100):
+    """Paginate a listing query ordered by ``sort_keys``, all descending.
+    
+    Offset mode (``page``) keeps the classic page/total response. Passing
+    ``cursor`` (empty for the first page) switches to keyset mode, which
+    seeks past the last row of the previous page instead of scanning an
+    OFFSET and returns ``next_cursor``. The COUNT(*) is skipped when
+    ``include_total=false``, and is opt-in (``include_total=true``) in
+    keyset mode.
+    
+    The last sort key must be unique (normally the primary key).
+    Raises ValueError for invalid paging parameters.
+    """
+    try:
+        per_page = int(args.get('per_page', default_per_page))
+        page = int(args.get('page', 1))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid page or per_page parameter')
+    
+    per_page = max(1, min(max_per_page, per_page))
+    page = max(1, page)
+    keyset = 'cursor' in args
+    include_total = args.get('include_total', 'false' if keyset else 'true').lower() == 'true'
+    
+    ordered = query.order_by(*[column.desc() for column in sort_keys])
+    
+    if not keyset:
+        result = ordered.paginate(page=page, per_page=per_page, error_out=False, count=include_total)
+        return PageResult(
+            result.items,
+            per_page,
+            page=page,
+            total=result.total,
+            pages=result.pages if include_total else None
+        )
+    
+    total = query.order_by(None).count() if include_total else None
+    
+    cursor = args.get('cursor')
+    if cursor:
+        values = decode_cursor(cursor, sort_keys)
+        ordered = ordered.filter(tuple_(*sort_keys) < tuple_(*values))
+    
+    # Fetch one extra row to learn whether another page exists
+    items = ordered.limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = _row_entity(items[-1])
+        next_cursor = encode_cursor([getattr(last, column.key) for column in sort_keys])
+    
+    return PageResult(items, per_page, total=total, next_cursor=next_cursor, keyset=True)
+
+def version_freshness(query, model):
+    """Validator for one versioned record; the version is used as a strong
+    ETag, the same one update endpoints accept in If-Match"""
+    return query.order_by(None).with_entities(
+        func.max(model.version).label('version'), func.max(model.updated_at), func.count()
+    )
+
+def freshness(query, *timestamp_columns):
+    """Reduce a listing query to (max of each timestamp column, row count),
+    the validator shape expected by conditional_get"""
+    return query.order_by(None).with_entities(*[func.max(column) for column in timestamp_columns], func.count())
+
+def conditional_get(validator):
+    """Decorator answering conditional GETs before the view runs.
+    
+    ``validator(principal, **view_kwargs)`` returns a ``freshness`` query
+    over the rows the response is built from. Its values, the principal's
+    id and role and the request path hash into a weak ETag (a
+    ``version_freshness`` query supplies a strong one instead), and the
+    latest timestamp becomes Last-Modified. A matching If-None-Match (or, when
+    none is sent, a satisfied If-Modified-Since) gets a 304 without the
+    view fetching or serializing any rows.
+    
+    The view runs as usual when there is no principal, when no rows match
+    or when the validator raises ValueError for bad parameters, so error
+    responses always come from the view. Must be applied below
+    jwt_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            principal = get_current_principal()
+            if not principal:
+                return f(*args, **kwargs)
+            
+            try:
+                row = validator(principal, **kwargs).one()
+            except ValueError:
+                return f(*args, **kwargs)
+            values = tuple(row)
+            if not values[-1]:
+                return f(*args, **kwargs)
+            
+            if 'version' in row._fields:
+                etag, weak = str(row.version), False
+            else:
+                scope = (values, principal.id, principal.role, request.full_path)
+                etag, weak = hashlib.sha1(repr(scope).encode()).hexdigest(), True
+            timestamps = [value for value in values if isinstance(value, datetime)]
+            # HTTP dates have one-second resolution
+            last_modified = max(timestamps).replace(microsecond=0, tzinfo=timezone.utc) if timestamps else None
+            
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = bool(last_modified and request.if_modified_since
+                                    and last_modified <= request.if_modified_since)
+            
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag, weak=weak)
+            if last_modified:
+                response.last_modified = last_modified
+            # Let browsers keep the payload but revalidate it on every use
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Authorization')
+            return response
         
-        return query.paginate(page=page, per_page=per_page, error_out=False)
+        return decorated_function
+    return decorator
+
+def record_etag(record):
+    """Strong ETag for a record of a model with a version_id_col"""
+    return str(record.version)
+
+def versioned_response(record, data=None, status=200):
+    """JSON response for a versioned record carrying its ETag"""
+    response = jsonify(record.to_dict() if data is None else data)
+    response.status_code = status
+    response.set_etag(record_etag(record))
+    return response
+
+def if_match_fails(record):
+    """True when the request's If-Match does not name the record's current version.
     
-    except ValueError:
-        return None
+    Requests without If-Match pass; the versioned UPDATE still fails with
+    StaleDataError if the row changed after it was loaded.
+    """
+    return bool(request.if_match) and not request.if_match.contains(record_etag(record))
+
+def precondition_failed():
+    """412 response for an update made against a stale version"""
+    return jsonify({'error': 'Record was modified by another request. Reload it and try again'}), 412
 
 def hr_or_admin_required(f):
     """Decorator to require HR or admin role"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_principal()
         
         if not user or user.role not in ['hr', 'admin']:
             return jsonify({'error': 'HR or admin access required'}), 403